@@ -0,0 +1,157 @@
+"""
+聚类模型再训练 - 用数据库中的真实数据增量更新异常检测基线
+
+从 sensor_data 按 id 分块流式读取（整表不会读入内存），每块调用一次 MiniBatchKMeans.partial_fit
+（去掉缺失读数后不足聚类数的块并入相邻批次），初始中心取当前使用中的聚类模型，训练结果随实际设备环境逐步偏移。
+
+每次训练保存为带版本号的模型 ai_models/cluster_model_v<N>.pkl（附 .json 训练信息），
+再原子替换 cluster_model.pkl 并重新导出编译模型；分析器按文件修改时间自动加载新模型。
+"""
+import os, sys
+import argparse
+import glob
+import json
+import re
+import shutil
+import time
+import numpy as np
+import joblib
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+shared_dir = os.path.join(current_dir, '..', 'shared')
+sys.path.insert(0, shared_dir)
+sys.path.insert(0, current_dir)
+from database import DatabaseManager
+from compiled_model import export_compiled_model
+
+MODELS_DIR = os.path.join(current_dir, "ai_models")
+CHUNK_SIZE = 10000        # 每块读取的行数，即每次 partial_fit 的样本数
+KEEP_VERSIONS = 10        # 保留的历史版本数
+
+_VERSION_PATTERN = re.compile(r'cluster_model_v(\d+)\.pkl$')
+
+
+def list_cluster_versions(models_dir=MODELS_DIR):
+    """已保存的版本号（升序）"""
+    versions = []
+    for path in glob.glob(os.path.join(models_dir, "cluster_model_v*.pkl")):
+        match = _VERSION_PATTERN.search(path)
+        if match:
+            versions.append(int(match.group(1)))
+    return sorted(versions)
+
+
+def _version_path(models_dir, version, suffix=".pkl"):
+    return os.path.join(models_dir, f"cluster_model_v{version}{suffix}")
+
+
+def _atomic_copy(source, target):
+    """先复制到临时文件再替换，读取方不会看到写了一半的模型"""
+    tmp_path = target + ".tmp"
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def retrain_cluster(db_path=None, models_dir=MODELS_DIR, chunk_size=CHUNK_SIZE, since=None,
+                    keep_versions=KEEP_VERSIONS, activate=True):
+    """流式再训练聚类模型，返回训练信息；数据不足一个批次（少于聚类数）时返回 None"""
+    from sklearn.cluster import MiniBatchKMeans
+
+    active_path = os.path.join(models_dir, "cluster_model.pkl")
+    current = joblib.load(active_path)
+    n_clusters = len(current.cluster_centers_)
+    if chunk_size < n_clusters:
+        raise ValueError(f"chunk_size 不能小于聚类数 {n_clusters}: {chunk_size}")
+
+    model = MiniBatchKMeans(n_clusters=n_clusters, init=np.asarray(current.cluster_centers_),
+                            n_init=1, random_state=42)
+    start = time.perf_counter()
+    rows = chunks = 0
+    # 待训练的批次：推迟一块再训练，不足聚类数的块（含末尾的块）并入其中，不单独 partial_fit
+    pending = np.empty((0, 3))
+    with DatabaseManager(db_path=db_path) as db:
+        for chunk in db.iter_sensor_chunks(chunk_size, since=since):
+            X = np.array([row[2:5] for row in chunk], dtype=np.float64).reshape(-1, 3)
+            X = X[~np.isnan(X).any(axis=1)]  # 缺失读数（NULL）不参与训练
+            if len(X) == 0:
+                continue
+            if len(pending) >= n_clusters and len(X) >= n_clusters:
+                model.partial_fit(pending)
+                rows += len(pending)
+                chunks += 1
+                pending = X
+            else:
+                pending = np.concatenate([pending, X])
+    if len(pending) >= n_clusters:
+        model.partial_fit(pending)
+        rows += len(pending)
+        chunks += 1
+
+    if chunks == 0:
+        print(f"⚠️ 可用数据不足 {n_clusters} 条，保留当前聚类模型")
+        return None
+
+    versions = list_cluster_versions(models_dir)
+    version = versions[-1] + 1 if versions else 1
+    info = {
+        'version': version,
+        'rows': rows,
+        'chunks': chunks,
+        'since': since,
+        'trained_at': int(time.time()),
+        'seconds': round(time.perf_counter() - start, 3),
+        'previous_centers': np.asarray(current.cluster_centers_).round(3).tolist(),
+        'centers': model.cluster_centers_.round(3).tolist(),
+    }
+    version_path = _version_path(models_dir, version)
+    joblib.dump(model, version_path)
+    with open(_version_path(models_dir, version, ".json"), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+    for old in versions[:max(0, len(versions) + 1 - keep_versions)]:
+        for suffix in (".pkl", ".json"):
+            path = _version_path(models_dir, old, suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    if activate:
+        activate_cluster_version(version, models_dir)
+    print(f"✅ 聚类模型 v{version}：{rows} 条数据，{chunks} 个批次，耗时 {info['seconds']}s")
+    return info
+
+
+def activate_cluster_version(version, models_dir=MODELS_DIR):
+    """把指定版本设为当前聚类模型（也用于回滚），并重新导出编译模型"""
+    version_path = _version_path(models_dir, version)
+    if not os.path.exists(version_path):
+        raise FileNotFoundError(f"聚类模型版本不存在: {version_path}")
+    _atomic_copy(version_path, os.path.join(models_dir, "cluster_model.pkl"))
+
+    # 编译模型内含聚类中心，需要与新的聚类模型一起更新
+    compiled_path = os.path.join(models_dir, "compiled_model.joblib")
+    forest_path = os.path.join(models_dir, "environment_model.pkl")
+    if os.path.exists(compiled_path) and os.path.exists(forest_path):
+        tmp_path = compiled_path + ".tmp"
+        export_compiled_model(joblib.load(forest_path), joblib.load(version_path), tmp_path)
+        os.replace(tmp_path, compiled_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IoT环境监测 - 用真实数据再训练聚类模型")
+    parser.add_argument("--db", default=None, help="数据库路径（默认 shared/sensor_data.db）")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="每批读取和训练的行数")
+    parser.add_argument("--hours", type=int, default=None, help="只使用最近N小时的数据（默认全部）")
+    parser.add_argument("--activate", type=int, default=None, metavar="VERSION",
+                        help="不训练，直接切换到指定版本（回滚）")
+    args = parser.parse_args()
+
+    if args.activate is not None:
+        activate_cluster_version(args.activate)
+        print(f"✅ 已切换到聚类模型 v{args.activate}")
+        return
+    since = int(time.time()) - args.hours * 3600 if args.hours is not None else None
+    retrain_cluster(db_path=args.db, chunk_size=args.chunk_size, since=since)
+
+
+if __name__ == "__main__":
+    main()
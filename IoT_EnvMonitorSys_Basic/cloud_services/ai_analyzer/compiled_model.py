@@ -0,0 +1,149 @@
+"""
+编译推理引擎 - 不依赖sklearn的随机森林分类和KMeans异常检测
+
+compile_models 把每棵决策树编译为紧凑的扁平节点数组（特征、阈值、左右子节点、叶子概率），
+全部树首尾相接存放，大小与节点总数成正比；推理时所有树、整批样本同时向下走一层，
+已到达叶子的从待处理集合中移除，最多走 max_depth 步，不需要逐样本、逐树的Python循环。
+
+CompiledModel 提供与sklearn模型相同的 predict_proba / classes_ / cluster_centers_：
+特征先转换为 float32 再与 float64 阈值比较，各树概率按树的顺序累加后取平均，结果与sklearn逐位相同。
+"""
+import os
+import numpy as np
+import joblib
+
+FORMAT_VERSION = 2
+N_FEATURES = 3               # 温度、湿度、空气质量
+PREDICT_CHUNK_SIZE = 1024    # 单次处理的样本数，(树数 x 样本数) 的节点数组保持在缓存友好的大小
+MAX_NODES = np.iinfo(np.int32).max   # 节点序号用 int32 存放
+
+
+def _compile_tree(tree, n_classes, offset):
+    """把一棵决策树编译为扁平节点数组，子节点序号加上 offset（该树在整体数组中的起始位置）
+
+    叶子节点的左右子节点都指向自身、特征取0：遍历到叶子后停留不动，不需要额外判断
+    """
+    nodes = np.arange(tree.node_count)
+    leaf = tree.children_left == -1
+    left = np.where(leaf, nodes, tree.children_left) + offset
+    right = np.where(leaf, nodes, tree.children_right) + offset
+    # 与 DecisionTreeClassifier.predict_proba 相同：取单输出的前 n_classes 列
+    return {
+        'feature': np.where(leaf, 0, tree.feature).astype(np.int8),
+        'threshold': tree.threshold.astype(np.float64),
+        'left': left.astype(np.int32),
+        'right': right.astype(np.int32),
+        'value': tree.value[:, 0, :n_classes].astype(np.float64),
+    }
+
+
+def compile_models(forest, kmeans):
+    """将随机森林和KMeans编译为数组字典（导出时需要sklearn模型对象，推理时不需要）
+
+    节点总数超过 int32 范围时抛出 ValueError（RealAIAnalyzer 在 engine='auto' 时改用sklearn模型）
+    """
+    node_counts = np.array([e.tree_.node_count for e in forest.estimators_], dtype=np.int64)
+    if node_counts.sum() > MAX_NODES:
+        raise ValueError(f"随机森林共 {node_counts.sum()} 个节点，超出编译模型的 int32 节点序号范围")
+    roots = np.cumsum(node_counts) - node_counts
+
+    compiled = [_compile_tree(e.tree_, forest.n_classes_, int(root))
+                for e, root in zip(forest.estimators_, roots)]
+    arrays = {key: np.concatenate([c[key] for c in compiled]) for key in compiled[0]}
+    arrays.update({
+        'format_version': FORMAT_VERSION,
+        'roots': roots.astype(np.int32),
+        'max_depth': max(e.tree_.max_depth for e in forest.estimators_),
+        'classes': np.asarray(forest.classes_),
+        'centers': np.asarray(kmeans.cluster_centers_, dtype=np.float64),
+    })
+    return arrays
+
+
+def export_compiled_model(forest, kmeans, path):
+    """导出编译模型文件（未压缩，支持 mmap_mode 加载）"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    joblib.dump(compile_models(forest, kmeans), path)
+
+
+class CompiledModel:
+    """纯NumPy批量推理：同时充当分类模型（predict_proba/classes_）和聚类模型（cluster_centers_）"""
+
+    def __init__(self, arrays):
+        if arrays.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"不支持的编译模型版本: {arrays.get('format_version')}")
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.max_depth = arrays['max_depth']
+        self.classes_ = arrays['classes']
+        self.cluster_centers_ = arrays['centers']
+        self.n_estimators = len(self.roots)
+        # 推理用的派生数组：children[2 * 节点 + 是否走右边] 为下一个节点
+        self._feature = np.asarray(self.feature, dtype=np.intp)
+        self._children = np.stack([self.left, self.right], axis=1).ravel().astype(np.intp)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        return cls(joblib.load(path, mmap_mode=mmap_mode))
+
+    def predict_proba(self, X):
+        """各类别概率，shape (样本数, 类别数)"""
+        # sklearn 预测前把特征转换为 float32，再与 float64 阈值比较
+        X = np.asarray(X, dtype=np.float32).reshape(-1, N_FEATURES).astype(np.float64)
+        proba = np.empty((len(X), len(self.classes_)), dtype=np.float64)
+        for start in range(0, len(X), PREDICT_CHUNK_SIZE):
+            chunk = X[start:start + PREDICT_CHUNK_SIZE]
+            proba[start:start + len(chunk)] = self._predict_chunk(chunk)
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def _predict_chunk(self, X):
+        # 所有树、全部样本同时下降：node 按 (树, 样本) 展平，pending 为尚未到达叶子的位置
+        n = len(X)
+        flat_X = np.ascontiguousarray(X).ravel()
+        node = np.repeat(self.roots.astype(np.intp), n)
+        pending = np.arange(node.size)
+        current = node.copy()
+        row = np.tile(np.arange(0, N_FEATURES * n, N_FEATURES), self.n_estimators)  # 样本在 flat_X 中的起点
+        for _ in range(self.max_depth):
+            # 与sklearn相同按 x <= 阈值 判断走左边（NaN 走右边）
+            go_right = ~(np.take(flat_X, row + np.take(self._feature, current)) <= np.take(self.threshold, current))
+            child = np.take(self._children, 2 * current + go_right)
+            node[pending] = child
+            moved = child != current   # 叶子的子节点指向自身
+            pending, current, row = pending[moved], child[moved], row[moved]
+            if not len(pending):
+                break
+        node = node.reshape(self.n_estimators, n)
+
+        # 沿第0轴（树）归约是按树的顺序逐个相加，与 RandomForestClassifier.predict_proba 的累加顺序一致
+        proba = np.add.reduce(np.take(self.value, node, axis=0), axis=0)
+        proba /= self.n_estimators
+        return proba
+
+
+if __name__ == "__main__":
+    # 从 ai_models/ 下的sklearn模型导出编译模型
+    import time
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    models_dir = os.path.join(current_dir, "ai_models")
+    output = os.path.join(models_dir, "compiled_model.joblib")
+
+    forest = joblib.load(os.path.join(models_dir, "environment_model.pkl"))
+    kmeans = joblib.load(os.path.join(models_dir, "cluster_model.pkl"))
+    export_compiled_model(forest, kmeans, output)
+
+    X = np.random.default_rng(0).normal((22, 55, 80), (10, 20, 25), size=(10000, 3))
+    model = CompiledModel.load(output, mmap_mode='r')
+    start = time.perf_counter()
+    proba = model.predict_proba(X)
+    elapsed = time.perf_counter() - start
+    same = np.array_equal(proba, forest.predict_proba(X))
+    print(f"✅ 已导出 {output}（{model.n_estimators}棵树，{len(model.left)}个节点），与sklearn结果一致: {same}")
+    print(f"⏱️ 10000条批量推理耗时 {elapsed:.3f}s")
@@ -1,44 +1,129 @@
 import sys
 import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 # 添加shared目录到Python路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
 shared_dir = os.path.join(current_dir, '..', 'shared')
 sys.path.insert(0, shared_dir)
+sys.path.insert(0, current_dir)
 
 from real_ai_analyzer import RealAIAnalyzer
-from database import DatabaseManager
+from database import DatabaseManager, SENSOR_DTYPE
 
+# 每个工作进程只创建一次的分析器和数据库连接
+_worker = {}
 
-def main():
-    db = DatabaseManager()
-    ai_analyzer = RealAIAnalyzer()
-    
-    # 获取设备数据
+
+def _init_worker(db_path):
+    """工作进程初始化：加载一次模型（已由主进程加载时直接复用），打开一次数据库"""
+    _worker['db'] = DatabaseManager(db_path=db_path)
+    _worker['ai'] = RealAIAnalyzer()
+
+
+def _analyze_devices(device_ids, hours, limit, incremental=True):
+    """分析一组设备的数据，返回 (分析记录, 读取条数, 新高水位)
+
+    增量模式下只读取每台设备高水位之后的新数据（首次分析的设备取最近时间窗口）；
+    整组设备的数据合并后只做一次批量推理；结果交给主进程统一写库，避免多进程争用写锁
+    """
+    db, ai = _worker['db'], _worker['ai']
+    marks = db.get_high_water_marks(device_ids) if incremental else {}
+
+    # 数据以结构化数组读取，整组拼接后直接按列送入模型，不逐行创建字典
+    batch_devices, arrays, new_marks = [], [], {}
+    for device_id in device_ids:
+        if device_id in marks:
+            data = db.get_new_data_array(device_id, marks[device_id], limit)
+        else:
+            # 最近窗口按时间倒序返回，翻转为时间顺序，分析结果按读数先后写入
+            data = db.get_recent_array(device_id, hours=hours, limit=limit)[::-1]
+        if len(data) and incremental:
+            new_marks[device_id] = int(data['id'].max())
+        batch_devices.extend([device_id] * len(data))
+        arrays.append(data)
+
+    records = np.concatenate(arrays) if arrays else np.empty(0, dtype=SENSOR_DTYPE)
+    if not len(records):
+        return [], 0, new_marks
+
+    batch = ai.analyze_batch(batch_devices, records)
+    rows = ai.build_analysis_rows(batch, records['id'].tolist())
+    return rows, len(records), new_marks
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def run_fleet_analysis(db_path=None, workers=None, hours=24, limit=50, chunk_size=64, incremental=True):
+    """全量设备分析：按设备分片到进程池，返回运行统计
+
+    incremental=True 时每轮只分析上次之后的新数据（每台设备每轮最多 limit 条），
+    分析结果与高水位在同一事务中保存
+    """
+    start = time.perf_counter()
+
+    db = DatabaseManager(db_path=db_path)
     devices = db.get_all_devices()
-    if not devices:
+
+    readings = saved = 0
+    shards = list(_chunks(devices, chunk_size))
+    if workers == 1:
+        # 单进程模式：便于调试，省去进程池开销
+        _init_worker(db_path)
+        results = (_analyze_devices(shard, hours, limit, incremental) for shard in shards)
+        for rows, count, marks in results:
+            readings += count
+            saved += db.save_analysis_batch(rows, marks)
+    else:
+        # 主进程先加载一次模型（只读内存映射）：fork 启动的工作进程直接继承，不再各自加载
+        RealAIAnalyzer(mmap_mode='r')
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(db_path,)) as executor:
+            futures = [executor.submit(_analyze_devices, shard, hours, limit, incremental) for shard in shards]
+            for future in futures:
+                rows, count, marks = future.result()
+                readings += count
+                saved += db.save_analysis_batch(rows, marks)
+    db.close()
+
+    elapsed = time.perf_counter() - start
+    return {
+        'devices': len(devices),
+        'readings': readings,
+        'saved': saved,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(readings / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IoT环境监测 - 全量设备AI分析")
+    parser.add_argument("--db", default=None, help="数据库路径（默认 shared/sensor_data.db）")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数（默认CPU核数）")
+    parser.add_argument("--hours", type=int, default=24, help="分析最近多少小时的数据")
+    parser.add_argument("--limit", type=int, default=50, help="每台设备每轮最多分析多少条")
+    parser.add_argument("--chunk-size", type=int, default=64, help="每个任务包含的设备数")
+    parser.add_argument("--full", action="store_true", help="忽略高水位，重新分析最近时间窗口")
+    args = parser.parse_args()
+
+    stats = run_fleet_analysis(args.db, args.workers, args.hours, args.limit, args.chunk_size,
+                               incremental=not args.full)
+
+    if not stats['devices']:
         print("❌ 无设备数据")
         return
-    
-    device_id = devices[1]
-    recent_data = db.get_recent_data(device_id)
-    
-    if not recent_data:
-        print("❌ 该设备无数据")
-        return
-    
-    # AI分析
-    latest = recent_data[0]
-    result = ai_analyzer.analyze_with_ai(device_id, latest['temp'], latest['hum'], latest['air'])
-    
+
     # 输出结果
-    print(f"🎯 设备: {device_id}")
-    print(f"📊 数据: {latest['temp']}°C, {latest['hum']}%, {latest['air']}%")
-    print(f"🤖 分析: {result['environment_type']} (置信度: {result['prediction_confidence']}%)")
-    print("💡 建议:")
-    for suggestion in result['ai_suggestions']:
-        print(f"  • {suggestion}")
+    print(f"🎯 设备数: {stats['devices']}")
+    print(f"📊 分析数据: {stats['readings']} 条，保存结果: {stats['saved']} 条")
+    print(f"⏱️ 耗时: {stats['seconds']}s，吞吐: {stats['rows_per_sec']} 条/秒")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,19 +2,114 @@
 AI分析器 - 使用机器学习模型
 """
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.cluster import KMeans
 import joblib
+import functools
 import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from compiled_model import CompiledModel, compile_models
+
+# 推理引擎：compiled 为纯NumPy编译模型，sklearn 为原始模型，auto 使用编译模型（无法编译时使用sklearn模型）
+# 编译模型是由sklearn模型导出的生成文件（不纳入版本库），缺失、过期或格式版本不符时在首次加载时导出
+ENGINES = ('auto', 'compiled', 'sklearn')
+
+# 单条分析结果缓存：默认按读数原值缓存，结果与不缓存完全一致；
+# cache_decimals=1 时按保留1位小数的读数缓存（0.1以内的读数共用一份结果，适合按0.1上报的设备，命中率更高）
+ANALYSIS_CACHE_SIZE = 4096
+ANALYSIS_CACHE_DECIMALS = None
+# 检查模型文件是否被替换（如 cluster_retrainer 重新训练）的最小间隔（秒）
+MODEL_CHECK_INTERVAL = 1.0
+
+
+class ModelRegistry:
+    """进程级模型缓存：同一模型文件只加载一次，文件更新后自动重新加载
+
+    mmap_mode='r' 时模型中的大数组以只读内存映射方式加载，fork 出的工作进程共享同一份物理页；
+    sklearn 只在模型文件缺失需要训练时才导入（反序列化已保存的模型时由 pickle 按需导入）
+    """
+
+    def __init__(self, mmap_mode=None):
+        self.mmap_mode = mmap_mode
+        self._models = {}  # 文件路径 -> (修改时间, 模型)
+        self._lock = threading.RLock()  # 编译模型缺失时会在持锁期间加载sklearn模型
+        self.stats = {'loads': 0, 'trained': 0, 'hits': 0, 'load_seconds': 0.0}
+
+    def get(self, path, trainer=None, mmap_mode=None, wrapper=None):
+        """返回 path 对应的模型；文件不存在时调用 trainer() 训练并保存
+
+        wrapper 不为 None 时缓存并返回 wrapper(文件内容)（例如把数组字典包装为推理对象）
+        """
+        with self._lock:
+            mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            cached = self._models.get(path)
+            if cached is not None and cached[0] == mtime:
+                self.stats['hits'] += 1
+                return cached[1]
+
+            start = time.perf_counter()
+            if mtime is None:
+                if trainer is None:
+                    raise FileNotFoundError(f"模型文件不存在: {path}")
+                model = trainer()
+                joblib.dump(model, path)
+                mtime = os.path.getmtime(path)
+                self.stats['trained'] += 1
+            else:
+                model = joblib.load(path, mmap_mode=mmap_mode or self.mmap_mode)
+                self.stats['loads'] += 1
+            if wrapper is not None:
+                model = wrapper(model)
+            self.stats['load_seconds'] += time.perf_counter() - start
+
+            self._models[path] = (mtime, model)
+            return model
+
+    def version(self, path):
+        """当前缓存的 path 模型对应的文件修改时间（未加载时为 None）"""
+        with self._lock:
+            cached = self._models.get(path)
+            return cached[0] if cached is not None else None
+
+    def clear(self):
+        """清空缓存（下次获取时重新加载）"""
+        with self._lock:
+            self._models.clear()
+
+
+# 创建全局实例
+model_registry = ModelRegistry()
+
+# 合成训练数据的类别分布：(标签序号, 均值, 标准差, 样本数)，均值/标准差按 (温度, 湿度, 空气质量)
+TRAINING_CLASSES = (
+    (0, (22, 55, 85), (2, 10, 10), 200),   # 舒适
+    (1, (32, 40, 70), (3, 15, 15), 200),   # 炎热
+    (2, (5, 30, 90), (3, 10, 5), 200),     # 寒冷
+    (3, (25, 85, 60), (3, 5, 10), 200),    # 潮湿
+    (4, (24, 20, 80), (3, 5, 10), 100),    # 干燥
+    (5, (23, 50, 25), (3, 10, 10), 100),   # 空气质量差
+)
+
+# 正常环境数据分布（用于训练异常检测的聚类模型）
+NORMAL_MEAN = (22, 55, 80)
+NORMAL_STD = (5, 15, 15)
+
 
 class RealAIAnalyzer:
-    def __init__(self):
+    def __init__(self, mmap_mode=None, registry=None, engine='auto', cache_size=ANALYSIS_CACHE_SIZE,
+                 cache_decimals=ANALYSIS_CACHE_DECIMALS, models_dir=None, model_check_interval=MODEL_CHECK_INTERVAL):
+        if engine not in ENGINES:
+            raise ValueError(f"未知的推理引擎: {engine}，可选: {ENGINES}")
+        start = time.perf_counter()
         # 获取当前文件所在目录
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.models_dir = os.path.join(current_dir, "ai_models")
+        self.models_dir = models_dir or os.path.join(current_dir, "ai_models")
 
         self.model_path = os.path.join(self.models_dir, "environment_model.pkl")
         self.cluster_path = os.path.join(self.models_dir, "cluster_model.pkl")
+        self.compiled_path = os.path.join(self.models_dir, "compiled_model.joblib")
         
         # # 创建多级目录，且目录已存在时不报错
         os.makedirs(self.models_dir, exist_ok=True)
@@ -23,117 +118,142 @@ class RealAIAnalyzer:
         # self.cluster_path = "ai_models/cluster_model.pkl"
         self.labels = ['舒适', '炎热', '寒冷', '潮湿', '干燥', '空气质量差']
         
+        # 模型由进程级缓存提供：同一进程内的多个分析器共享一份模型
+        self.registry = registry or model_registry
+        self.mmap_mode = mmap_mode
+        
         # 加载或训练模型
-        self.model = self.load_or_train_model()
-        self.cluster_model = self.load_or_train_cluster()
+        self.engine = 'compiled' if engine == 'auto' else engine
+        self._fallback_to_sklearn = engine == 'auto'
+        self.model_check_interval = model_check_interval
+        self._load_models()
+        
+        # 有界LRU缓存：重复出现的环境条件只需一次字典查找（cache_size=0 关闭缓存）
+        # 键包含模型版本，模型文件被替换后旧结果不再命中，由LRU自然淘汰
+        self.cache_decimals = cache_decimals
+        self._cached_analysis = functools.lru_cache(maxsize=cache_size)(self._analyze_reading)
+        
+        self.startup_seconds = time.perf_counter() - start
+        print(f"🤖 AI模型就绪（{self.engine}），耗时 {self.startup_seconds * 1000:.1f}ms")
+    
+    def _load_models(self):
+        """从进程级缓存取模型，记录模型版本（各模型文件的修改时间）"""
+        if self.engine == 'compiled':
+            # 编译模型同时提供分类概率和聚类中心，推理路径不需要导入sklearn
+            try:
+                self.model = self.cluster_model = self.load_or_compile()
+                paths = (self.compiled_path,)
+            except ValueError as e:
+                if not self._fallback_to_sklearn:
+                    raise
+                print(f"⚠️ 编译模型不可用（{e}），使用sklearn模型")
+                self.engine = 'sklearn'
+        if self.engine == 'sklearn':
+            self.model = self.load_or_train_model()
+            self.cluster_model = self.load_or_train_cluster()
+            paths = (self.model_path, self.cluster_path)
+        self.model_version = tuple(self.registry.version(path) for path in paths)
+        self._models_checked_at = time.monotonic()
+    
+    def refresh_models(self, force=False):
+        """模型文件被替换后（如 cluster_retrainer 重新训练）换用新模型，返回模型是否变化
+
+        每 model_check_interval 秒最多检查一次文件修改时间，force=True 时立即检查
+        """
+        if not force and time.monotonic() - self._models_checked_at < self.model_check_interval:
+            return False
+        previous = self.model_version
+        self._load_models()
+        return self.model_version != previous
     
     def load_or_train_model(self):
         """加载或训练分类模型"""
-        if os.path.exists(self.model_path):
-            return joblib.load(self.model_path)
-        else:
-            # 生成训练数据（模拟真实环境数据）
-            X, y = self.generate_training_data()
-            model = RandomForestClassifier(n_estimators=100, random_state=42)
-            model.fit(X, y)
-            
-            joblib.dump(model, self.model_path)
-            return model
+        self._invalidate_compiled(self.model_path)
+        return self.registry.get(self.model_path, self.train_model, self.mmap_mode)
     
     def load_or_train_cluster(self):
         """加载或训练聚类模型（用于异常检测）"""
-        if os.path.exists(self.cluster_path):
-            return joblib.load(self.cluster_path)
-        else:
-            # 生成正常环境数据用于聚类
-            X_normal = self.generate_normal_data()
-
-            model = KMeans(n_clusters=3, random_state=42)
-            model.fit(X_normal)
-            
-            joblib.dump(model, self.cluster_path)
-            return model
+        self._invalidate_compiled(self.cluster_path)
+        return self.registry.get(self.cluster_path, self.train_cluster, self.mmap_mode)
     
-    def generate_training_data(self):
-        """生成训练数据"""
-        np.random.seed(42)
-        n_samples = 1000
-        
-        # 生成各种环境条件的数据
-        X = []
-        y = []
-        
-        # 舒适环境
-        for _ in range(200):
-            temp = np.random.normal(22, 2)
-            hum = np.random.normal(55, 10)
-            air = np.random.normal(85, 10)
-            X.append([temp, hum, air])
-            y.append(0)  # 舒适
-        
-        # 炎热环境
-        for _ in range(200):
-            temp = np.random.normal(32, 3)
-            hum = np.random.normal(40, 15)
-            air = np.random.normal(70, 15)
-            X.append([temp, hum, air])
-            y.append(1)  # 炎热
-        
-        # 寒冷环境
-        for _ in range(200):
-            temp = np.random.normal(5, 3)
-            hum = np.random.normal(30, 10)
-            air = np.random.normal(90, 5)
-            X.append([temp, hum, air])
-            y.append(2)  # 寒冷
-            
-        # 潮湿环境
-        for _ in range(200):
-            temp = np.random.normal(25, 3)
-            hum = np.random.normal(85, 5)
-            air = np.random.normal(60, 10)
-            X.append([temp, hum, air])
-            y.append(3)  # 潮湿
-            
-        # 干燥环境
-        for _ in range(100):
-            temp = np.random.normal(24, 3)
-            hum = np.random.normal(20, 5)
-            air = np.random.normal(80, 10)
-            X.append([temp, hum, air])
-            y.append(4)  # 干燥
-            
-        # 空气质量差
-        for _ in range(100):
-            temp = np.random.normal(23, 3)
-            hum = np.random.normal(50, 10)
-            air = np.random.normal(25, 10)
-            X.append([temp, hum, air])
-            y.append(5)  # 空气质量差
-            
-        return np.array(X), np.array(y)
+    def load_or_compile(self):
+        """加载编译模型（缺失或早于sklearn模型文件时由sklearn模型重新导出）"""
+        self._invalidate_compiled(self.model_path)
+        self._invalidate_compiled(self.cluster_path)
+        try:
+            return self.registry.get(self.compiled_path, self.build_compiled_model, self.mmap_mode,
+                                     wrapper=CompiledModel)
+        except ValueError:
+            # 旧格式版本的编译模型：删除后重新导出（导出本身失败时文件不存在，直接抛出）
+            if not os.path.exists(self.compiled_path):
+                raise
+            os.remove(self.compiled_path)
+            return self.registry.get(self.compiled_path, self.build_compiled_model, self.mmap_mode,
+                                     wrapper=CompiledModel)
+    
+    def build_compiled_model(self):
+        """把随机森林和KMeans编译为纯NumPy数组（见 compiled_model.py）"""
+        return compile_models(self.load_or_train_model(), self.load_or_train_cluster())
+    
+    def _invalidate_compiled(self, source_path):
+        """sklearn模型需要重新训练或已被更新时，由旧模型导出的编译模型随之失效"""
+        if not os.path.exists(self.compiled_path):
+            return
+        if not os.path.exists(source_path) or os.path.getmtime(source_path) > os.path.getmtime(self.compiled_path):
+            os.remove(self.compiled_path)
+    
+    def train_model(self):
+        """训练分类模型（仅在需要训练时导入sklearn）"""
+        from sklearn.ensemble import RandomForestClassifier
+        
+        # 生成训练数据（模拟真实环境数据）
+        X, y = self.generate_training_data()
+        model = RandomForestClassifier(n_estimators=100, random_state=42)
+        model.fit(X, y)
+        return model
+    
+    def train_cluster(self):
+        """训练聚类模型（仅在需要训练时导入sklearn）"""
+        from sklearn.cluster import KMeans
+        
+        # 生成正常环境数据用于聚类
+        X_normal = self.generate_normal_data()
+        model = KMeans(n_clusters=3, random_state=42)
+        model.fit(X_normal)
+        return model
+    
+    def generate_training_data(self, classes=TRAINING_CLASSES, scale=1, seed=42):
+        """生成训练数据（模拟真实环境数据）
+
+        classes 为 (标签序号, 均值, 标准差, 样本数) 序列，均值/标准差按 (温度, 湿度, 空气质量) 给出；
+        scale 为样本数倍率。整批一次生成标准正态样本再按类别缩放平移，百万级样本也只需几次数组运算
+        """
+        rng = np.random.default_rng(seed)
+        counts = np.array([count for _, _, _, count in classes]) * scale
+        index = np.repeat(np.arange(len(classes)), counts)
+
+        means = np.array([mean for _, mean, _, _ in classes], dtype=np.float64)
+        stds = np.array([std for _, _, std, _ in classes], dtype=np.float64)
+        X = rng.standard_normal((len(index), 3))
+        X *= stds[index]
+        X += means[index]
+        y = np.array([label for label, _, _, _ in classes])[index]
+        return X, y
     
-    def generate_normal_data(self):
+    def generate_normal_data(self, n_samples=500, mean=NORMAL_MEAN, std=NORMAL_STD, seed=42):
         """生成正常环境数据用于异常检测"""
-        np.random.seed(42)
-        n_samples = 500
-        
-        X = []
-        for _ in range(n_samples):
-            temp = np.random.normal(22, 5)    # 正常温度范围
-            hum = np.random.normal(55, 15)    # 正常湿度范围
-            air = np.random.normal(80, 15)    # 正常空气质量范围
-            X.append([temp, hum, air])
-            
-        return np.array(X)
+        rng = np.random.default_rng(seed)
+        return rng.normal(mean, std, size=(n_samples, 3))
     
     def predict_environment(self, temp, hum, air):
         """使用AI模型预测环境类型"""
         features = np.array([[temp, hum, air]])
-        prediction = self.model.predict(features)[0]
-        probability = np.max(self.model.predict_proba(features))
+        # 只调用一次 predict_proba，argmax 即 predict 的结果
+        proba = self.model.predict_proba(features)[0]
+        best = np.argmax(proba)
+        prediction = self.model.classes_[best]
         
-        return self.labels[prediction], round(probability * 100, 1)
+        return self.labels[prediction], round(proba[best] * 100, 1)
     
     def detect_anomaly(self, temp, hum, air):
         """使用聚类检测异常环境"""
@@ -145,7 +265,33 @@ class RealAIAnalyzer:
         return round(anomaly_score * 100, 1)
     
     def analyze_with_ai(self, device_id, temp, hum, air):
-        """使用真正的AI进行分析"""
+        """使用真正的AI进行分析（按模型版本和读数查缓存，设置了 cache_decimals 时读数先取整）"""
+        self.refresh_models()
+        key = (float(temp), float(hum), float(air))
+        if self.cache_decimals is not None:
+            key = tuple(round(value, self.cache_decimals) for value in key)
+        result = self._cached_analysis(self.model_version, *key)
+        # 返回副本，调用方修改结果不会污染缓存
+        return dict(result, ai_suggestions=list(result["ai_suggestions"]))
+    
+    def cache_info(self):
+        """分析缓存统计：命中/未命中次数、当前条数、容量和命中率"""
+        info = self._cached_analysis.cache_info()
+        total = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'maxsize': info.maxsize,
+            'hit_rate': round(info.hits / total, 4) if total else 0.0
+        }
+    
+    def clear_cache(self):
+        """清空分析缓存和统计"""
+        self._cached_analysis.cache_clear()
+    
+    def _analyze_reading(self, model_version, temp, hum, air):
+        """单条读数的完整分析（与设备无关，结果可按读数缓存；model_version 只用作缓存键）"""
         # 预测环境类型
         env_type, confidence = self.predict_environment(temp, hum, air)
         
@@ -163,6 +309,95 @@ class RealAIAnalyzer:
             "model_used": "RandomForest + KMeans"
         }
     
+    def analyze_batch(self, device_ids, temps, hums=None, airs=None):
+        """批量AI分析：整批只调用一次 predict_proba，KMeans距离一次向量化计算
+
+        temps/hums/airs 为等长数组；也可以只传入 get_recent_data 返回的记录列表，
+        或 get_recent_array/get_new_data_array 返回的结构化数组作为 temps（直接取列，不逐行转换）。
+        device_ids 为单个设备ID（应用到每一行）或等长序列。
+        返回列式结果，prediction_confidence/anomaly_score 为百分比数值数组。
+        """
+        if hums is None and airs is None:
+            records = temps
+            if isinstance(records, np.ndarray) and records.dtype.names:
+                temps, hums, airs = records['temp'], records['hum'], records['air']
+            else:
+                temps = [r['temp'] for r in records]
+                hums = [r['hum'] for r in records]
+                airs = [r['air'] for r in records]
+
+        features = np.column_stack([
+            np.asarray(temps, dtype=np.float64),
+            np.asarray(hums, dtype=np.float64),
+            np.asarray(airs, dtype=np.float64),
+        ]).reshape(-1, 3)
+        n = len(features)
+        if isinstance(device_ids, str):
+            device_ids = [device_ids] * n
+
+        self.refresh_models()
+        if n == 0:
+            confidences = anomaly_scores = np.empty(0)
+            env_types = []
+        else:
+            proba = self.model.predict_proba(features)
+            best = np.argmax(proba, axis=1)
+            env_types = [self.labels[p] for p in self.model.classes_[best]]
+            confidences = np.round(proba[np.arange(n), best] * 100, 1)
+            anomaly_scores = self.detect_anomaly_batch(features)
+
+        suggestions = [
+            self.generate_ai_suggestions(env_type, score, temp, hum, air)
+            for env_type, score, (temp, hum, air) in zip(env_types, anomaly_scores.tolist(), features.tolist())
+        ]
+
+        return {
+            "device_id": list(device_ids),
+            "environment_type": env_types,
+            "prediction_confidence": confidences,
+            "anomaly_score": anomaly_scores,
+            "ai_suggestions": suggestions,
+            "model_used": "RandomForest + KMeans"
+        }
+
+    def build_analysis_rows(self, batch_result, sensor_data_ids=None):
+        """将 analyze_batch 的列式结果转换为 ai_analysis 表记录
+
+        舒适度评分 = 100 - 异常分数；健康风险：异常分数>70为"高"，非舒适环境为"中"，否则为"低"
+        """
+        n = len(batch_result["environment_type"])
+        if sensor_data_ids is None:
+            sensor_data_ids = [None] * n
+
+        rows = []
+        for i in range(n):
+            env_type = batch_result["environment_type"][i]
+            anomaly_score = float(batch_result["anomaly_score"][i])
+            if anomaly_score > 70:
+                health_risk = "高"
+            elif env_type != "舒适":
+                health_risk = "中"
+            else:
+                health_risk = "低"
+
+            rows.append({
+                "device_id": batch_result["device_id"][i],
+                "sensor_data_id": sensor_data_ids[i],
+                "environment_type": env_type,
+                "comfort_score": round(100 - anomaly_score, 1),
+                "health_risk": health_risk,
+                "suggestions": batch_result["ai_suggestions"][i],
+                "prediction_confidence": float(batch_result["prediction_confidence"][i]),
+                "anomaly_score": anomaly_score
+            })
+        return rows
+
+    def detect_anomaly_batch(self, features):
+        """向量化异常检测：一次计算所有样本到全部聚类中心的距离"""
+        centers = self.cluster_model.cluster_centers_
+        distances = np.min(np.linalg.norm(features[:, None, :] - centers[None, :, :], axis=2), axis=1)
+        return np.round(np.minimum(distances / 10, 1.0) * 100, 1)
+    
     def generate_ai_suggestions(self, env_type, anomaly_score, temp, hum, air):
         """基于AI结果生成建议"""
         suggestions = []
@@ -0,0 +1,290 @@
+"""
+异步数据收集服务 - asyncio事件循环驱动paho的socket读写
+
+paho的socket回调把每个连接注册到事件循环：socket可读时调用 loop_read，
+有待发送数据时调用 loop_write，心跳和重传由定时的 loop_misc 协程处理，
+不需要为每个代理占用一个 loop_forever 线程。
+消息进入 asyncio.Queue，批处理协程解析后交给单线程执行器批量写库，
+一个进程即可同时服务多个代理和主题。
+"""
+import os, sys
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import paho.mqtt.client as mqtt
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+shared_dir = os.path.join(current_dir, '..', 'shared')
+sys.path.insert(0, shared_dir)
+sys.path.insert(0, current_dir)
+from database import DatabaseManager
+from payload_parser import parse_records
+from streaming_anomaly import StreamingAnomalyDetector
+from mqtt_receiver import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, QUEUE_MAXSIZE, WRITE_BATCH_SIZE,
+                           WRITE_RETRIES, WRITE_RETRY_DELAY)
+
+FLUSH_INTERVAL_MS = 200      # 批次未满时最长等待时间
+MISC_INTERVAL = 1.0          # loop_misc 调用间隔（秒）
+RECONNECT_MAX_DELAY = 60     # 断线重连最大退避（秒）
+
+_STOP = object()             # 写入协程的停止标记
+
+
+class _LoopBridge:
+    """把一个paho客户端的socket挂到asyncio事件循环上"""
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self._misc = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _call_in_loop(self, callback, *args):
+        """connect/reconnect 在执行器线程中进行，期间触发的socket回调转到事件循环线程执行"""
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self._open, sock.fileno())
+
+    def _open(self, fd):
+        self.loop.add_reader(fd, self.client.loop_read)
+        self._misc = self.loop.create_task(self._misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        # 按文件描述符注销：socket 随后即被关闭
+        self._call_in_loop(self._close, sock.fileno())
+
+    def _close(self, fd):
+        self.loop.remove_reader(fd)
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_writer, sock.fileno())
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(MISC_INTERVAL)
+
+
+class AsyncDataCollector:
+    def __init__(self, db_path=None, brokers=None, topics=None, queue_size=QUEUE_MAXSIZE,
+                 batch_size=WRITE_BATCH_SIZE, flush_interval_ms=FLUSH_INTERVAL_MS, detect_anomalies=True,
+                 write_retries=WRITE_RETRIES, write_retry_delay=WRITE_RETRY_DELAY):
+        if db_path is None:
+            db_path = os.path.join(shared_dir, "sensor_data.db")
+        print(f"📁 异步接收器使用数据库: {db_path}")
+
+        self.db = DatabaseManager(db_path=db_path)
+        self.brokers = list(brokers or [(MQTT_BROKER, MQTT_PORT)])
+        self.topics = list(topics or [MQTT_TOPIC])
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.write_retries = write_retries
+        self.write_retry_delay = write_retry_delay
+        # 计数器只在事件循环线程中修改，不需要加锁
+        self.stats = {'received': 0, 'written': 0, 'dropped': 0, 'parse_errors': 0, 'anomalies': 0,
+                      'write_errors': 0}
+        self.anomaly_detector = StreamingAnomalyDetector() if detect_anomalies else None
+        self.clients = []
+        self._loop = None
+        self._queue = None
+        self._stopping = False
+        # SQLite写入放到单线程执行器：同一连接串行写，不阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-db")
+
+    def on_connect(self, client, userdata, flags, rc):
+        """MQTT连接成功回调：订阅所有主题"""
+        if rc == 0:
+            host, port = userdata
+            print(f"✅ Connected to MQTT broker {host}:{port}")
+            for topic in self.topics:
+                client.subscribe(topic)
+        else:
+            print(f"Failed to connect, return code {rc}")
+
+    def on_disconnect(self, client, userdata, rc):
+        """非主动断开时在事件循环中安排重连"""
+        if rc != 0 and not self._stopping:
+            self._loop.create_task(self._reconnect(client))
+
+    def on_message(self, client, userdata, msg):
+        """由 loop_read 在事件循环线程中调用：只入队"""
+        self.enqueue(msg.payload)
+
+    def enqueue(self, payload):
+        """放入有界队列；回调中不能等待，队列满时丢弃最旧的一条"""
+        self.stats['received'] += 1
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.stats['dropped'] += 1
+        self._queue.put_nowait(payload)
+
+    def get_stats(self):
+        """获取计数器（含当前队列深度）"""
+        stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        stats['queue_capacity'] = self.queue_size
+        return stats
+
+    async def run(self, stop_event=None):
+        """连接所有代理并持续收集，stop_event 被设置（或任务被取消）后写完剩余数据退出"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = False
+        writer = self._loop.create_task(self._batch_writer())
+        try:
+            await asyncio.gather(*(self._connect(host, port) for host, port in self.brokers))
+            if stop_event is None:
+                await self._loop.create_future()  # 一直运行直到被取消
+            else:
+                await stop_event.wait()
+        finally:
+            self._stopping = True
+            for client in self.clients:
+                client.disconnect()
+            await self._queue.put(_STOP)
+            await writer
+            await self._loop.run_in_executor(self._executor, self.db.close)
+            self._executor.shutdown(wait=False)
+            print(f"📊 写入统计: {self.get_stats()}")
+
+    async def _connect(self, host, port):
+        """创建客户端并发起连接
+
+        DNS解析和TCP握手是阻塞调用，放到默认执行器中进行，不阻塞事件循环（也不占用写库线程）；
+        连接建立后socket由事件循环接管
+        """
+        client = mqtt.Client(userdata=(host, port))
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_message = self.on_message
+        _LoopBridge(self._loop, client)
+        self.clients.append(client)
+        try:
+            await self._loop.run_in_executor(None, client.connect, host, port, 60)
+        except OSError as e:
+            print(f"❌ 连接 {host}:{port} 失败: {e}")
+            self._loop.create_task(self._reconnect(client))
+
+    async def _reconnect(self, client):
+        delay = 1
+        while not self._stopping:
+            await asyncio.sleep(delay)
+            try:
+                await self._loop.run_in_executor(None, client.reconnect)
+                return
+            except OSError:
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _batch_writer(self):
+        """攒满 batch_size 条或等待 flush_interval 后写库；上一批写库期间继续攒下一批"""
+        pending = None
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            batch = []
+            if item is _STOP:
+                stopping = True
+            else:
+                batch.append(item)
+                deadline = self._loop.time() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        timeout = deadline - self._loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            item = await asyncio.wait_for(self._queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+            if pending is not None:
+                await pending
+                pending = None
+            if batch:
+                pending = self._loop.create_task(self._write_batch(batch))
+        if pending is not None:
+            await pending
+
+    async def _write_batch(self, payloads):
+        records = []
+        for raw in payloads:
+            try:
+                records.extend(parse_records(raw))
+            except Exception as e:
+                self.stats['parse_errors'] += 1
+                print(f"❌ 解析失败: {e}")
+
+        written = await self._save_batch(records)
+        if written is None:
+            self.stats['write_errors'] += 1
+            self.stats['dropped'] += len(records)
+            return
+        self.stats['written'] += written
+
+        # 只统计已入库的读数；与写库共用执行器线程，逐条更新统计不占用事件循环
+        if self.anomaly_detector is not None:
+            events = await self._loop.run_in_executor(self._executor, self.anomaly_detector.update_batch, records)
+            self.stats['anomalies'] += len(events)
+
+    async def _save_batch(self, records):
+        """批量写库，失败时（如 database is locked）按退避重试；全部失败返回 None
+
+        重试期间写入协程不取下一批，队列满后新数据计为丢弃
+        """
+        delay = self.write_retry_delay
+        for attempt in range(self.write_retries + 1):
+            try:
+                return await self._loop.run_in_executor(self._executor, self.db.save_sensor_data_batch, records)
+            except Exception as e:
+                print(f"❌ 批量写入失败（第{attempt + 1}次）: {e}")
+                if attempt < self.write_retries:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IoT环境监测 - 异步数据收集服务")
+    parser.add_argument("--db", default=None, help="数据库路径（默认 shared/sensor_data.db）")
+    parser.add_argument("--broker", action="append", default=None,
+                        help=f"代理地址 host:port，可重复指定（默认 {MQTT_BROKER}:{MQTT_PORT}）")
+    parser.add_argument("--topic", action="append", default=None,
+                        help=f"订阅主题，可重复指定（默认 {MQTT_TOPIC}）")
+    args = parser.parse_args()
+
+    brokers = None
+    if args.broker:
+        brokers = [(host, int(port)) for host, port in (b.rsplit(':', 1) for b in args.broker)]
+
+    collector = AsyncDataCollector(db_path=args.db, brokers=brokers, topics=args.topic)
+    try:
+        asyncio.run(collector.run())
+    except KeyboardInterrupt:
+        print("\n Shutting down data collector...")
+
+
+if __name__ == "__main__":
+    main()
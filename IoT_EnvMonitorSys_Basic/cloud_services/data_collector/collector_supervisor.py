@@ -0,0 +1,167 @@
+"""
+多进程数据收集管理器 - 按设备分片启动N个收集进程
+
+分片方式：
+- hash（默认）：每个进程都订阅 devices/+/sensor_data，只处理 crc32(设备ID) % N 归属自己的消息，
+  过滤只看主题不解析负载，每台设备固定由同一个进程写入
+- shared：使用MQTT共享订阅 $share/<组名>/devices/+/sensor_data，由代理在进程间分发消息，
+  代理负载更低，但同一设备的消息可能落到不同进程
+
+每个进程有独立的MQTT连接和数据库连接；管理器负责重启提前退出的进程（包括连接代理失败后
+正常返回的进程），连续重启按指数退避，并在退出时汇总统计
+"""
+import os, sys
+import argparse
+import multiprocessing
+import queue
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+from mqtt_receiver import DataCollector, MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
+
+SHARD_MODES = ('hash', 'shared')
+SHARED_GROUP = "collectors"
+GAUGE_STATS = ('queue_depth', 'queue_capacity')   # 进程重启后取最新值，不累加
+
+
+def _run_worker(index, num_workers, options, stop_event, results):
+    """收集进程入口：运行到 stop_event 被设置，退出前上报统计"""
+    mode = options.pop('mode')
+    if mode == 'shared':
+        options['topic'] = f"$share/{SHARED_GROUP}/{options['topic']}"
+        shard = None
+    else:
+        shard = (index, num_workers)
+
+    collector = DataCollector(shard=shard, **options)
+    try:
+        collector.start(stop_event)
+    except KeyboardInterrupt:
+        pass  # Ctrl+C 同时发给所有子进程，由管理器统一停止
+    results.put((index, collector.get_stats()))
+
+
+class CollectorSupervisor:
+    def __init__(self, num_workers=None, db_path=None, broker_host=MQTT_BROKER, broker_port=MQTT_PORT,
+                 topic=MQTT_TOPIC, mode='hash', restart_delay=1.0, max_restart_delay=30.0,
+                 **collector_options):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"未知的分片方式: {mode}，可选: {SHARD_MODES}")
+
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.options = dict(collector_options, db_path=db_path, broker_host=broker_host,
+                            broker_port=broker_port, topic=topic, mode=mode)
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.worker_stats = {}
+        self.restarts = 0
+        self._stop_event = multiprocessing.Event()
+        self._results = multiprocessing.Queue()
+        self._workers = {}
+        self._spawned_at = {}
+        self._backoff = {}   # 每个进程当前的重启退避（秒），0 表示可以立即重启
+        self._spawns = 0
+
+    def start(self):
+        """启动全部收集进程"""
+        self._stop_event.clear()
+        for index in range(self.num_workers):
+            self._spawn(index)
+        print(f"🚀 已启动 {self.num_workers} 个收集进程（{self.options['mode']} 分片）")
+
+    def supervise(self, poll_interval=1.0):
+        """阻塞监控：提前退出的进程自动重启，Ctrl+C 后停止全部进程"""
+        try:
+            while not self._stop_event.is_set():
+                self.check_workers()
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("\n Shutting down collectors...")
+        finally:
+            self.stop()
+
+    def check_workers(self):
+        """重启已退出的进程（未停止时任何退出都是异常，退出码为0也一样），返回本次重启的数量
+
+        同一进程距上次启动不足退避时间时暂不重启；退避从 restart_delay 起每次翻倍，
+        最长 max_restart_delay，进程稳定运行超过 max_restart_delay 后退避清零
+        """
+        if self._stop_event.is_set():
+            return 0
+        restarted = 0
+        now = time.time()
+        for index, process in list(self._workers.items()):
+            if process.is_alive():
+                continue
+            uptime = now - self._spawned_at[index]
+            delay = self._backoff.get(index, 0.0)
+            if uptime > self.max_restart_delay:
+                delay = 0.0
+            elif uptime < delay:
+                continue
+            print(f"⚠️ 收集进程 {index} 已退出（{process.exitcode}），重新启动")
+            self._backoff[index] = min(max(delay * 2, self.restart_delay), self.max_restart_delay)
+            self.restarts += 1
+            restarted += 1
+            self._spawn(index)
+        return restarted
+
+    def stop(self, timeout=10.0):
+        """通知全部进程写完队列后退出，返回各进程统计 {序号: stats}"""
+        self._stop_event.set()
+        deadline = time.time() + timeout
+        # 先收结果再 join：子进程在队列数据被取走前不会退出
+        # 重启过的进程每次运行都上报一次，按序号累加
+        reports = 0
+        while reports < self._spawns and time.time() < deadline:
+            try:
+                index, stats = self._results.get(timeout=0.1)
+                reports += 1
+                merged = self.worker_stats.setdefault(index, {})
+                for key, value in stats.items():
+                    merged[key] = value if key in GAUGE_STATS else merged.get(key, 0) + value
+            except queue.Empty:
+                if not any(p.is_alive() for p in self._workers.values()):
+                    break
+        for process in self._workers.values():
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                process.terminate()
+        return self.worker_stats
+
+    def get_stats(self):
+        """汇总所有进程的计数器"""
+        total = {}
+        for stats in self.worker_stats.values():
+            for key, value in stats.items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def _spawn(self, index):
+        process = multiprocessing.Process(
+            target=_run_worker, name=f"collector-{index}",
+            args=(index, self.num_workers, dict(self.options), self._stop_event, self._results))
+        process.start()
+        self._workers[index] = process
+        self._spawned_at[index] = time.time()
+        self._spawns += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IoT环境监测 - 多进程数据收集")
+    parser.add_argument("--workers", type=int, default=None, help="收集进程数（默认CPU核数）")
+    parser.add_argument("--db", default=None, help="数据库路径（默认 shared/sensor_data.db）")
+    parser.add_argument("--broker", default=f"{MQTT_BROKER}:{MQTT_PORT}", help="代理地址 host:port")
+    parser.add_argument("--mode", choices=SHARD_MODES, default='hash', help="分片方式")
+    args = parser.parse_args()
+
+    host, port = args.broker.rsplit(':', 1)
+    supervisor = CollectorSupervisor(args.workers, args.db, host, int(port), mode=args.mode)
+    supervisor.start()
+    supervisor.supervise()
+    print(f"📊 写入统计: {supervisor.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,61 @@
 import os, sys
-import json
+import queue
+import struct
+import threading
+import time
+import zlib
 import paho.mqtt.client as mqtt
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 shared_dir = os.path.join(current_dir, '..', 'shared')
 sys.path.insert(0, shared_dir)
+sys.path.insert(0, current_dir)
 from database import DatabaseManager
+from payload_parser import parse_payload, parse_records
+from streaming_anomaly import StreamingAnomalyDetector
 
 # 配置信息
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC = "devices/+/sensor_data"
 
+# 写入管道配置
+QUEUE_MAXSIZE = 10000        # 有界队列容量
+WRITE_BATCH_SIZE = 500       # 写入线程单次批量写库条数
+WRITE_RETRIES = 3            # 批量写库失败（如 database is locked）后的重试次数
+WRITE_RETRY_DELAY = 0.1      # 首次重试前等待（秒），之后每次翻倍
+BACKPRESSURE_POLICIES = ('block', 'drop_oldest', 'spill')
+
+# 溢出文件记录格式：4字节长度前缀 + 原始负载
+_SPILL_HEADER = struct.Struct('>I')
+
+
+def topic_device_id(topic):
+    """从主题 devices/<device_id>/sensor_data 中取出设备ID"""
+    parts = topic.split('/')
+    return parts[1] if len(parts) >= 3 else topic
+
+
+def device_shard(device_id, num_shards):
+    """设备所属分片（crc32 跨进程、跨重启稳定，不使用随机化的 hash()）"""
+    return zlib.crc32(device_id.encode('utf-8')) % num_shards
+
+
 class DataCollector:
-    def __init__(self):
+    def __init__(self, db_path=None, queue_size=QUEUE_MAXSIZE, num_writers=1,
+                 backpressure='block', spill_path=None, batch_size=WRITE_BATCH_SIZE,
+                 broker_host=MQTT_BROKER, broker_port=MQTT_PORT, topic=MQTT_TOPIC, shard=None,
+                 detect_anomalies=True, write_retries=WRITE_RETRIES, write_retry_delay=WRITE_RETRY_DELAY):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"未知的背压策略: {backpressure}，可选: {BACKPRESSURE_POLICIES}")
+        if shard is not None and not 0 <= shard[0] < shard[1]:
+            raise ValueError(f"分片参数应为 (序号, 总数): {shard}")
+
         # 添加调试信息
         current_dir = os.path.dirname(os.path.abspath(__file__))
         shared_dir = os.path.join(current_dir, '..', 'shared')
-        db_path = os.path.join(shared_dir, "sensor_data.db")
+        if db_path is None:
+            db_path = os.path.join(shared_dir, "sensor_data.db")
         
         print(f"📁 接收器使用数据库: {db_path}")
         print(f"📁 数据库存在: {os.path.exists(db_path)}")
@@ -25,6 +63,28 @@ class DataCollector:
         self.db = DatabaseManager(db_path=db_path)  # 明确指定路径
         # self.db = DatabaseManager()
         self.mqtt_client = mqtt.Client()
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.topic = topic
+        # 分片模式：shard=(序号, 总数) 时只处理按设备ID哈希归属本分片的消息
+        self.shard = shard
+        # 写入线程逐条更新各设备的在线统计，发现单点异常和漂移（不回查数据库）
+        self.anomaly_detector = StreamingAnomalyDetector() if detect_anomalies else None
+
+        # 解耦的写入管道：回调只入队，写入线程负责解析和批量写库
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.num_writers = num_writers
+        self.batch_size = batch_size
+        self.write_retries = write_retries
+        self.write_retry_delay = write_retry_delay
+        self.backpressure = backpressure
+        self.spill_path = spill_path or os.path.join(os.path.dirname(db_path), "ingest_spill.bin")
+        self.stats = {'received': 0, 'written': 0, 'dropped': 0, 'spilled': 0, 'parse_errors': 0, 'skipped': 0,
+                      'anomalies': 0, 'write_errors': 0}
+        self._stats_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._writers = []
         
         # 设置MQTT回调函数
         self.mqtt_client.on_connect = self.on_connect
@@ -35,53 +95,218 @@ class DataCollector:
         if rc == 0:
             print("✅ Connected to MQTT broker successfully!")
             # 订阅设备数据主题
-            client.subscribe(MQTT_TOPIC)
-            print(f"Subscribed to topic: {MQTT_TOPIC}")
+            client.subscribe(self.topic)
+            print(f"Subscribed to topic: {self.topic}")
         else:
             print(f"Failed to connect, return code {rc}")
     
     def on_message(self, client, userdata, msg):
+        """只负责入队，解析和写库在写入线程中完成，不阻塞MQTT网络循环"""
+        if self.shard is not None and not self.owns_topic(msg.topic):
+            self._count('skipped')
+            return
+        self.enqueue(msg.payload)
+
+    def owns_topic(self, topic):
+        """主题中的设备是否归属本分片（只看主题，不解析负载）"""
+        index, count = self.shard
+        return device_shard(topic_device_id(topic), count) == index
+
+    def enqueue(self, payload):
+        """按背压策略将原始负载放入有界队列"""
+        self._count('received')
+
+        if self.backpressure == 'block':
+            self.queue.put(payload)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(payload)
+                return
+            except queue.Full:
+                if self.backpressure == 'spill':
+                    self._spill(payload)
+                    return
+                # drop_oldest：丢弃最旧的一条，为新数据腾出位置
+                try:
+                    self.queue.get_nowait()
+                    self._count('dropped')
+                except queue.Empty:
+                    pass
+
+    def parse_payload(self, raw):
+        """解析负载，兼容固件发送的非标准JSON（失败抛出 PayloadError）"""
+        return parse_payload(raw)
+
+    def parse_records(self, raw):
+        """解析一条消息中的全部读数（含固件补发离线缓存的批量消息）"""
+        return parse_records(raw)
+
+    def get_stats(self):
+        """获取写入管道计数器（含当前队列深度）"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_capacity'] = self.queue.maxsize
+        return stats
+
+    def start_writers(self):
+        """启动写入线程"""
+        self._stop_event.clear()
+        for i in range(self.num_writers):
+            writer = threading.Thread(target=self._writer_loop, args=(i,),
+                                      name=f"ingest-writer-{i}", daemon=True)
+            writer.start()
+            self._writers.append(writer)
+
+    def stop(self):
+        """停止写入线程：先写完队列中剩余数据，再关闭数据库"""
+        self._stop_event.set()
+        for writer in self._writers:
+            writer.join()
+        self._writers = []
+        self.db.close()
+        print(f"📊 写入统计: {self.get_stats()}")
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _writer_loop(self, index):
+        while True:
+            batch = self._drain_batch()
+            if batch:
+                self._write_batch(batch)
+            elif self._stop_event.is_set():
+                break
+            elif self.backpressure == 'spill' and index == 0:
+                # 队列空闲时由0号写入线程回放溢出文件
+                self._replay_spill()
+
+    def _drain_batch(self):
+        """阻塞等待第一条，随后非阻塞取满一个批次"""
         try:
-            raw = msg.payload.decode('utf-8')
-            print(f"📨 收到: {raw}")
-            
+            batch = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
             try:
-                # 第一步：先尝试直接解析JSON
-                data = json.loads(raw)  # 如果是正常JSON，这里就成功了
-                print("✅ 正常JSON解析成功")
-            except json.JSONDecodeError:
-                # 第二步：如果JSON解析失败，说明需要修复
-                print("🛠️ 检测到非标准JSON，开始修复...")
-                fixed = raw.replace('{', '{"').replace(':', '":"').replace(',', '","').replace('}', '"}')
-                fixed = fixed.replace('"","', '","').replace('":"{', ':{')
-                data = json.loads(fixed)  # 修复后再解析
-                print("✅ 修复后JSON解析成功")
-            
-            self.db.save_sensor_data(data)
-            print("💾 保存成功!")
-        
-        except Exception as e:
-            print(f"❌ 失败: {e}")
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, payloads):
+        records, parsed = [], []
+        for raw in payloads:
+            try:
+                records.extend(self.parse_records(raw))
+                parsed.append(raw)
+            except Exception as e:
+                self._count('parse_errors')
+                print(f"❌ 解析失败: {e}")
+
+        written = self._save_batch(records)
+        if written is None:
+            # 重试后仍失败：spill 策略写入溢出文件，数据库恢复后回放；其它策略计为丢弃
+            self._count('write_errors')
+            if self.backpressure == 'spill':
+                for raw in parsed:
+                    self._spill(raw)
+            else:
+                self._count('dropped', len(records))
+            return
+        self._count('written', written)
+
+        # 只统计已入库的读数，转入溢出文件的数据在回放入库时才计入
+        if self.anomaly_detector is not None:
+            self._report_anomalies(self.anomaly_detector.update_batch(records))
+
+    def _save_batch(self, records):
+        """批量写库，失败时按退避重试；全部失败返回 None"""
+        delay = self.write_retry_delay
+        for attempt in range(self.write_retries + 1):
+            try:
+                return self.db.save_sensor_data_batch(records)
+            except Exception as e:
+                print(f"❌ 批量写入失败（第{attempt + 1}次）: {e}")
+                if attempt < self.write_retries:
+                    time.sleep(delay)
+                    delay *= 2
+        return None
+
+    def _report_anomalies(self, events):
+        if events:
+            self._count('anomalies', len(events))
+            for event in events:
+                print(f"🚨 {event['device_id']} {event['field']} {event['kind']}异常: "
+                      f"{event['value']}（{event['score']}σ）")
+
+    def _spill(self, payload):
+        """队列已满时将负载追加到磁盘溢出文件"""
+        with self._spill_lock:
+            with open(self.spill_path, 'ab') as f:
+                f.write(_SPILL_HEADER.pack(len(payload)))
+                f.write(payload)
+        self._count('spilled')
+
+    def _replay_spill(self):
+        """将溢出文件中的数据重新写入数据库"""
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            # 上次未回放完的文件优先处理
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+
+        batch = []
+        with open(replay_path, 'rb') as f:
+            while True:
+                header = f.read(_SPILL_HEADER.size)
+                if len(header) < _SPILL_HEADER.size:
+                    break
+                batch.append(f.read(_SPILL_HEADER.unpack(header)[0]))
+                if len(batch) >= self.batch_size:
+                    self._write_batch(batch)
+                    batch = []
+        if batch:
+            self._write_batch(batch)
+        os.remove(replay_path)
         
         
-    def start(self):
-        """启动数据收集服务"""
+    def start(self, stop_event=None):
+        """启动数据收集服务
+
+        stop_event 为 None 时阻塞在 loop_forever 直到 Ctrl+C；
+        否则在后台线程运行网络循环，stop_event 被设置后退出（供多进程管理器使用）
+        """
         print(" Starting IoT Data Collector...")
-        print(f" MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
+        print(f" MQTT Broker: {self.broker_host}:{self.broker_port}")
         
+        self.start_writers()
         try:
             # 连接MQTT代理
-            self.mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            self.mqtt_client.connect(self.broker_host, self.broker_port, 60)
             
-            # 启动网络循环（阻塞调用）
-            print(" Starting network loop...")
-            self.mqtt_client.loop_forever()
+            if stop_event is None:
+                # 启动网络循环（阻塞调用）
+                print(" Starting network loop...")
+                self.mqtt_client.loop_forever()
+            else:
+                self.mqtt_client.loop_start()
+                stop_event.wait()
+                self.mqtt_client.disconnect()
+                self.mqtt_client.loop_stop()
             
         except KeyboardInterrupt:
             print("\n Shutting down data collector...")
             self.mqtt_client.disconnect()
         except Exception as e:
             print(f"❌ Unexpected error: {e}")
+        finally:
+            self.stop()
 
 
 if __name__ == "__main__":
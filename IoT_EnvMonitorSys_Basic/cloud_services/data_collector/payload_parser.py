@@ -0,0 +1,183 @@
+"""
+传感器负载解析器 - 单次匹配识别固件的两种消息格式
+
+固件 mqtt_publish_sensor_data 生成的标准JSON：
+    {"device_id":"basic_001","temp":25.50,"hum":60.00,"air":75.00,"ts":1234567890}
+经Windows命令行转义丢失引号后的非标准格式：
+    {device_id:basic_001,temp:25.50,hum:60.00,air:75.00,ts:1234567890}
+
+两种格式由同一个预编译正则直接匹配，不需要先失败一次再修复重解析；
+其它字段顺序或额外字段的JSON走通用解析（安装了orjson时优先使用）后做字段校验。
+
+固件补发离线缓存时一条消息包含多条读数（mqtt_publish_sensor_records），设备ID只出现一次：
+    {"device_id":"basic_001","records":[[25.50,60.00,75.00,1234567890],...]}
+parse_records 统一返回记录列表，单条和批量消息都可以处理。
+
+固件也可以发送二进制帧（mqtt_client_set_payload_format，小端、无填充），首字节为版本号而不是 '{'：
+    头部   version(u8) count(u16) id_len(u8) device_id[id_len]
+    读数   device_hash(u32) temp(f32) hum(f32) air(f32) ts(u32) sequence(u16)，每条22字节
+读数区直接用 np.frombuffer 按结构化dtype解释，不逐字段解析；每条读数的 device_hash 须与头部设备ID一致。
+"""
+import json
+import re
+import struct
+import numpy as np
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+_NUMBER = rb'(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)'
+
+# 固件字段顺序固定：device_id, temp, hum, air, ts；键和字符串值的引号可有可无
+_FIRMWARE_PATTERN = re.compile(
+    rb'\s*\{\s*"?device_id"?\s*:\s*"?([^",}\s]+)"?\s*,'
+    rb'\s*"?temp"?\s*:\s*' + _NUMBER + rb'\s*,'
+    rb'\s*"?hum"?\s*:\s*' + _NUMBER + rb'\s*,'
+    rb'\s*"?air"?\s*:\s*' + _NUMBER + rb'\s*,'
+    rb'\s*"?ts"?\s*:\s*(\d+)\s*\}\s*'
+)
+
+NUMERIC_FIELDS = ('temp', 'hum', 'air')
+
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<BHB')   # version, count, id_len
+BINARY_RECORD_DTYPE = np.dtype([
+    ('device_hash', '<u4'),
+    ('temp', '<f4'),
+    ('hum', '<f4'),
+    ('air', '<f4'),
+    ('ts', '<u4'),
+    ('sequence', '<u2'),
+])
+
+
+class PayloadError(ValueError):
+    """负载格式错误或字段类型不合法"""
+
+
+def parse_payload(raw):
+    """解析一条传感器负载，返回 {'device_id', 'temp', 'hum', 'air', 'ts'}"""
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8')
+
+    match = _FIRMWARE_PATTERN.fullmatch(raw)
+    if match is not None:
+        device_id, temp, hum, air, ts = match.groups()
+        return {
+            'device_id': device_id.decode('utf-8'),
+            'temp': float(temp),
+            'hum': float(hum),
+            'air': float(air),
+            'ts': int(ts)
+        }
+
+    try:
+        data = _json_loads(raw)
+    except ValueError as e:
+        raise PayloadError(f"无法解析的负载: {raw[:80]!r}") from e
+    return validate_record(data)
+
+
+def parse_records(raw):
+    """解析一条消息中的全部读数（单条、批量或二进制格式），返回记录列表"""
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8')
+
+    if raw[:1] == b'\x01':
+        return parse_binary(raw)
+    if _FIRMWARE_PATTERN.fullmatch(raw) is not None:
+        return [parse_payload(raw)]
+
+    try:
+        data = _json_loads(raw)
+    except ValueError as e:
+        raise PayloadError(f"无法解析的负载: {raw[:80]!r}") from e
+    if isinstance(data, dict) and 'records' in data:
+        return _expand_records(data)
+    if isinstance(data, list):
+        return [validate_record(item) for item in data]
+    return [validate_record(data)]
+
+
+def device_id_hash(device_id):
+    """设备ID的32位FNV-1a哈希（与固件 device_id_hash 一致）"""
+    value = 2166136261
+    for byte in device_id.encode('utf-8'):
+        value = ((value ^ byte) * 16777619) & 0xFFFFFFFF
+    return value
+
+
+def parse_binary(raw):
+    """解析二进制帧，返回记录列表；读数保留两位小数，与JSON格式的精度一致"""
+    if len(raw) < BINARY_HEADER.size:
+        raise PayloadError(f"二进制帧不完整: {len(raw)} 字节")
+    version, count, id_length = BINARY_HEADER.unpack_from(raw)
+    if version != BINARY_VERSION:
+        raise PayloadError(f"不支持的二进制帧版本: {version}")
+    offset = BINARY_HEADER.size + id_length
+    if id_length == 0 or len(raw) != offset + count * BINARY_RECORD_DTYPE.itemsize:
+        raise PayloadError(f"二进制帧长度错误: {len(raw)} 字节，{count} 条读数")
+
+    try:
+        device_id = raw[BINARY_HEADER.size:offset].decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise PayloadError("二进制帧设备ID不是UTF-8") from e
+    rows = np.frombuffer(raw, dtype=BINARY_RECORD_DTYPE, count=count, offset=offset)
+    if (rows['device_hash'] != device_id_hash(device_id)).any():
+        raise PayloadError(f"二进制帧设备ID哈希不匹配: {device_id}")
+
+    columns = [np.round(rows[field].astype(np.float64), 2).tolist() for field in NUMERIC_FIELDS]
+    return [{'device_id': device_id, 'temp': temp, 'hum': hum, 'air': air, 'ts': ts}
+            for temp, hum, air, ts in zip(*columns, rows['ts'].tolist())]
+
+
+def encode_binary(device_id, records, sequence_start=0):
+    """把记录列表编码为二进制帧（模拟设备和测试使用）"""
+    encoded_id = device_id.encode('utf-8')
+    rows = np.zeros(len(records), dtype=BINARY_RECORD_DTYPE)
+    rows['device_hash'] = device_id_hash(device_id)
+    for field in NUMERIC_FIELDS + ('ts',):
+        rows[field] = [record[field] for record in records]
+    rows['sequence'] = (sequence_start + np.arange(len(records))) % 65536
+    return BINARY_HEADER.pack(BINARY_VERSION, len(records), len(encoded_id)) + encoded_id + rows.tobytes()
+
+
+def _expand_records(data):
+    """展开批量格式：每条读数为 [temp, hum, air, ts]"""
+    rows = data['records']
+    if not isinstance(rows, list):
+        raise PayloadError(f"records 不是数组: {type(rows).__name__}")
+
+    records = []
+    for row in rows:
+        if not isinstance(row, list) or len(row) != 4:
+            raise PayloadError(f"批量读数格式错误: {row!r}")
+        records.append(validate_record({'device_id': data.get('device_id'), 'temp': row[0],
+                                        'hum': row[1], 'air': row[2], 'ts': row[3]}))
+    return records
+
+
+def validate_record(data):
+    """校验通用JSON解析结果的字段和类型"""
+    if not isinstance(data, dict):
+        raise PayloadError(f"负载不是JSON对象: {type(data).__name__}")
+
+    device_id = data.get('device_id')
+    if not isinstance(device_id, str) or not device_id:
+        raise PayloadError(f"device_id 缺失或类型错误: {device_id!r}")
+
+    record = {'device_id': device_id}
+    for field in NUMERIC_FIELDS:
+        value = data.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise PayloadError(f"{field} 缺失或类型错误: {value!r}")
+        record[field] = float(value)
+
+    ts = data.get('ts')
+    if isinstance(ts, bool) or not isinstance(ts, int):
+        raise PayloadError(f"ts 缺失或类型错误: {ts!r}")
+    record['ts'] = ts
+    return record
@@ -0,0 +1,201 @@
+"""
+流式异常检测 - 每台设备维护自己的在线统计量，收集时逐条O(1)更新
+
+每台设备占用固定大小的数组槽位（温度、湿度、空气质量三列）：
+- Welford算法累计的均值和二阶矩 M2，作为设备的长期基线
+- EWMA（指数加权移动平均），反映最近一段时间的水平
+
+两类异常：
+- zscore：单条读数偏离长期基线超过 z_threshold 个标准差
+- drift：EWMA 偏离长期基线超过 drift_threshold 个标准差（只在进入漂移状态时报告一次）
+
+不需要回查数据库；设备数超过 max_devices 时淘汰最久未上报的设备，内存占用有上界。
+
+统计量存放在按槽位分配的NumPy数组中；一批记录先按设备分组，每台设备的槽位只读出、写回一次，
+逐条更新用Python浮点数计算（对3个元素的小数组逐条调用NumPy反而更慢）。
+"""
+import math
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+
+FIELDS = ('temp', 'hum', 'air')
+MIN_SAMPLES = 30                   # 基线样本数达到后才开始判断
+Z_THRESHOLD = 4.0                  # 单点异常阈值（标准差倍数）
+DRIFT_THRESHOLD = 1.0              # 漂移阈值（EWMA 偏离基线的标准差倍数）
+EWMA_ALPHA = 0.1                   # EWMA 平滑系数
+MIN_STD = (0.5, 1.0, 1.0)          # 标准差下限，避免读数恒定时任何波动都被判为异常
+MAX_DEVICES = 10000                # 同时跟踪的最大设备数
+INITIAL_CAPACITY = 64              # 初始槽位数，按需倍增到 max_devices
+RECENT_EVENTS = 1000               # 保留最近的异常事件条数
+
+
+class StreamingAnomalyDetector:
+    def __init__(self, max_devices=MAX_DEVICES, min_samples=MIN_SAMPLES, z_threshold=Z_THRESHOLD,
+                 drift_threshold=DRIFT_THRESHOLD, alpha=EWMA_ALPHA, min_std=MIN_STD,
+                 recent_events=RECENT_EVENTS):
+        if max_devices < 1:
+            raise ValueError(f"max_devices 必须大于0: {max_devices}")
+        self.max_devices = max_devices
+        self.min_samples = max(min_samples, 2)
+        self.z_threshold = z_threshold
+        self.drift_threshold = drift_threshold
+        self.alpha = alpha
+        self.min_std = np.asarray(min_std, dtype=np.float64)
+        self.recent = deque(maxlen=recent_events)
+        self.stats = {'updates': 0, 'zscore': 0, 'drift': 0, 'evicted': 0}
+        # 设备ID -> 槽位号，按最近更新时间排序（最久未更新的在最前）
+        self._slots = OrderedDict()
+        self._free = []
+        self._lock = threading.Lock()
+        # 每台设备一个槽位（一行），三列依次为温度、湿度、空气质量
+        self._count = np.zeros(0, dtype=np.int64)
+        self._mean = np.zeros((0, len(FIELDS)), dtype=np.float64)
+        self._m2 = np.zeros((0, len(FIELDS)), dtype=np.float64)
+        self._ewma = np.zeros((0, len(FIELDS)), dtype=np.float64)
+        self._drifting = np.zeros((0, len(FIELDS)), dtype=np.bool_)
+        self._allocate(min(INITIAL_CAPACITY, max_devices))
+
+    def update(self, record):
+        """用一条记录更新该设备的统计量，返回本条触发的异常事件列表"""
+        return self.update_batch([record])
+
+    def update_batch(self, records):
+        """更新一批记录，返回触发的全部异常事件（按设备分组，同一设备内保持记录顺序）"""
+        groups = {}
+        for record in records:
+            groups.setdefault(record['device_id'], []).append(record)
+
+        events = []
+        with self._lock:
+            for device_id, rows in groups.items():
+                self._update_device(device_id, rows, events)
+        return events
+
+    def device_stats(self, device_id):
+        """设备当前的基线统计，未跟踪的设备返回 None"""
+        with self._lock:
+            slot = self._slots.get(device_id)
+            if slot is None:
+                return None
+            count = int(self._count[slot])
+            std = np.sqrt(self._m2[slot] / (count - 1)) if count > 1 else np.zeros(len(FIELDS))
+            return {
+                'count': count,
+                'mean': dict(zip(FIELDS, self._mean[slot].tolist())),
+                'std': dict(zip(FIELDS, std.tolist())),
+                'ewma': dict(zip(FIELDS, self._ewma[slot].tolist())),
+                'drifting': [f for f, d in zip(FIELDS, self._drifting[slot]) if d]
+            }
+
+    def get_stats(self):
+        """计数器，含当前跟踪设备数和统计数组占用字节数"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['devices'] = len(self._slots)
+            stats['memory_bytes'] = self.memory_bytes()
+        return stats
+
+    def memory_bytes(self):
+        """统计数组占用的字节数（上限由 max_devices 决定）"""
+        return sum(a.nbytes for a in (self._count, self._mean, self._m2, self._ewma, self._drifting))
+
+    def _allocate(self, capacity):
+        """分配（或扩容）槽位数组，已有设备的数据原样保留"""
+        old = len(self._count)
+        for name in ('_count', '_mean', '_m2', '_ewma', '_drifting'):
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self._free.extend(range(capacity - 1, old - 1, -1))
+
+    def _slot_for(self, device_id):
+        slot = self._slots.get(device_id)
+        if slot is not None:
+            self._slots.move_to_end(device_id)
+            return slot
+
+        if not self._free:
+            if len(self._count) < self.max_devices:
+                self._allocate(min(len(self._count) * 2, self.max_devices))
+            else:
+                # 淘汰最久未上报的设备，复用其槽位
+                _, evicted = self._slots.popitem(last=False)
+                self._free.append(evicted)
+                self.stats['evicted'] += 1
+        slot = self._free.pop()
+        self._count[slot] = 0
+        self._mean[slot] = 0.0
+        self._m2[slot] = 0.0
+        self._ewma[slot] = 0.0
+        self._drifting[slot] = False
+        self._slots[device_id] = slot
+        return slot
+
+    def _update_device(self, device_id, rows, events):
+        """顺序处理一台设备的若干条记录：读出槽位 → 逐条更新 → 写回槽位"""
+        slot = self._slot_for(device_id)
+        self.stats['updates'] += len(rows)
+        n = int(self._count[slot])
+        mean = self._mean[slot].tolist()
+        m2 = self._m2[slot].tolist()
+        ewma = self._ewma[slot].tolist()
+        drifting = self._drifting[slot].tolist()
+        min_std = self.min_std.tolist()
+        z_threshold, drift_threshold, alpha = self.z_threshold, self.drift_threshold, self.alpha
+
+        for record in rows:
+            ts = record.get('ts')
+            ready = n >= self.min_samples
+            n += 1
+            for i, field in enumerate(FIELDS):
+                value = float(record[field])
+                mu, s2 = mean[i], m2[i]
+                smoothed = value
+
+                # 先用更新前的基线判断单点异常，避免异常值稀释自身的z分数
+                if ready:
+                    std = max(math.sqrt(s2 / (n - 2)), min_std[i])
+                    z = (value - mu) / std
+                    if abs(z) > z_threshold:
+                        events.append(self._event('zscore', device_id, ts, i, value, z))
+                    # 进入EWMA的读数截断到 ±z_threshold 个标准差：单个尖峰不会被当成漂移，持续偏移仍会拉动EWMA
+                    smoothed = mu + max(-z_threshold, min(z, z_threshold)) * std
+
+                # Welford 增量更新均值和二阶矩
+                delta = value - mu
+                mu += delta / n
+                s2 += delta * (value - mu)
+                mean[i], m2[i] = mu, s2
+                ewma[i] = value if n == 1 else ewma[i] + alpha * (smoothed - ewma[i])
+
+                # 漂移：短期水平偏离长期基线；回落到阈值一半以下才解除，避免在阈值附近反复报告
+                if n > self.min_samples:
+                    std = max(math.sqrt(s2 / (n - 1)), min_std[i])
+                    score = (ewma[i] - mu) / std
+                    if abs(score) > drift_threshold:
+                        if not drifting[i]:
+                            events.append(self._event('drift', device_id, ts, i, ewma[i], score))
+                            drifting[i] = True
+                    elif abs(score) <= drift_threshold / 2:
+                        drifting[i] = False
+
+        self._count[slot] = n
+        self._mean[slot] = mean
+        self._m2[slot] = m2
+        self._ewma[slot] = ewma
+        self._drifting[slot] = drifting
+
+    def _event(self, kind, device_id, ts, index, value, score):
+        event = {
+            'kind': kind,
+            'device_id': device_id,
+            'ts': ts,
+            'field': FIELDS[index],
+            'value': round(float(value), 2),
+            'score': round(float(score), 2)
+        }
+        self.stats[kind] += 1
+        self.recent.append(event)
+        return event
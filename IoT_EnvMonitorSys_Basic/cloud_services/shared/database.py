@@ -1,40 +1,139 @@
 import os
+import json
+import heapq
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote
+import numpy as np
+
+# 降采样汇总表：(表名, 桶宽度秒数)，按粒度从细到粗排列
+ROLLUP_LEVELS = (
+    ('sensor_rollup_1m', 60),
+    ('sensor_rollup_1h', 3600),
+    ('sensor_rollup_1d', 86400),
+)
+
+# 汇总的指标：(汇总列前缀, sensor_data列名)
+ROLLUP_METRICS = (
+    ('temp', 'temperature'),
+    ('hum', 'humidity'),
+    ('air', 'air_quality'),
+)
+
+# 分区存储：原始数据按天/按周写入独立的SQLite文件，过期数据直接删除整个文件
+PARTITION_SPANS = {'day': 1, 'week': 7}  # 分区跨度（天）
+PARTITION_ID_SHIFT = 32                  # 分区内 id 从 分区序号 << 32 开始，跨分区保持全局递增
+MAX_ATTACHED_PARTITIONS = 8              # SQLite 默认最多附加10个数据库，超出时按LRU分离
+
+# 列式导出：按 日期/设备 分目录写入 Parquet（需要pyarrow）或每列一个 .npy 文件
+EXPORT_FORMATS = ('auto', 'parquet', 'npy')
+EXPORT_CHUNK_SIZE = 100000
+EXPORT_COLUMNS = (
+    ('id', 'int64'),
+    ('timestamp', 'int64'),
+    ('temperature', 'float32'),
+    ('humidity', 'float32'),
+    ('air_quality', 'float32'),
+)
+
+# 未传入 db_path 时使用的数据库（与本模块同目录）
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sensor_data.db")
+
+# NumPy查询接口返回的结构化数组，字段与 get_recent_data 的字典键一致（timestamp 为空时为0）
+SENSOR_DTYPE = np.dtype([('id', 'i8'), ('temp', 'f8'), ('hum', 'f8'), ('air', 'f8'), ('ts', 'i8')])
+FETCH_CHUNK_SIZE = 4096   # 从游标分块读取的行数
 
 
 class DatabaseManager:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, buffer_size=0, flush_interval_ms=1000,
+                 partition=None, retention_days=None):
+        if partition is not None and partition not in PARTITION_SPANS:
+            raise ValueError(f"不支持的分区方式: {partition}，可选 {list(PARTITION_SPANS)}")
+
+        # 持久连接：写入路径复用同一个连接，避免每条消息 connect/commit/close
+        self._conn = None
+        self._lock = threading.RLock()
+
+        # 缓冲写入模式：buffer_size > 0 时攒满N条或等待T毫秒后批量落盘
+        self.buffer_size = buffer_size
+        self.flush_interval_ms = flush_interval_ms
+        self._buffer = []
+        self._flush_timer = None
+
+        # 分区模式：partition='day'/'week' 时原始数据写入 <库名>_partitions/ 下的分区文件，
+        # 查询时按需附加（ATTACH）；retention_days 为原始数据保留天数（None 表示永久保留）
+        self.partition = partition
+        self.retention_days = retention_days
+        self._attached = OrderedDict()  # 模式名 -> 分区文件路径，按最近使用排序
+
         if db_path is None:
-            # 获取当前脚本所在目录
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            self.db_path = os.path.join(current_dir, "sensor_data.db")
+            self.db_path = DEFAULT_DB_PATH
             print(f"🔄 使用默认路径: {self.db_path}")
         else:
             self.db_path = db_path
-            self.init_database()
             print(f"🔄 使用传入路径: {self.db_path}")
+        self.partition_dir = os.path.splitext(self.db_path)[0] + "_partitions"
+        # 新库直接建表；已有的库（如仓库自带的 sensor_data.db）可能缺少汇总表等后来新增的表，
+        # 在首次写入时才补齐（幂等），只读使用不会修改数据库文件
+        self._schema_ready = False
+        if not os.path.exists(self.db_path):
+            self._ensure_schema()
         
         print(f"📍 最终数据库路径: {os.path.abspath(self.db_path)}")
         print(f"📍 文件存在: {os.path.exists(self.db_path)}")
+
+    def _get_connection(self):
+        """获取持久连接（首次使用时创建）"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # NORMAL：WAL模式下提交不再逐条fsync，仅在检查点时同步
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
     
+    def _ensure_schema(self, create=True):
+        """确保表结构为当前版本，返回是否就绪
+
+        create=True（写入路径）时缺少的表、列和索引由 init_database 补齐；
+        create=False（只读查询）时只检查，不修改数据库
+        """
+        if self._schema_ready:
+            return True
+        with self._lock:
+            if not self._schema_ready:
+                if self._schema_is_current():
+                    self._schema_ready = True
+                elif create:
+                    self.init_database()
+                    self._schema_ready = True
+        return self._schema_ready
+
+    def _schema_is_current(self):
+        """检查主库是否已包含 init_database 创建的全部表、列和索引"""
+        conn = self._get_connection()
+        names = {row[0] for row in conn.execute("SELECT name FROM main.sqlite_master")}
+        required = {'sensor_data', 'ai_analysis', 'analysis_progress',
+                    'idx_sensor_data_device_ts', 'idx_sensor_data_device',
+                    'idx_ai_analysis_sensor', 'idx_ai_analysis_device_time',
+                    'idx_ai_analysis_device_reading'}
+        required.update(table for table, _ in ROLLUP_LEVELS)
+        if not required <= names:
+            return False
+        columns = {row[1] for row in conn.execute("PRAGMA main.table_info(ai_analysis)")}
+        return {'sensor_data_id', 'prediction_confidence', 'anomaly_score'} <= columns
+
     def init_database(self):
         """初始化两个表"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
+
+        # WAL日志模式（持久化到数据库文件）：写入不阻塞读取，批量提交开销更低
+        cursor.execute("PRAGMA journal_mode=WAL")
         
         # 保持现有的传感器表结构
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_id TEXT NOT NULL,
-                temperature REAL,
-                humidity REAL,
-                air_quality REAL,
-                timestamp INTEGER,
-                received_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        self._create_sensor_table(cursor)
         
         # 从sensor_database.py添加AI分析表
         cursor.execute('''
@@ -45,64 +144,866 @@ class DatabaseManager:
                 comfort_score REAL NOT NULL,
                 health_risk TEXT,
                 suggestions TEXT,
-                analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                sensor_data_id INTEGER,
+                prediction_confidence REAL,
+                anomaly_score REAL
+            )
+        ''')
+
+        # 旧数据库补充新增列
+        existing = {row[1] for row in cursor.execute("PRAGMA table_info(ai_analysis)")}
+        for column, column_type in (('sensor_data_id', 'INTEGER'),
+                                    ('prediction_confidence', 'REAL'),
+                                    ('anomaly_score', 'REAL')):
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE ai_analysis ADD COLUMN {column} {column_type}")
+
+        # 每条传感器数据最多一条分析结果（upsert的冲突键）；按设备+时间索引查询最新分析
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_ai_analysis_sensor
+            ON ai_analysis (sensor_data_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ai_analysis_device_time
+            ON ai_analysis (device_id, analyzed_at)
+        ''')
+        # 最新分析按被分析读数的 sensor_data_id 判断（同一秒内批量写入时 analyzed_at 相同）
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ai_analysis_device_reading
+            ON ai_analysis (device_id, sensor_data_id)
+        ''')
+        
+        existing_tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+        # 降采样汇总表：每个桶存 count/min/max/sum，平均值 = sum / count
+        metric_columns = ", ".join(f"{p}_min REAL, {p}_max REAL, {p}_sum REAL" for p, _ in ROLLUP_METRICS)
+        for table, _ in ROLLUP_LEVELS:
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    device_id TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    {metric_columns},
+                    PRIMARY KEY (device_id, bucket)
+                ) WITHOUT ROWID
+            ''')
+        
+        # 增量分析进度：每台设备已分析到的 sensor_data.id（高水位）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_progress (
+                device_id TEXT PRIMARY KEY,
+                last_sensor_id INTEGER NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
         conn.commit()
         conn.close()
+
+        # 已有历史数据的库新建汇总表时，用历史数据补齐汇总
+        if any(table not in existing_tables for table, _ in ROLLUP_LEVELS):
+            self._rebuild_rollups()
     
+
+    @staticmethod
+    def _create_sensor_table(cursor, schema="main"):
+        """在主库或分区库（schema）中创建 sensor_data 表和索引"""
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.sensor_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT NOT NULL,
+                temperature REAL,
+                humidity REAL,
+                air_quality REAL,
+                timestamp INTEGER,
+                received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 按设备+时间的复合索引：单设备时间窗口查询和分页保持 O(log n)
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {schema}.idx_sensor_data_device_ts
+            ON sensor_data (device_id, timestamp)
+        ''')
+        
+        # 按设备+自增id的增量读取（索引隐含rowid，可直接做 id > ? 的范围查找）
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {schema}.idx_sensor_data_device
+            ON sensor_data (device_id)
+        ''')
     
     def save_sensor_data(self, data):
-        """保存传感器数据到数据库"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO sensor_data 
-            (device_id, temperature, humidity, air_quality, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+        """保存传感器数据到数据库（缓冲模式下先写入缓冲区）"""
+        if self.buffer_size > 0:
+            self._buffer_record(data)
+            return
+
+        self.save_sensor_data_batch([data])
+        print(f"Data saved: {data['device_id']} at {datetime.now()}")
+
+    def save_sensor_data_batch(self, records):
+        """批量保存传感器数据：单个事务内 executemany，返回写入条数"""
+        with self._lock:
+            # 先带上缓冲区中尚未落盘的数据，保证写入顺序
+            return self._write_buffered(records)
+
+    def flush(self):
+        """立即将缓冲区数据写入数据库，返回写入条数；写入失败时数据保留在缓冲区"""
+        with self._lock:
+            return self._write_buffered()
+
+    def close(self):
+        """落盘缓冲数据并关闭持久连接"""
+        with self._lock:
+            self.flush()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._attached.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _buffer_record(self, data):
+        """记录进入缓冲区：达到条数阈值立即落盘，否则启动定时落盘"""
+        with self._lock:
+            self._buffer.append(data)
+            if len(self._buffer) >= self.buffer_size:
+                self._write_buffered()
+            else:
+                self._schedule_flush()
+
+    def _schedule_flush(self):
+        """启动定时落盘（调用方持有锁；已有待执行的定时器时不重复启动）"""
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval_ms / 1000.0, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _timed_flush(self):
+        """定时器线程中落盘：异常没有调用方接收，记录后由 _write_buffered 安排的下一次定时落盘重试"""
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"❌ 缓冲数据定时落盘失败，{len(self._buffer)} 条保留在缓冲区等待重试: {e}")
+
+    def _write_buffered(self, records=()):
+        """缓冲区数据连同 records 在一个事务中写入（调用方持有锁）
+
+        失败时缓冲区数据放回缓冲区并重新安排定时落盘（records 由调用方处理），异常继续抛出
+        """
+        buffered = self._take_buffer()
+        try:
+            return self._insert_sensor_rows(buffered + list(records))
+        except Exception:
+            if buffered:
+                self._buffer[:0] = buffered
+                self._schedule_flush()
+            raise
+
+    def _take_buffer(self):
+        """取出缓冲区全部数据并取消待执行的定时落盘（调用方持有锁）"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        records, self._buffer = self._buffer, []
+        return records
+
+    def _insert_sensor_rows(self, records):
+        """executemany 批量插入（调用方持有锁）"""
+        rows = [(
             data.get('device_id'),
             data.get('temp'),
-            data.get('hum'), 
+            data.get('hum'),
             data.get('air'),
             data.get('ts')
-        ))
-        
-        conn.commit()
-        conn.close()
-        print(f"Data saved: {data['device_id']} at {datetime.now()}")
+        ) for data in records]
+        if not rows:
+            return 0
+
+        self._ensure_schema()
+        conn = self._get_connection()
+        if self.partition is None:
+            self._insert_into(conn, "main.sensor_data", rows)
+            return len(rows)
+
+        # 分区模式：按时间戳分组写入各自的分区文件（缺少时间戳的按接收时间归属）
+        now = int(time.time())
+        groups = {}
+        for row in rows:
+            index = self._partition_index(row[4] if row[4] is not None else now)
+            groups.setdefault(index, []).append(row)
+
+        created = False
+        for index, group in sorted(groups.items()):
+            created |= not os.path.exists(self._partition_path(index))
+            schema = self._attach_partition(index, create=True)
+            self._insert_into(conn, f"{schema}.sensor_data", group)
+        if created:
+            self.apply_retention()  # 新分区产生时顺带删除过期分区
+        return len(rows)
+
+    def _insert_into(self, conn, table, rows):
+        """单个事务内写入一张 sensor_data 表并累加汇总表"""
+        with conn:  # 单个事务：成功提交，异常回滚
+            # 立即获取写锁：多个收集进程并发写同一个库时，读取 last_id 和插入之间不会混入其它进程的数据
+            conn.execute("BEGIN IMMEDIATE")
+            last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            conn.executemany(f'''
+                INSERT INTO {table} 
+                (device_id, temperature, humidity, air_quality, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            # 同一事务内把本批新数据（id > last_id，按rowid范围读取）累加到各级汇总表
+            self._update_rollups(conn, table, "WHERE id > ?", (last_id,))
+
+    def _update_rollups(self, conn, table, where, params):
+        """将 sensor_data 表（主库或分区）中满足条件的数据聚合后 upsert 到各级汇总表"""
+        aggregates = ", ".join(
+            f"MIN({column}), MAX({column}), SUM({column})" for _, column in ROLLUP_METRICS)
+        merges = []
+        for prefix, _ in ROLLUP_METRICS:
+            # 多参数 MIN/MAX 遇到 NULL 返回 NULL，用 COALESCE 保留非空的一方
+            merges.append(f"{prefix}_min = MIN(COALESCE({prefix}_min, excluded.{prefix}_min), "
+                          f"COALESCE(excluded.{prefix}_min, {prefix}_min))")
+            merges.append(f"{prefix}_max = MAX(COALESCE({prefix}_max, excluded.{prefix}_max), "
+                          f"COALESCE(excluded.{prefix}_max, {prefix}_max))")
+            merges.append(f"{prefix}_sum = COALESCE({prefix}_sum, 0) + COALESCE(excluded.{prefix}_sum, 0)")
+        metric_columns = ", ".join(f"{p}_min, {p}_max, {p}_sum" for p, _ in ROLLUP_METRICS)
+
+        for rollup, width in ROLLUP_LEVELS:
+            conn.execute(f'''
+                INSERT INTO main.{rollup} (device_id, bucket, count, {metric_columns})
+                SELECT device_id, (timestamp / {width}) * {width}, COUNT(*), {aggregates}
+                FROM {table} NOT INDEXED
+                {where} AND timestamp IS NOT NULL
+                GROUP BY 1, 2
+                ON CONFLICT (device_id, bucket) DO UPDATE SET
+                    count = count + excluded.count,
+                    {", ".join(merges)}
+            ''', params)
+
+    def rebuild_rollups(self):
+        """根据 sensor_data（含全部分区）全量重建汇总表（用于已有历史数据的数据库）"""
+        with self._lock:
+            self._ensure_schema()
+            self._rebuild_rollups()
+
+    def _rebuild_rollups(self):
+        """全量重建汇总表（不检查表结构，供 init_database 调用）"""
+        with self._lock:
+            conn = self._get_connection()
+            with conn:
+                for table, _ in ROLLUP_LEVELS:
+                    conn.execute(f"DELETE FROM {table}")
+            # 附加分区不能在事务中进行，每个数据源单独一个事务
+            for source in self._sensor_sources():
+                with conn:
+                    self._update_rollups(conn, source, "WHERE 1", ())
+
+    def _partition_index(self, ts):
+        """时间戳所属的分区序号（UTC；按周分区从周一开始，1970-01-01 为周四）"""
+        day = int(ts) // 86400
+        return day if self.partition == 'day' else (day + 3) // 7
+
+    def _partition_start(self, index):
+        """分区的起始时间戳"""
+        day = index if self.partition == 'day' else index * 7 - 3
+        return day * 86400
+
+    def _partition_path(self, index):
+        """分区文件路径：<库名>_partitions/sensor_data_<起始日期>.db"""
+        date = datetime.fromtimestamp(self._partition_start(index), tz=timezone.utc)
+        return os.path.join(self.partition_dir, f"sensor_data_{date:%Y%m%d}.db")
+
+    def list_partitions(self):
+        """已存在的分区 [(分区序号, 起始时间戳, 文件路径)]，按时间升序"""
+        if self.partition is None or not os.path.isdir(self.partition_dir):
+            return []
+        partitions = []
+        for name in os.listdir(self.partition_dir):
+            if not (name.startswith("sensor_data_") and name.endswith(".db")):
+                continue
+            date = datetime.strptime(name[len("sensor_data_"):-len(".db")], "%Y%m%d")
+            start = int(date.replace(tzinfo=timezone.utc).timestamp())
+            partitions.append((self._partition_index(start), start, os.path.join(self.partition_dir, name)))
+        return sorted(partitions)
+
+    def _attach_partition(self, index, create=False):
+        """按需附加分区库，返回模式名；分区不存在且 create=False 时返回 None
+
+        调用方持有锁且不在事务中（ATTACH/DETACH 不能在事务内执行）
+        """
+        schema = f"p{index}"
+        if schema in self._attached:
+            self._attached.move_to_end(schema)
+            return schema
+
+        path = self._partition_path(index)
+        exists = os.path.exists(path)
+        if not exists and not create:
+            return None
+
+        conn = self._get_connection()
+        while len(self._attached) >= MAX_ATTACHED_PARTITIONS:
+            oldest, _ = self._attached.popitem(last=False)
+            conn.execute(f"DETACH DATABASE {oldest}")
+
+        os.makedirs(self.partition_dir, exist_ok=True)
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        self._attached[schema] = path
+        conn.execute(f"PRAGMA {schema}.synchronous=NORMAL")
+        if not exists:
+            conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                self._create_sensor_table(conn, schema)
+                # 预置自增序列：分区内 id 从 分区序号 << 32 开始，增量分析的高水位跨分区仍然有效
+                # （其它进程已创建同一分区时跳过）
+                conn.execute(f'''
+                    INSERT INTO {schema}.sqlite_sequence (name, seq)
+                    SELECT 'sensor_data', ?
+                    WHERE NOT EXISTS (SELECT 1 FROM {schema}.sqlite_sequence WHERE name = 'sensor_data')
+                ''', (index << PARTITION_ID_SHIFT,))
+        return schema
+
+    def _sensor_sources(self, since=None, until=None, min_id=None, newest_first=False):
+        """依次产出需要查询的 sensor_data 表名（主库 + 时间/id 范围相交的分区，按需附加）
+
+        调用方持有锁；产出的表名在下一次迭代前有效（超出附加上限时较早的分区会被分离）
+        """
+        indexes = self._source_indexes(since, until, min_id)
+        for index in (reversed(indexes) if newest_first else indexes):
+            yield self._source_table(index)
+
+    def _source_indexes(self, since=None, until=None, min_id=None):
+        """数据源列表（按 id 区间升序）：None 表示主库，其余为与时间/id 范围相交的分区序号"""
+        indexes = [None]
+        span = PARTITION_SPANS.get(self.partition, 0) * 86400
+        for index, start, _ in self.list_partitions():
+            if since is not None and start + span <= since:
+                continue
+            if until is not None and start > until:
+                continue
+            if min_id is not None and (index + 1) << PARTITION_ID_SHIFT <= min_id:
+                continue
+            indexes.append(index)
+        return indexes
+
+    def _source_table(self, index):
+        """数据源的表名（分区按需附加，调用方持有锁）"""
+        if index is None:
+            return "main.sensor_data"
+        return f"{self._attach_partition(index)}.sensor_data"
+
+    def apply_retention(self, retention_days=None, now=None):
+        """删除超过保留期的原始数据，返回 {'partitions_dropped', 'rows_deleted'}
+
+        分区模式下过期分区整个文件直接删除，不产生逐行删除的写放大；
+        主库 sensor_data 中的旧数据按时间戳删除。汇总表保留，用于长时间范围查询
+        """
+        if retention_days is None:
+            retention_days = self.retention_days
+        result = {'partitions_dropped': 0, 'rows_deleted': 0}
+        if retention_days is None:
+            return result
+
+        cutoff = int(now if now is not None else time.time()) - retention_days * 86400
+        span = PARTITION_SPANS.get(self.partition, 0) * 86400
+        with self._lock:
+            self._ensure_schema()
+            conn = self._get_connection()
+            for index, start, path in self.list_partitions():
+                if start + span > cutoff:
+                    continue
+                schema = f"p{index}"
+                if self._attached.pop(schema, None) is not None:
+                    conn.execute(f"DETACH DATABASE {schema}")
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                result['partitions_dropped'] += 1
+
+            with conn:
+                result['rows_deleted'] = conn.execute(
+                    "DELETE FROM main.sensor_data WHERE timestamp < ?", (cutoff,)).rowcount
+        return result
+
+    @staticmethod
+    def choose_rollup_level(resolution):
+        """选择能精确组合出 resolution 秒桶宽的最粗汇总表，返回 (表名, 桶宽)；都不满足时为 (None, 1) 即原始数据"""
+        for table, width in reversed(ROLLUP_LEVELS):
+            if width <= resolution and resolution % width == 0:
+                return table, width
+        return None, 1
+
+    def query_rollup(self, device_id: str, start_ts: int, end_ts: int, resolution=None, max_points: int = 500):
+        """查询时间范围内按 resolution 秒分桶的 min/max/avg/count
+
+        resolution 为 None 时按 max_points 推算，并向上取整到汇总表桶宽的整数倍；
+        自动使用满足分辨率的最粗汇总表，不扫描原始数据
+        """
+        if resolution is None:
+            resolution = max(1, -(-(end_ts - start_ts) // max_points))
+            for _, width in reversed(ROLLUP_LEVELS):
+                if resolution >= width:
+                    resolution = -(-resolution // width) * width
+                    break
+        table, _ = self.choose_rollup_level(resolution)
+        if table is not None and not self._ensure_schema(create=False):
+            table = None  # 尚未迁移的旧库没有汇总表，直接聚合原始数据
+
+        if table is None:
+            bucket, count = "timestamp", "COUNT(*)"
+            metrics = ", ".join(f"MIN({c}), MAX({c}), SUM({c})" for _, c in ROLLUP_METRICS)
+        else:
+            bucket, count = "bucket", "SUM(count)"
+            metrics = ", ".join(f"MIN({p}_min), MAX({p}_max), SUM({p}_sum)" for p, _ in ROLLUP_METRICS)
+
+        sql = f'''
+            SELECT ({bucket} / ?) * ? AS ts, {count}, {metrics}
+            FROM {{source}}
+            WHERE device_id = ? AND {bucket} >= ? AND {bucket} <= ?
+            GROUP BY 1 ORDER BY 1
+        '''
+        aligned_start = (start_ts // resolution) * resolution
+        params = (resolution, resolution, device_id, aligned_start, end_ts)
+        with self._lock:
+            conn = self._get_connection()
+            if table is not None:
+                data = conn.execute(sql.format(source=table), params).fetchall()
+            else:
+                # 原始数据可能分布在多个分区：各自分桶后合并跨分区的同一个桶
+                data = self._merge_buckets(
+                    conn.execute(sql.format(source=source), params).fetchall()
+                    for source in self._sensor_sources(since=aligned_start, until=end_ts))
+
+        results = []
+        for row in data:
+            item = {'ts': row[0], 'count': row[1]}
+            for i, (prefix, _) in enumerate(ROLLUP_METRICS):
+                low, high, total = row[2 + i * 3: 5 + i * 3]
+                item[f'{prefix}_min'] = low
+                item[f'{prefix}_max'] = high
+                item[f'{prefix}_avg'] = total / row[1] if total is not None else None
+            results.append(item)
+        return results
+
+    @staticmethod
+    def _merge_buckets(sources):
+        """合并多个数据源的分桶结果 (ts, count, min, max, sum, ...)，按 ts 升序返回"""
+        merged = {}
+        for rows in sources:
+            for row in rows:
+                current = merged.get(row[0])
+                if current is None:
+                    merged[row[0]] = list(row)
+                    continue
+                current[1] += row[1]
+                for i in range(2, len(row), 3):
+                    low, high, total = row[i:i + 3]
+                    if low is not None:
+                        current[i] = low if current[i] is None else min(current[i], low)
+                        current[i + 1] = high if current[i + 1] is None else max(current[i + 1], high)
+                        current[i + 2] = total if current[i + 2] is None else current[i + 2] + total
+        return [merged[ts] for ts in sorted(merged)]
     
     def get_all_devices(self):
-        """获取数据库中所有的设备ID"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT DISTINCT device_id FROM sensor_data")
-        devices = [row[0] for row in cursor.fetchall()]
-        
-        conn.close()
-        return devices
+        """获取数据库中所有的设备ID（递归CTE逐设备跳跃查找索引，代价与设备数成正比）"""
+        sql = '''
+            WITH RECURSIVE devices(device_id) AS (
+                SELECT MIN(device_id) FROM {source}
+                UNION ALL
+                SELECT (SELECT MIN(device_id) FROM {source} WHERE device_id > devices.device_id)
+                FROM devices WHERE devices.device_id IS NOT NULL
+            )
+            SELECT device_id FROM devices WHERE device_id IS NOT NULL
+        '''
+        devices = set()
+        with self._lock:
+            conn = self._get_connection()
+            for source in self._sensor_sources():
+                devices.update(row[0] for row in conn.execute(sql.format(source=source)))
+        return sorted(devices)
 
-    def get_recent_data(self, device_id: str, hours: int = 24):
-        """获取最近的数据用于AI分析"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 🎯 修改：使用 id 排序而不是时间
-        cursor.execute('''
-            SELECT temperature, humidity, air_quality, timestamp 
-            FROM sensor_data 
+    def get_recent_data(self, device_id: str, hours: int = 24, limit: int = 50, offset: int = 0):
+        """获取最近 hours 小时内的数据用于AI分析（按时间倒序，hours=None 表示不限时间）"""
+        since = int(time.time()) - hours * 3600 if hours is not None else None
+        records, _ = self._query_device_data(device_id, since, None, limit, offset)
+        return records
+
+    def get_data_page(self, device_id: str, cursor=None, page_size: int = 100, since=None):
+        """游标分页查询设备数据（按时间倒序）
+
+        cursor 为上一页返回的 (timestamp, id)，首页传 None；
+        返回 (records, next_cursor)，没有更多数据时 next_cursor 为 None
+        """
+        records, next_cursor = self._query_device_data(device_id, since, cursor, page_size, 0)
+        return records, (next_cursor if len(records) == page_size else None)
+
+    def get_new_data(self, device_id: str, after_id: int, limit: int = 1000):
+        """获取 id 大于 after_id 的新数据（按 id 升序），用于增量分析"""
+        data = self._query_new_data(device_id, after_id, limit, as_array=False)
+        return [{'id': row[0], 'temp': row[1], 'hum': row[2], 'air': row[3], 'ts': row[4]} for row in data]
+
+    def get_recent_array(self, device_id: str, hours: int = 24, limit: int = 50, offset: int = 0):
+        """与 get_recent_data 相同的查询，返回 SENSOR_DTYPE 结构化数组（不逐行创建字典）"""
+        since = int(time.time()) - hours * 3600 if hours is not None else None
+        data, _ = self._query_device_data(device_id, since, None, limit, offset, as_array=True)
+        return data
+
+    def get_new_data_array(self, device_id: str, after_id: int, limit: int = 1000):
+        """与 get_new_data 相同的查询，返回 SENSOR_DTYPE 结构化数组（不逐行创建字典）"""
+        return self._query_new_data(device_id, after_id, limit, as_array=True)
+
+    def _query_new_data(self, device_id, after_id, limit, as_array):
+        sql = f'''
+            SELECT id, temperature, humidity, air_quality, {"IFNULL(timestamp, 0)" if as_array else "timestamp"}
+            FROM {{source}}
+            WHERE device_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        '''
+        parts, count = [], 0
+        with self._lock:
+            conn = self._get_connection()
+            # 数据源按 id 区间升序排列，依次读取直到凑满 limit 条
+            for source in self._sensor_sources(min_id=after_id):
+                cursor = conn.execute(sql.format(source=source), (device_id, after_id, limit - count))
+                part = self._fetch_array(cursor) if as_array else cursor.fetchall()
+                parts.append(part)
+                count += len(part)
+                if count >= limit:
+                    break
+        if as_array:
+            return np.concatenate(parts)
+        return [row for part in parts for row in part]
+
+    @staticmethod
+    def _fetch_array(cursor):
+        """从游标分块读取为 SENSOR_DTYPE 结构化数组，中间只保留一块元组"""
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+            if not rows:
+                break
+            chunks.append(np.fromiter(rows, dtype=SENSOR_DTYPE, count=len(rows)))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=SENSOR_DTYPE)
+
+    def iter_sensor_chunks(self, chunk_size: int = 10000, since=None, until=None, after_id: int = 0):
+        """按 id 升序分块遍历全部设备的传感器数据，每块为
+        [(id, device_id, temperature, humidity, air_quality, timestamp), ...]
+
+        按 id 键集分页，每块单独加锁查询，整表不会一次读入内存；
+        since/until 为时间戳范围（含 since，不含 until）
+        """
+        sql = '''
+            SELECT id, device_id, temperature, humidity, air_quality, timestamp
+            FROM {source}
+            WHERE id > ?
+        '''
+        params = []
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND timestamp < ?"
+            params.append(until)
+        sql += " ORDER BY id LIMIT ?"
+
+        last_id = after_id
+        while True:
+            chunk = []
+            with self._lock:
+                conn = self._get_connection()
+                # 数据源按 id 区间升序排列，从上一块的最后一个 id 之后继续，跨数据源凑满一块
+                for source in self._sensor_sources(since=since, until=until, min_id=last_id):
+                    chunk.extend(conn.execute(sql.format(source=source),
+                                              [last_id] + params + [chunk_size - len(chunk)]).fetchall())
+                    if len(chunk) >= chunk_size:
+                        break
+            if not chunk:
+                return
+            last_id = chunk[-1][0]
+            yield chunk
+
+    def export_columnar(self, output_dir, format='auto', since=None, until=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """将 sensor_data 分块导出为列式文件，返回 {'format', 'rows', 'partitions'}
+
+        目录结构 <output_dir>/date=YYYY-MM-DD/device_id=<设备>/part-<n>.parquet（或 part-<n>/<列名>.npy），
+        并写入 manifest.json；format='auto' 时安装了pyarrow用Parquet，否则用 .npy。
+        按 (device_id, timestamp, id) 键集分页读取，同一设备同一天（UTC）的数据在结果中连续，
+        内存中只保留当前一个 日期/设备 分区的数据；timestamp 为空的记录无法归属日期，不导出
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {format}，可选 {EXPORT_FORMATS}")
+        pq = None
+        if format != 'npy':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                if format == 'parquet':
+                    raise
+        format = 'parquet' if pq is not None else 'npy'
+        if os.path.isdir(output_dir) and os.listdir(output_dir):
+            raise FileExistsError(f"导出目录不为空: {output_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+
+        sql = '''
+            SELECT device_id, id, timestamp, temperature, humidity, air_quality
+            FROM {source}
+            WHERE timestamp IS NOT NULL {after}
+        '''
+        params = []
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND timestamp < ?"
+            params.append(until)
+        sql += " ORDER BY device_id, timestamp, id LIMIT ?"
+        after = "AND (device_id, timestamp, id) > (?, ?, ?)"
+
+        manifest = {'format': format, 'columns': dict(EXPORT_COLUMNS), 'rows': 0, 'partitions': []}
+
+        def write_partition(device_id, day, rows):
+            date = datetime.fromtimestamp(day * 86400, tz=timezone.utc).strftime('%Y-%m-%d')
+            directory = os.path.join(output_dir, f"date={date}", f"device_id={quote(device_id, safe='')}")
+            os.makedirs(directory, exist_ok=True)
+            # 同一设备同一天的数据分布在多个数据源（主库和分区）时写成多个 part
+            part = os.path.join(directory, f"part-{len(os.listdir(directory))}")
+            columns = {name: np.array([row[i] for row in rows], dtype=dtype)
+                       for i, (name, dtype) in enumerate(EXPORT_COLUMNS)}
+            if format == 'parquet':
+                part += ".parquet"
+                pq.write_table(pa.table(columns), part)
+            else:
+                os.makedirs(part)
+                for name, values in columns.items():
+                    np.save(os.path.join(part, f"{name}.npy"), values)
+            manifest['rows'] += len(rows)
+            manifest['partitions'].append({'date': date, 'device_id': device_id, 'rows': len(rows),
+                                           'path': os.path.relpath(part, output_dir)})
+
+        with self._lock:
+            indexes = self._source_indexes(since=since, until=until)
+        for index in indexes:
+            key, group, rows = None, None, []
+            while True:
+                # 每块单独加锁，导出期间不长时间阻塞写入
+                with self._lock:
+                    source = self._source_table(index)
+                    if key is None:
+                        query, query_params = sql.format(source=source, after=""), params
+                    else:
+                        query, query_params = sql.format(source=source, after=after), list(key) + params
+                    chunk = self._get_connection().execute(query, query_params + [chunk_size]).fetchall()
+                for row in chunk:
+                    row_group = (row[0], row[2] // 86400)
+                    if row_group != group:
+                        if rows:
+                            write_partition(*group, rows)
+                        group, rows = row_group, []
+                    rows.append(row[1:])
+                if len(chunk) < chunk_size:
+                    break
+                key = (chunk[-1][0], chunk[-1][2], chunk[-1][1])
+            if rows:
+                write_partition(*group, rows)
+
+        with open(os.path.join(output_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return {'format': format, 'rows': manifest['rows'], 'partitions': len(manifest['partitions'])}
+
+    def get_high_water_marks(self, device_ids=None):
+        """获取设备的增量分析高水位 {device_id: last_sensor_id}"""
+        sql = "SELECT device_id, last_sensor_id FROM analysis_progress"
+        params = ()
+        if device_ids is not None:
+            device_ids = list(device_ids)
+            sql += f" WHERE device_id IN ({','.join('?' * len(device_ids))})"
+            params = device_ids
+        with self._lock:
+            if not self._ensure_schema(create=False):
+                return {}  # 尚未迁移的旧库没有进度表
+            return dict(self._get_connection().execute(sql, params).fetchall())
+
+    def save_analysis_batch(self, analyses, high_water_marks=None):
+        """批量保存AI分析结果（按 sensor_data_id upsert），返回写入条数
+
+        high_water_marks 为 {device_id: last_sensor_id}，与分析结果在同一事务中更新，
+        保证结果写入和进度推进要么都成功要么都失败
+        """
+        rows = [(
+            a['device_id'],
+            a.get('sensor_data_id'),
+            a['environment_type'],
+            a['comfort_score'],
+            a.get('health_risk'),
+            json.dumps(a.get('suggestions', []), ensure_ascii=False),
+            a.get('prediction_confidence'),
+            a.get('anomaly_score')
+        ) for a in analyses]
+        marks = list((high_water_marks or {}).items())
+        if not rows and not marks:
+            return 0
+
+        with self._lock:
+            self._ensure_schema()
+            conn = self._get_connection()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO analysis_progress (device_id, last_sensor_id)
+                    VALUES (?, ?)
+                    ON CONFLICT (device_id) DO UPDATE SET
+                        last_sensor_id = MAX(last_sensor_id, excluded.last_sensor_id),
+                        updated_at = CURRENT_TIMESTAMP
+                ''', marks)
+                conn.executemany('''
+                    INSERT INTO ai_analysis
+                    (device_id, sensor_data_id, environment_type, comfort_score,
+                     health_risk, suggestions, prediction_confidence, anomaly_score)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (sensor_data_id) DO UPDATE SET
+                        environment_type = excluded.environment_type,
+                        comfort_score = excluded.comfort_score,
+                        health_risk = excluded.health_risk,
+                        suggestions = excluded.suggestions,
+                        prediction_confidence = excluded.prediction_confidence,
+                        anomaly_score = excluded.anomaly_score,
+                        analyzed_at = CURRENT_TIMESTAMP
+                ''', rows)
+        return len(rows)
+
+    def get_latest_analysis(self, device_id=None):
+        """获取最新分析结果
+
+        "最新"指被分析的读数最新（sensor_data_id 最大），与写入顺序和 analyzed_at 无关；
+        没有 sensor_data_id 的旧版本记录排在后面，按 analyzed_at 排序。
+        指定 device_id 时返回该设备最新一条（无结果返回 None）；
+        不指定时返回每台设备各自最新一条，通过索引逐设备跳跃查找，不扫描全表
+        """
+        columns = '''
+            a.device_id, a.sensor_data_id, a.environment_type, a.comfort_score, a.health_risk,
+            a.suggestions, a.prediction_confidence, a.anomaly_score, a.analyzed_at
+        '''
+        latest_id = '''
+            SELECT id FROM ai_analysis
+            WHERE device_id = {device}
+            ORDER BY sensor_data_id DESC, analyzed_at DESC, id DESC LIMIT 1
+        '''
+        if device_id is not None:
+            sql = f"SELECT {columns} FROM ai_analysis a WHERE a.id = ({latest_id.format(device='?')})"
+            params = (device_id,)
+        else:
+            # 递归CTE：每一步用索引取下一个更大的 device_id
+            sql = f'''
+                WITH RECURSIVE devices(device_id) AS (
+                    SELECT MIN(device_id) FROM ai_analysis
+                    UNION ALL
+                    SELECT (SELECT MIN(device_id) FROM ai_analysis WHERE device_id > devices.device_id)
+                    FROM devices WHERE devices.device_id IS NOT NULL
+                )
+                SELECT {columns} FROM devices
+                JOIN ai_analysis a ON a.id = ({latest_id.format(device='devices.device_id')})
+            '''
+            params = ()
+
+        with self._lock:
+            # 尚未迁移的旧库中没有带 sensor_data_id 的分析结果
+            data = self._get_connection().execute(sql, params).fetchall() \
+                if self._ensure_schema(create=False) else []
+
+        results = [{
+            'device_id': row[0],
+            'sensor_data_id': row[1],
+            'environment_type': row[2],
+            'comfort_score': row[3],
+            'health_risk': row[4],
+            'suggestions': json.loads(row[5]) if row[5] else [],
+            'prediction_confidence': row[6],
+            'anomaly_score': row[7],
+            'analyzed_at': row[8]
+        } for row in data]
+        if device_id is not None:
+            return results[0] if results else None
+        return results
+
+    def _query_device_data(self, device_id, since, cursor, limit, offset, as_array=False):
+        """按 (device_id, timestamp) 索引倒序扫描，返回 (records, 最后一行的游标)
+
+        分区模式下只查询与时间范围相交的分区，各分区取前 offset+limit 条后归并；
+        as_array=True 时 records 为 SENSOR_DTYPE 结构化数组
+        """
+        sql = f'''
+            SELECT id, temperature, humidity, air_quality, {"IFNULL(timestamp, 0)" if as_array else "timestamp"}
+            FROM {{source}} 
             WHERE device_id = ?
-            ORDER BY id DESC
-            LIMIT 50
-        ''', (device_id,))
-        
-        data = cursor.fetchall()
-        conn.close()
+        '''
+        params = [device_id]
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            params.append(since)
+        if cursor is not None:
+            sql += " AND (timestamp, id) < (?, ?)"
+            params.extend(cursor)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+
+        with self._lock:
+            conn = self._get_connection()
+            sources = self._sensor_sources(since=since, until=cursor[0] if cursor else None, newest_first=True)
+            if self.partition is None:
+                rows = conn.execute(sql.format(source=next(sources)), params + [limit, offset])
+                data = self._fetch_array(rows) if as_array else rows.fetchall()
+            elif as_array:
+                merged = np.concatenate([
+                    self._fetch_array(conn.execute(sql.format(source=source), params + [limit + offset, 0]))
+                    for source in sources])
+                # 与 SQL 排序一致：按 (timestamp, id) 倒序，timestamp 为空（0）的排在最后
+                order = np.lexsort((merged['id'], merged['ts']))[::-1]
+                data = merged[order[offset:offset + limit]]
+            else:
+                parts = [conn.execute(sql.format(source=source), params + [limit + offset, 0]).fetchall()
+                         for source in sources]
+                # 与 SQL 排序一致：timestamp 为 NULL 的排在最后
+                merged = heapq.merge(*parts, key=lambda row: (row[4] is not None, row[4] or 0, row[0]),
+                                     reverse=True)
+                data = list(merged)[offset:offset + limit]
 
-        return [{'temp': row[0], 'hum': row[1], 'air': row[2], 'ts': row[3]} for row in data]
+        if as_array:
+            return data, ((int(data['ts'][-1]), int(data['id'][-1])) if len(data) else None)
+        records = [{'id': row[0], 'temp': row[1], 'hum': row[2], 'air': row[3], 'ts': row[4]} for row in data]
+        last_cursor = (data[-1][4], data[-1][0]) if data else None
+        return records, last_cursor
+
+
+def load_columnar(output_dir, device_id=None, date=None, mmap_mode='r'):
+    """依次产出 export_columnar 导出的分区 (分区信息, {列名: 数组})，可按设备和日期（YYYY-MM-DD）过滤
+
+    .npy 以内存映射方式打开（mmap_mode=None 时读入内存）；Parquet 通过内存映射读取，
+    无空值的数值列转换为NumPy数组时不复制
+    """
+    with open(os.path.join(output_dir, "manifest.json"), encoding='utf-8') as f:
+        manifest = json.load(f)
+    for entry in manifest['partitions']:
+        if device_id is not None and entry['device_id'] != device_id:
+            continue
+        if date is not None and entry['date'] != date:
+            continue
+        path = os.path.join(output_dir, entry['path'])
+        if manifest['format'] == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(path, memory_map=True)
+            columns = {name: table.column(name).to_numpy() for name in table.column_names}
+        else:
+            columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                       for name in manifest['columns']}
+        yield entry, columns
 
 
 # 测试数据库创建
@@ -18,6 +18,16 @@
 #define MQTT_CLIENT_ID "env_monitor_" DEVICE_ID
 #define MQTT_KEEPALIVE 60
 #define MQTT_QOS 1
+#define MQTT_CONNECT_TIMEOUT_MS 3000   // TCP连接、CONNACK和单次发送的超时
+#define MQTT_RECONNECT_DELAY_MIN_S 5   // 重连失败后的首次退避间隔，之后每次翻倍
+#define MQTT_RECONNECT_DELAY_MAX_S 300 // 重连退避间隔上限
+#define MQTT_PUBLISH_BATCH 32          // 发送缓冲区攒够多少条读数后一次发出
+#define MQTT_SEND_BUFFER_SIZE 8192     // 发送缓冲区大小（字节）
+#define MQTT_RECORDS_PER_MESSAGE 64    // 合并发布时每条消息的读数上限
+#define MQTT_DEFAULT_PAYLOAD_FORMAT MQTT_PAYLOAD_JSON  // 或 MQTT_PAYLOAD_BINARY（每条读数22字节）
+
+// 离线缓存配置：断线期间保留最近的读数，重连后合并补发
+#define OFFLINE_BUFFER_CAPACITY 720    // 5秒采样时约1小时的数据（每条20字节）
 
 
 #define MQTT_TOPIC_SENSOR "sensors/data"
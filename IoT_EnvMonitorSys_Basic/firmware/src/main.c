@@ -2,6 +2,7 @@
 #include "config.h"
 #include "sensor_emulator.h"
 #include "mqtt_client.h"
+#include "offline_buffer.h"
 #include <stdio.h>
 #include <string.h>
 #include <time.h>
@@ -63,18 +64,27 @@ int main(void) {
                 //        sensor_data.temperature, sensor_data.humidity, 
                 //        sensor_data.air_quality);
                 
-                // 发布到MQTT
+                // 发布到MQTT；离线缓存中还有数据时先补发，保证读数按时间顺序到达
                 if (mqtt_is_connected()) {
-                    if (mqtt_publish_sensor_data(&sensor_data) != RESULT_OK) {
+                    if (offline_buffer_count() > 0) {
+                        offline_buffer_flush();
+                    }
+                    if (offline_buffer_count() > 0 ||
+                        mqtt_publish_sensor_data(&sensor_data) != RESULT_OK) {
                         printf("Failed to publish sensor data: %s\n", 
                                mqtt_get_last_error());
+                        offline_buffer_push(&sensor_data);
                     }
                 } else {
-                    printf("[MQTT] Offline - data not sent\n");
+                    offline_buffer_push(&sensor_data);
+                    printf("[MQTT] Offline - buffered %u readings\n", offline_buffer_count());
                     
-                    // 尝试重新连接
-                    if (mqtt_connect() == RESULT_OK) {
+                    // 按退避间隔尝试重新连接，成功后合并补发离线期间的读数
+                    if (mqtt_reconnect() == RESULT_OK) {
                         printf("[MQTT] Reconnected successfully\n");
+                        if (offline_buffer_flush() == RESULT_OK) {
+                            printf("[MQTT] Offline readings forwarded\n");
+                        }
                     }
                 }
             }
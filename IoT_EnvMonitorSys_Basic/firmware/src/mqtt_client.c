@@ -1,16 +1,59 @@
 ﻿#define ENV_MONITOR_DLL_EXPORTS
 #include "common.h"
 #include "config.h"
+#include "mqtt_client.h"
+#include "offline_buffer.h"
 #include <stdio.h>
 #include <string.h>
 #include <stdlib.h>
 #include <time.h>
 #ifdef _WIN32
+#include <winsock2.h>
+#include <ws2tcpip.h>
 #include <windows.h>
+#ifdef _MSC_VER
+#pragma comment(lib, "ws2_32.lib")
+#endif
+typedef SOCKET mqtt_socket_t;
+#define MQTT_INVALID_SOCKET INVALID_SOCKET
+#define mqtt_close_socket closesocket
 #else
 #include <unistd.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <netdb.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <sys/select.h>
+#include <sys/socket.h>
+#include <sys/time.h>
+typedef int mqtt_socket_t;
+#define MQTT_INVALID_SOCKET (-1)
+#define mqtt_close_socket close
+#endif
+
+// 连接断开时 send 不触发 SIGPIPE（否则会直接结束进程）
+#ifdef MSG_NOSIGNAL
+#define MQTT_SEND_FLAGS MSG_NOSIGNAL
+#else
+#define MQTT_SEND_FLAGS 0
 #endif
 
+// MQTT 3.1.1 报文类型（固定头高4位）
+#define MQTT_PACKET_CONNECT    0x10
+#define MQTT_PACKET_CONNACK    0x20
+#define MQTT_PACKET_PUBLISH    0x30   // QoS 0，无报文标识符
+#define MQTT_PACKET_PINGREQ    0xC0
+#define MQTT_PACKET_DISCONNECT 0xE0
+
+// 二进制负载
+#define BINARY_PAYLOAD_VERSION 1
+#define BINARY_HEADER_SIZE 4
+#define BINARY_RECORD_SIZE 22
+
+// 发送缓冲区中尚未发出的读数最多保留多少条副本（至少容纳两条合并消息）
+#define MQTT_UNSENT_CAPACITY (2 * MQTT_RECORDS_PER_MESSAGE)
+
 // 添加缺失的函数实现
 uint32_t get_current_time_ms(void) {
     return (uint32_t)(clock() * 1000 / CLOCKS_PER_SEC);
@@ -24,63 +67,582 @@ void network_delay_ms(uint32_t ms) {
     #endif
 }
 
-// 简化的MQTT客户端状态
-static bool connected = true;
+// MQTT客户端状态：一个长连接 + 待发送缓冲区
+static mqtt_socket_t mqtt_socket = MQTT_INVALID_SOCKET;
+static mqtt_state_t mqtt_state = MQTT_STATE_DISCONNECTED;
+static char broker_host[64] = MQTT_BROKER;
+static uint16_t broker_port = MQTT_PORT;
+static char last_error[128] = "No error";
+static uint32_t last_send_time = 0;      // 最近一次发送的时间（秒），用于保活
+static mqtt_payload_format_t payload_format = MQTT_DEFAULT_PAYLOAD_FORMAT;
+static uint32_t reconnect_delay = 0;     // 当前重连退避间隔（秒），0 表示可以立即重连
+static uint32_t next_reconnect_time = 0;
+
+// 多条PUBLISH报文先写入缓冲区，攒够一批（或主循环调用 mqtt_process）时一次 send 发出
+static uint8_t send_buffer[MQTT_SEND_BUFFER_SIZE];
+static size_t send_length = 0;
+static uint32_t pending_count = 0;
+
+// 已进入发送缓冲区、尚未写入套接字的读数副本：断线时放回离线缓存，不随缓冲区丢弃
+static sensor_data_t unsent[MQTT_UNSENT_CAPACITY];
+static uint32_t unsent_count = 0;
+
+
+static void set_error(const char* message) {
+    snprintf(last_error, sizeof(last_error), "%s", message);
+}
+
+
+// 关闭连接：缓冲区中未发出的读数放回离线缓存，重连后补发
+static void close_connection(mqtt_state_t state) {
+    if (mqtt_socket != MQTT_INVALID_SOCKET) {
+        mqtt_close_socket(mqtt_socket);
+        mqtt_socket = MQTT_INVALID_SOCKET;
+    }
+    if (unsent_count > 0) {
+        offline_buffer_requeue(unsent, unsent_count);
+        unsent_count = 0;
+    }
+    send_length = 0;
+    pending_count = 0;
+    mqtt_state = state;
+}
+
+
+static result_code_t send_all(const uint8_t* data, size_t length) {
+    while (length > 0) {
+        int sent = send(mqtt_socket, (const char*)data, (int)length, MQTT_SEND_FLAGS);
+        if (sent <= 0) {
+            set_error("Send failed, connection lost");
+            close_connection(MQTT_STATE_ERROR);
+            return RESULT_NETWORK_ERROR;
+        }
+        data += sent;
+        length -= (size_t)sent;
+    }
+    last_send_time = get_timestamp();
+    return RESULT_OK;
+}
+
+
+// 等待套接字可读，超时返回0
+static int wait_readable(uint32_t timeout_ms) {
+    fd_set readable;
+    struct timeval timeout;
+    FD_ZERO(&readable);
+    FD_SET(mqtt_socket, &readable);
+    timeout.tv_sec = timeout_ms / 1000;
+    timeout.tv_usec = (timeout_ms % 1000) * 1000;
+    return select((int)mqtt_socket + 1, &readable, NULL, NULL, &timeout);
+}
+
+
+// 切换阻塞/非阻塞模式
+static int set_blocking(mqtt_socket_t sock, bool blocking) {
+#ifdef _WIN32
+    u_long mode = blocking ? 0 : 1;
+    return ioctlsocket(sock, FIONBIO, &mode) == 0 ? 0 : -1;
+#else
+    int flags = fcntl(sock, F_GETFL, 0);
+    if (flags < 0) return -1;
+    flags = blocking ? (flags & ~O_NONBLOCK) : (flags | O_NONBLOCK);
+    return fcntl(sock, F_SETFL, flags);
+#endif
+}
+
+
+// 非阻塞 connect，最多等待 timeout_ms（代理不可达时不会卡住主循环），成功后恢复阻塞模式
+static int connect_with_timeout(mqtt_socket_t sock, const struct addrinfo* address, uint32_t timeout_ms) {
+    if (set_blocking(sock, false) != 0) return -1;
+    if (connect(sock, address->ai_addr, (int)address->ai_addrlen) != 0) {
+#ifdef _WIN32
+        if (WSAGetLastError() != WSAEWOULDBLOCK) return -1;
+#else
+        if (errno != EINPROGRESS) return -1;
+#endif
+        fd_set writable, failed;
+        struct timeval timeout;
+        FD_ZERO(&writable);
+        FD_ZERO(&failed);
+        FD_SET(sock, &writable);
+        FD_SET(sock, &failed);   // Windows 通过异常集合报告连接失败
+        timeout.tv_sec = timeout_ms / 1000;
+        timeout.tv_usec = (timeout_ms % 1000) * 1000;
+        if (select((int)sock + 1, NULL, &writable, &failed, &timeout) <= 0) return -1;
+
+        int error = 0;
+        socklen_t error_length = sizeof(error);
+        if (getsockopt(sock, SOL_SOCKET, SO_ERROR, (char*)&error, &error_length) != 0 || error != 0) {
+            return -1;
+        }
+    }
+    return set_blocking(sock, true);
+}
+
+
+// 发送超时：代理停止读取时 send 不会无限阻塞
+static void set_send_timeout(mqtt_socket_t sock, uint32_t timeout_ms) {
+#ifdef _WIN32
+    DWORD timeout = timeout_ms;
+#else
+    struct timeval timeout;
+    timeout.tv_sec = timeout_ms / 1000;
+    timeout.tv_usec = (timeout_ms % 1000) * 1000;
+#endif
+    setsockopt(sock, SOL_SOCKET, SO_SNDTIMEO, (const char*)&timeout, sizeof(timeout));
+}
+
+
+// 剩余长度的变长编码，返回写入的字节数
+static size_t encode_remaining_length(uint8_t* out, size_t length) {
+    size_t i = 0;
+    do {
+        uint8_t byte = length % 128;
+        length /= 128;
+        out[i++] = length > 0 ? (byte | 0x80) : byte;
+    } while (length > 0);
+    return i;
+}
+
+
+static size_t encode_string(uint8_t* out, const char* text, size_t length) {
+    out[0] = (uint8_t)(length >> 8);
+    out[1] = (uint8_t)(length & 0xFF);
+    memcpy(out + 2, text, length);
+    return length + 2;
+}
+
+
+// 按小端写入，与主机字节序和结构体填充无关
+static size_t put_u16(uint8_t* out, uint16_t value) {
+    out[0] = (uint8_t)(value & 0xFF);
+    out[1] = (uint8_t)(value >> 8);
+    return 2;
+}
+
+static size_t put_u32(uint8_t* out, uint32_t value) {
+    for (int i = 0; i < 4; i++) {
+        out[i] = (uint8_t)(value >> (8 * i));
+    }
+    return 4;
+}
+
+static size_t put_f32(uint8_t* out, float value) {
+    uint32_t bits;
+    memcpy(&bits, &value, sizeof(bits));
+    return put_u32(out, bits);
+}
+
+
+// 设备ID的32位FNV-1a哈希，写入每条读数供收集端校验
+static uint32_t device_id_hash(const char* device_id) {
+    uint32_t hash = 2166136261u;
+    while (*device_id) {
+        hash ^= (uint8_t)*device_id++;
+        hash *= 16777619u;
+    }
+    return hash;
+}
+
+
+// 编码二进制帧，返回字节数
+static size_t encode_binary_frame(uint8_t* out, const sensor_data_t* data, uint32_t count) {
+    size_t id_length = strlen(DEVICE_ID);
+    uint32_t hash = device_id_hash(DEVICE_ID);
+    size_t length = 0;
+    
+    out[length++] = BINARY_PAYLOAD_VERSION;
+    length += put_u16(out + length, (uint16_t)count);
+    out[length++] = (uint8_t)id_length;
+    memcpy(out + length, DEVICE_ID, id_length);
+    length += id_length;
+    for (uint32_t i = 0; i < count; i++) {
+        length += put_u32(out + length, hash);
+        length += put_f32(out + length, data[i].temperature);
+        length += put_f32(out + length, data[i].humidity);
+        length += put_f32(out + length, data[i].air_quality);
+        length += put_u32(out + length, data[i].timestamp);
+        length += put_u16(out + length, data[i].sequence);
+    }
+    return length;
+}
+
+
+result_code_t mqtt_client_set_payload_format(mqtt_payload_format_t format) {
+    if (format != MQTT_PAYLOAD_JSON && format != MQTT_PAYLOAD_BINARY) {
+        return RESULT_INVALID_PARAM;
+    }
+    payload_format = format;
+    return RESULT_OK;
+}
+
+
+result_code_t mqtt_client_configure(const char* host, uint16_t port) {
+    if (host == NULL || strlen(host) >= sizeof(broker_host) || port == 0) {
+        return RESULT_INVALID_PARAM;
+    }
+    snprintf(broker_host, sizeof(broker_host), "%s", host);
+    broker_port = port;
+    reconnect_delay = 0;
+    return RESULT_OK;
+}
+
 
 result_code_t mqtt_client_init(void) {
-    printf("[MQTT] Initializing (simplified version)\n");
+#ifdef _WIN32
+    WSADATA wsa_data;
+    if (WSAStartup(MAKEWORD(2, 2), &wsa_data) != 0) {
+        set_error("WSAStartup failed");
+        return RESULT_NETWORK_ERROR;
+    }
+#endif
+    printf("[MQTT] Initializing, broker %s:%u\n", broker_host, broker_port);
     return RESULT_OK;
 }
 
+
 result_code_t mqtt_connect(void) {
-    printf("[MQTT] Connected (simplified)\n");
-    connected = true;
+    if (mqtt_socket != MQTT_INVALID_SOCKET) {
+        close_connection(MQTT_STATE_DISCONNECTED);
+    }
+    mqtt_state = MQTT_STATE_CONNECTING;
+
+    // 建立TCP连接
+    char port_text[8];
+    struct addrinfo hints, *addresses = NULL, *address;
+    memset(&hints, 0, sizeof(hints));
+    hints.ai_family = AF_UNSPEC;
+    hints.ai_socktype = SOCK_STREAM;
+    snprintf(port_text, sizeof(port_text), "%u", broker_port);
+    if (getaddrinfo(broker_host, port_text, &hints, &addresses) != 0) {
+        set_error("Cannot resolve broker address");
+        mqtt_state = MQTT_STATE_ERROR;
+        return RESULT_NETWORK_ERROR;
+    }
+    for (address = addresses; address != NULL; address = address->ai_next) {
+        mqtt_socket = socket(address->ai_family, address->ai_socktype, address->ai_protocol);
+        if (mqtt_socket == MQTT_INVALID_SOCKET) continue;
+        if (connect_with_timeout(mqtt_socket, address, MQTT_CONNECT_TIMEOUT_MS) == 0) break;
+        mqtt_close_socket(mqtt_socket);
+        mqtt_socket = MQTT_INVALID_SOCKET;
+    }
+    freeaddrinfo(addresses);
+    if (mqtt_socket == MQTT_INVALID_SOCKET) {
+        set_error("Cannot connect to broker");
+        mqtt_state = MQTT_STATE_ERROR;
+        return RESULT_NETWORK_ERROR;
+    }
+
+    // 批量报文已在应用层合并，关闭Nagle避免额外延迟
+    int no_delay = 1;
+    setsockopt(mqtt_socket, IPPROTO_TCP, TCP_NODELAY, (const char*)&no_delay, sizeof(no_delay));
+    set_send_timeout(mqtt_socket, MQTT_CONNECT_TIMEOUT_MS);
+
+    // CONNECT：协议名 "MQTT"、级别4、Clean Session、保活时间、客户端ID
+    uint8_t packet[128];
+    uint8_t body[96];
+    size_t body_length = encode_string(body, "MQTT", 4);
+    body[body_length++] = 4;
+    body[body_length++] = 0x02;
+    body[body_length++] = (uint8_t)(MQTT_KEEPALIVE >> 8);
+    body[body_length++] = (uint8_t)(MQTT_KEEPALIVE & 0xFF);
+    body_length += encode_string(body + body_length, MQTT_CLIENT_ID, strlen(MQTT_CLIENT_ID));
+
+    packet[0] = MQTT_PACKET_CONNECT;
+    size_t length = 1 + encode_remaining_length(packet + 1, body_length);
+    memcpy(packet + length, body, body_length);
+    if (send_all(packet, length + body_length) != RESULT_OK) {
+        return RESULT_NETWORK_ERROR;
+    }
+
+    // 等待CONNACK（4字节，返回码0表示接受）
+    uint8_t connack[4];
+    size_t received = 0;
+    while (received < sizeof(connack)) {
+        if (wait_readable(MQTT_CONNECT_TIMEOUT_MS) <= 0) {
+            set_error("CONNACK timeout");
+            close_connection(MQTT_STATE_ERROR);
+            return RESULT_MQTT_ERROR;
+        }
+        int n = recv(mqtt_socket, (char*)connack + received, (int)(sizeof(connack) - received), 0);
+        if (n <= 0) {
+            set_error("Connection closed before CONNACK");
+            close_connection(MQTT_STATE_ERROR);
+            return RESULT_NETWORK_ERROR;
+        }
+        received += (size_t)n;
+    }
+    if (connack[0] != MQTT_PACKET_CONNACK || connack[3] != 0) {
+        set_error("Connection refused by broker");
+        close_connection(MQTT_STATE_ERROR);
+        return RESULT_MQTT_ERROR;
+    }
+
+    mqtt_state = MQTT_STATE_CONNECTED;
+    reconnect_delay = 0;
+    set_error("No error");
+    printf("[MQTT] Connected to %s:%u\n", broker_host, broker_port);
     return RESULT_OK;
 }
 
+// 断线后由主循环调用：连续失败时重连间隔从 MQTT_RECONNECT_DELAY_MIN_S 起翻倍，
+// 最长 MQTT_RECONNECT_DELAY_MAX_S；退避期间直接返回，不发起连接
+result_code_t mqtt_reconnect(void) {
+    uint32_t now = get_timestamp();
+    if (reconnect_delay > 0 && (int32_t)(now - next_reconnect_time) < 0) {
+        set_error("Waiting to reconnect");
+        return RESULT_NETWORK_ERROR;
+    }
+
+    result_code_t result = mqtt_connect();
+    if (result != RESULT_OK) {
+        reconnect_delay = reconnect_delay == 0 ? MQTT_RECONNECT_DELAY_MIN_S : reconnect_delay * 2;
+        if (reconnect_delay > MQTT_RECONNECT_DELAY_MAX_S) {
+            reconnect_delay = MQTT_RECONNECT_DELAY_MAX_S;
+        }
+        next_reconnect_time = now + reconnect_delay;
+    }
+    return result;
+}
+
 void mqtt_disconnect(void) {
+    if (mqtt_state == MQTT_STATE_CONNECTED && mqtt_flush() == RESULT_OK) {
+        const uint8_t packet[2] = {MQTT_PACKET_DISCONNECT, 0};
+        send_all(packet, sizeof(packet));
+    }
+    close_connection(MQTT_STATE_DISCONNECTED);
     printf("[MQTT] Disconnected\n");
-    connected = false;
 }
 
 bool mqtt_is_connected(void) {
-    return connected;
+    return mqtt_state == MQTT_STATE_CONNECTED;
+}
+
+mqtt_state_t mqtt_get_state(void) {
+    return mqtt_state;
+}
+
+
+result_code_t mqtt_flush(void) {
+    if (send_length == 0) {
+        return RESULT_OK;
+    }
+    if (mqtt_state != MQTT_STATE_CONNECTED) {
+        return RESULT_MQTT_ERROR;
+    }
+    result_code_t result = send_all(send_buffer, send_length);
+    send_length = 0;
+    pending_count = 0;
+    unsent_count = 0;
+    return result;
 }
 
-result_code_t mqtt_publish_sensor_data(const sensor_data_t* data) {
-    if (!connected) return RESULT_MQTT_ERROR;
+
+// 把一条消息编码为PUBLISH报文追加到发送缓冲区，满一批时发出
+// readings 为消息中读数的副本（NULL 表示不跟踪）：写入缓冲区后即返回 RESULT_OK，
+// 之后发送失败时这些读数由 close_connection 放回离线缓存
+static result_code_t queue_publish(const char* topic, const void* payload, size_t payload_length,
+                                   const sensor_data_t* readings, uint32_t reading_count) {
+    size_t topic_length = strlen(topic);
+    size_t remaining = 2 + topic_length + payload_length;
+    size_t packet_length = 1 + (remaining < 128 ? 1 : remaining < 16384 ? 2 : 3) + remaining;
+    if (packet_length > sizeof(send_buffer)) {
+        set_error("Payload too large");
+        return RESULT_INVALID_PARAM;
+    }
+    bool track = readings != NULL;
+    if ((send_length + packet_length > sizeof(send_buffer) ||
+         (track && unsent_count + reading_count > MQTT_UNSENT_CAPACITY)) && mqtt_flush() != RESULT_OK) {
+        return RESULT_NETWORK_ERROR;
+    }
+
+    uint8_t* out = send_buffer + send_length;
+    out[0] = MQTT_PACKET_PUBLISH;
+    size_t length = 1 + encode_remaining_length(out + 1, remaining);
+    length += encode_string(out + length, topic, topic_length);
+    memcpy(out + length, payload, payload_length);
+    send_length += length + payload_length;
+    if (track) {
+        memcpy(&unsent[unsent_count], readings, reading_count * sizeof(sensor_data_t));
+        unsent_count += reading_count;
+    }
+
+    if (++pending_count >= MQTT_PUBLISH_BATCH) {
+        result_code_t result = mqtt_flush();
+        if (!track) return result;
+    }
+    return RESULT_OK;
+}
+
+
+static result_code_t queue_sensor_data(const sensor_data_t* data) {
+    if (payload_format == MQTT_PAYLOAD_BINARY) {
+        uint8_t frame[BINARY_HEADER_SIZE + sizeof(DEVICE_ID) + BINARY_RECORD_SIZE];
+        return queue_publish(MQTT_TOPIC_DATA, frame, encode_binary_frame(frame, data, 1), data, 1);
+    }
 
     // 生成JSON
-    char payload[512];
-    snprintf(payload, sizeof(payload),
+    char payload[256];
+    int payload_length = snprintf(payload, sizeof(payload),
         "{\"device_id\":\"%s\",\"temp\":%.2f,\"hum\":%.2f,\"air\":%.2f,\"ts\":%lu}",
-        DEVICE_ID, data->temperature, data->humidity, data->air_quality, data->timestamp);
-    
-    printf("[MQTT] 生成的JSON: %s\n", payload);
-    
+        DEVICE_ID, data->temperature, data->humidity, data->air_quality, (unsigned long)data->timestamp);
+    if (payload_length < 0 || (size_t)payload_length >= sizeof(payload)) {
+        set_error("Payload too large");
+        return RESULT_INVALID_PARAM;
+    }
+    return queue_publish(MQTT_TOPIC_DATA, payload, (size_t)payload_length, data, 1);
+}
 
-    char command[1024];
-    snprintf(command, sizeof(command), 
-             "cd /d \"C:\\Program Files\\mosquitto\" && mosquitto_pub.exe -t \"%s\" -m \"%s\"", 
-             MQTT_TOPIC_DATA, payload);
-    
-    printf("[MQTT] 执行命令: %s\n", command);
-    int result = system(command);
-    
-    
-    printf("[MQTT] 结果: %d\n", result);
-    return (result == 0) ? RESULT_OK : RESULT_ERROR;
+
+// 读数进入发送缓冲区，攒满 MQTT_PUBLISH_BATCH 条或下次 mqtt_process 时随同一批发出
+result_code_t mqtt_publish_sensor_data(const sensor_data_t* data) {
+    if (data == NULL) return RESULT_INVALID_PARAM;
+    if (mqtt_state != MQTT_STATE_CONNECTED) {
+        set_error("Not connected");
+        return RESULT_MQTT_ERROR;
+    }
+    return queue_sensor_data(data);
+}
+
+
+// 中途断线时，尚未进入缓冲区的读数也转入离线缓存，调用方无需再缓存本批读数
+static void requeue_remaining(const sensor_data_t* data, uint32_t count) {
+    for (uint32_t i = 0; i < count; i++) {
+        offline_buffer_push(&data[i]);
+    }
+}
+
+
+// 批量发布：count 条读数编码后按批发送，最后立即发出剩余部分
+// 开始发送后出错时，未发出的读数都已转入离线缓存
+result_code_t mqtt_publish_sensor_batch(const sensor_data_t* data, uint32_t count) {
+    if (data == NULL && count > 0) return RESULT_INVALID_PARAM;
+    if (mqtt_state != MQTT_STATE_CONNECTED) {
+        set_error("Not connected");
+        return RESULT_MQTT_ERROR;
+    }
+    for (uint32_t i = 0; i < count; i++) {
+        result_code_t result = queue_sensor_data(&data[i]);
+        if (result != RESULT_OK) {
+            requeue_remaining(&data[i], count - i);
+            return result;
+        }
+    }
+    return mqtt_flush();
+}
+
+
+// JSON编码多条读数：在 size 字节内尽量多放，*count 更新为实际编码的条数
+// 放不下的读数（数值位数超出预估时）留给下一条消息；一条都放不下时返回0
+static size_t encode_json_records(char* payload, size_t size, const sensor_data_t* data, uint32_t* count) {
+    static const char tail[] = "]}";
+    int written = snprintf(payload, size, "{\"device_id\":\"%s\",\"records\":[", DEVICE_ID);
+    if (written < 0 || (size_t)written + sizeof(tail) >= size) return 0;
+
+    size_t length = (size_t)written;
+    uint32_t encoded = 0;
+    for (; encoded < *count; encoded++) {
+        // 为结尾的 "]}" 预留空间，截断的读数不计入长度
+        size_t available = size - length - (sizeof(tail) - 1);
+        written = snprintf(payload + length, available, "%s[%.2f,%.2f,%.2f,%lu]",
+                           encoded > 0 ? "," : "", data[encoded].temperature, data[encoded].humidity,
+                           data[encoded].air_quality, (unsigned long)data[encoded].timestamp);
+        if (written < 0 || (size_t)written >= available) break;
+        length += (size_t)written;
+    }
+    if (encoded == 0) return 0;
+
+    memcpy(payload + length, tail, sizeof(tail));
+    *count = encoded;
+    return length + sizeof(tail) - 1;
+}
+
+
+// 多条读数合并为一条消息（设备ID只出现一次）：
+//   {"device_id":"basic_001","records":[[temp,hum,air,ts],...]}
+// 每条消息最多 MQTT_RECORDS_PER_MESSAGE 条读数；track 为 false 时不保留读数副本（由调用方保留）
+static result_code_t queue_records(const sensor_data_t* data, uint32_t count, bool track) {
+    static char payload[MQTT_RECORDS_PER_MESSAGE * 40 + 64];
+    uint32_t offset = 0;
+    while (offset < count) {
+        uint32_t n = count - offset < MQTT_RECORDS_PER_MESSAGE ? count - offset : MQTT_RECORDS_PER_MESSAGE;
+        size_t length;
+        result_code_t result;
+        if (payload_format == MQTT_PAYLOAD_BINARY) {
+            length = encode_binary_frame((uint8_t*)payload, &data[offset], n);
+        } else {
+            length = encode_json_records(payload, sizeof(payload), &data[offset], &n);
+        }
+
+        if (length == 0) {
+            set_error("Payload too large");
+            result = RESULT_INVALID_PARAM;
+        } else {
+            result = queue_publish(MQTT_TOPIC_DATA, payload, length, track ? &data[offset] : NULL, n);
+        }
+        if (result != RESULT_OK) {
+            if (track) requeue_remaining(&data[offset], count - offset);
+            return result;
+        }
+        offset += n;
+    }
+    return RESULT_OK;
+}
+
+
+// 合并发布：进入发送缓冲区，随下一批发出；开始发送后出错时，未发出的读数都已转入离线缓存
+result_code_t mqtt_publish_sensor_records(const sensor_data_t* data, uint32_t count) {
+    if (data == NULL && count > 0) return RESULT_INVALID_PARAM;
+    if (mqtt_state != MQTT_STATE_CONNECTED) {
+        set_error("Not connected");
+        return RESULT_MQTT_ERROR;
+    }
+    return queue_records(data, count, true);
+}
+
+
+// 合并发送并立即写入套接字：返回 RESULT_OK 时读数已发出；失败时读数不进入离线缓存
+result_code_t mqtt_send_sensor_records(const sensor_data_t* data, uint32_t count) {
+    if (data == NULL && count > 0) return RESULT_INVALID_PARAM;
+    if (mqtt_state != MQTT_STATE_CONNECTED) {
+        set_error("Not connected");
+        return RESULT_MQTT_ERROR;
+    }
+    result_code_t result = queue_records(data, count, false);
+    if (result == RESULT_OK) {
+        result = mqtt_flush();
+    }
+    return result;
 }
 
+
+// 主循环中定期调用：读取并丢弃代理的应答、发出缓冲区中的读数、按保活时间发送PINGREQ
+// 先检查代理是否已断开，避免把读数写进已关闭的连接
 void mqtt_process(void) {
-    // 空实现
+    if (mqtt_state != MQTT_STATE_CONNECTED) return;
+
+    uint8_t scratch[64];
+    while (wait_readable(0) > 0) {
+        if (recv(mqtt_socket, (char*)scratch, sizeof(scratch), 0) <= 0) {
+            set_error("Connection closed by broker");
+            close_connection(MQTT_STATE_ERROR);
+            return;
+        }
+    }
+
+    if (mqtt_flush() != RESULT_OK) return;
+    if (get_timestamp() - last_send_time >= MQTT_KEEPALIVE / 2) {
+        const uint8_t packet[2] = {MQTT_PACKET_PINGREQ, 0};
+        send_all(packet, sizeof(packet));
+    }
 }
 
 const char* mqtt_get_last_error(void) {
-    return "No error";
+    return last_error;
 }
 
 result_code_t mqtt_publish_status(const device_status_t* status) {
+    (void)status;
     printf("[MQTT] Status publishing not implemented\n");
     return RESULT_OK;
 }
@@ -9,18 +9,46 @@
 extern "C" {
 #endif
 
+// 读数负载格式
+// JSON：{"device_id":"basic_001","temp":25.50,...}，批量时 {"device_id":...,"records":[[...],...]}
+// 二进制（版本1，小端）：头部 version(u8) count(u16) id_len(u8) device_id[id_len]，
+//   随后 count 条22字节读数 device_hash(u32, FNV-1a) temp(f32) hum(f32) air(f32) ts(u32) sequence(u16)
+typedef enum {
+    MQTT_PAYLOAD_JSON = 0,
+    MQTT_PAYLOAD_BINARY = 1
+} mqtt_payload_format_t;
+
 // MQTT客户端初始化
 ENV_MONITOR_API result_code_t mqtt_client_init(void);
 
+// 切换负载格式（默认 MQTT_DEFAULT_PAYLOAD_FORMAT）
+ENV_MONITOR_API result_code_t mqtt_client_set_payload_format(mqtt_payload_format_t format);
+
+// 设置代理地址（默认 MQTT_BROKER:MQTT_PORT），在 mqtt_connect 之前调用
+ENV_MONITOR_API result_code_t mqtt_client_configure(const char* host, uint16_t port);
+
 // MQTT连接管理
+// mqtt_connect 的TCP连接和CONNACK各最多等待 MQTT_CONNECT_TIMEOUT_MS
 ENV_MONITOR_API result_code_t mqtt_connect(void);
+ENV_MONITOR_API result_code_t mqtt_reconnect(void);   // 带指数退避的重连，供主循环在离线时调用
 ENV_MONITOR_API void mqtt_disconnect(void);
 ENV_MONITOR_API bool mqtt_is_connected(void);
 ENV_MONITOR_API mqtt_state_t mqtt_get_state(void);
 
 // 数据发布
 // 直接接收传感器数据结构，内部处理JSON转换
+// 通过同一个TCP连接以QoS 0发布；报文先进入发送缓冲区，满 MQTT_PUBLISH_BATCH 条时一次发出，
+// 其余在下次 mqtt_process / mqtt_flush 时发出
+// 返回 RESULT_OK 后读数由客户端负责：连接断开时缓冲区中未发出的读数放回离线缓存（offline_buffer.h）
 ENV_MONITOR_API result_code_t mqtt_publish_sensor_data(const sensor_data_t* data);
+ENV_MONITOR_API result_code_t mqtt_publish_sensor_batch(const sensor_data_t* data, uint32_t count);
+ENV_MONITOR_API result_code_t mqtt_flush(void);
+
+// 多条读数合并为一条消息发布（每条消息最多 MQTT_RECORDS_PER_MESSAGE 条）：
+// JSON格式为 {"device_id":"basic_001","records":[[temp,hum,air,ts],...]}，二进制格式为一个多条读数的帧
+ENV_MONITOR_API result_code_t mqtt_publish_sensor_records(const sensor_data_t* data, uint32_t count);
+// 同上，但立即写入套接字且不把读数放回离线缓存：供 offline_buffer_flush 补发时使用，成功后再从缓存移除
+ENV_MONITOR_API result_code_t mqtt_send_sensor_records(const sensor_data_t* data, uint32_t count);
 ENV_MONITOR_API result_code_t mqtt_publish_status(const device_status_t* status);
 
 // 周期处理（需要在主循环中调用）
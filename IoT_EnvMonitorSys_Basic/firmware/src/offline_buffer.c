@@ -0,0 +1,84 @@
+﻿#define ENV_MONITOR_DLL_EXPORTS
+#include "offline_buffer.h"
+#include "mqtt_client.h"
+#include <stddef.h>
+
+// 环形缓冲区：head 指向最旧的一条，count 为当前条数
+static sensor_data_t buffer[OFFLINE_BUFFER_CAPACITY];
+static uint32_t head = 0;
+static uint32_t count = 0;
+static uint32_t dropped = 0;
+
+
+result_code_t offline_buffer_push(const sensor_data_t* data) {
+    if (data == NULL) {
+        return RESULT_INVALID_PARAM;
+    }
+    
+    if (count == OFFLINE_BUFFER_CAPACITY) {
+        // 缓存已满：覆盖最旧的一条，保留最近的数据
+        head = (head + 1) % OFFLINE_BUFFER_CAPACITY;
+        count--;
+        dropped++;
+    }
+    buffer[(head + count) % OFFLINE_BUFFER_CAPACITY] = *data;
+    count++;
+    return RESULT_OK;
+}
+
+result_code_t offline_buffer_requeue(const sensor_data_t* data, uint32_t requeue_count) {
+    if (data == NULL && requeue_count > 0) {
+        return RESULT_INVALID_PARAM;
+    }
+    
+    // 从最新的一条开始逐条插到 head 之前，保持原有顺序
+    for (uint32_t i = requeue_count; i > 0; i--) {
+        if (count == OFFLINE_BUFFER_CAPACITY) {
+            dropped += i;
+            break;
+        }
+        head = (head + OFFLINE_BUFFER_CAPACITY - 1) % OFFLINE_BUFFER_CAPACITY;
+        buffer[head] = data[i - 1];
+        count++;
+    }
+    return RESULT_OK;
+}
+
+uint32_t offline_buffer_count(void) {
+    return count;
+}
+
+uint32_t offline_buffer_capacity(void) {
+    return OFFLINE_BUFFER_CAPACITY;
+}
+
+uint32_t offline_buffer_dropped(void) {
+    return dropped;
+}
+
+void offline_buffer_clear(void) {
+    head = 0;
+    count = 0;
+    dropped = 0;
+}
+
+
+result_code_t offline_buffer_flush(void) {
+    sensor_data_t batch[MQTT_RECORDS_PER_MESSAGE];
+    
+    while (count > 0) {
+        // 从最旧的一条开始取出一批（可能跨越数组末尾）
+        uint32_t n = count < MQTT_RECORDS_PER_MESSAGE ? count : MQTT_RECORDS_PER_MESSAGE;
+        for (uint32_t i = 0; i < n; i++) {
+            batch[i] = buffer[(head + i) % OFFLINE_BUFFER_CAPACITY];
+        }
+        
+        result_code_t result = mqtt_send_sensor_records(batch, n);
+        if (result != RESULT_OK) {
+            return result;
+        }
+        head = (head + n) % OFFLINE_BUFFER_CAPACITY;
+        count -= n;
+    }
+    return RESULT_OK;
+}
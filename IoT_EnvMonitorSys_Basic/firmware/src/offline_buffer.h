@@ -0,0 +1,31 @@
+﻿#ifndef OFFLINE_BUFFER_H
+#define OFFLINE_BUFFER_H
+
+#include "common.h"
+#include "config.h"
+#include "env_monitor_export.h"
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// 离线缓存：固定大小的环形缓冲区（OFFLINE_BUFFER_CAPACITY 条），不分配动态内存
+// 断线期间的读数存入缓存，满了覆盖最旧的一条；重连后按时间顺序合并为批量消息补发
+ENV_MONITOR_API result_code_t offline_buffer_push(const sensor_data_t* data);
+ENV_MONITOR_API uint32_t offline_buffer_count(void);
+ENV_MONITOR_API uint32_t offline_buffer_capacity(void);
+ENV_MONITOR_API uint32_t offline_buffer_dropped(void);   // 因缓存已满被覆盖的读数
+ENV_MONITOR_API void offline_buffer_clear(void);
+
+// 把发送失败的读数放回缓存最前面（它们早于缓存中已有的读数）；缓存已满时丢弃这些较旧的读数
+ENV_MONITOR_API result_code_t offline_buffer_requeue(const sensor_data_t* data, uint32_t count);
+
+// 补发缓存中的读数：每 MQTT_RECORDS_PER_MESSAGE 条一条消息，发送成功后才从缓存移除
+// 全部发出返回 RESULT_OK；未连接或中途断开时返回错误，剩余读数留在缓存中
+ENV_MONITOR_API result_code_t offline_buffer_flush(void);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif // OFFLINE_BUFFER_H
\ No newline at end of file
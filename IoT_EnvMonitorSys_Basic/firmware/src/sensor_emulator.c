@@ -12,102 +12,189 @@ uint32_t get_timestamp(void) {
 }
 
 
+// 中国各地区秋冬季特征
+typedef enum {
+    GUANGDONG_GUANGXI,   // 广东广西：温暖潮湿
+    ZHEJIANG_ANHUI,      // 浙江安徽：温和湿润
+    BEIJING_TIANJIN,     // 北京天津：干燥凉爽
+    DONGBEI,             // 东北三省：寒冷干燥
+    NORTHWEST,           // 西北地区：干燥大风
+    XINJIANG,            // 新疆：昼夜温差大
+    XIZANG,              // 西藏：寒冷紫外线强
+    CHUANYU              // 川渝：潮湿多雾
+} region_type_t;
+
+// 模拟器上下文：随机数状态、地区、序列号都属于单个设备，互不共享
+struct sensor_emulator {
+    uint64_t rng_state;     // splitmix64 状态
+    int32_t region;         // 固定地区，SENSOR_REGION_RANDOM 表示每条样本随机选择
+    uint16_t sequence;      // 序列号
+};
+
+// 全局接口（sensor_emulator_read 等）使用的默认上下文，与原实现一样非线程安全
+static sensor_emulator_t default_emulator = {1, SENSOR_REGION_RANDOM, 0};
+
+
+// splitmix64：状态只有一个64位整数，同一种子产生相同序列
+static uint32_t emulator_random(sensor_emulator_t* emulator) {
+    uint64_t z = (emulator->rng_state += 0x9E3779B97F4A7C15ULL);
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return (uint32_t)((z ^ (z >> 31)) >> 32);
+}
+
+
 result_code_t sensor_emulator_init(void) {
     printf("[SENSOR] Sensor emulator initialized\n");
-    srand((unsigned int)time(NULL));  // 随机数种子
+    default_emulator.rng_state = (uint64_t)time(NULL);  // 随机数种子
     return RESULT_OK;
 }
 
 
-result_code_t sensor_emulator_read(sensor_data_t* data) {
-    if (data == NULL) {
-        return RESULT_INVALID_PARAM;
+sensor_emulator_t* sensor_emulator_create(uint64_t seed, int32_t region) {
+    if (region < SENSOR_REGION_RANDOM || region >= SENSOR_REGION_COUNT) {
+        return NULL;
     }
     
-    static uint16_t sequence_counter = 0;
-    
-    // 中国各地区秋冬季特征
-    typedef enum {
-        GUANGDONG_GUANGXI,   // 广东广西：温暖潮湿
-        ZHEJIANG_ANHUI,      // 浙江安徽：温和湿润
-        BEIJING_TIANJIN,     // 北京天津：干燥凉爽
-        DONGBEI,             // 东北三省：寒冷干燥
-        NORTHWEST,           // 西北地区：干燥大风
-        XINJIANG,            // 新疆：昼夜温差大
-        XIZANG,              // 西藏：寒冷紫外线强
-        CHUANYU              // 川渝：潮湿多雾
-    } region_type_t;
-    
-    // 随机选择一个地区
-    region_type_t region = rand() % 8;
+    sensor_emulator_t* emulator = (sensor_emulator_t*)malloc(sizeof(sensor_emulator_t));
+    if (emulator != NULL) {
+        emulator->rng_state = seed;
+        emulator->region = region;
+        emulator->sequence = 0;
+    }
+    return emulator;
+}
+
+
+void sensor_emulator_destroy(sensor_emulator_t* emulator) {
+    free(emulator);
+}
+
+
+// 生成一条样本（全局接口和上下文接口共用）
+static void emulate_sample(sensor_emulator_t* emulator, sensor_data_t* data, uint32_t timestamp) {
+    // 固定地区的设备读数在该地区范围内；未指定地区时每条样本随机选择一个地区
+    region_type_t region = emulator->region == SENSOR_REGION_RANDOM
+        ? (region_type_t)(emulator_random(emulator) % SENSOR_REGION_COUNT)
+        : (region_type_t)emulator->region;
     
     switch(region) {
         case GUANGDONG_GUANGXI:  // 广东广西：温暖潮湿
-            data->temperature = 18.0f + (float)(rand() % 120) / 10.0f;  // 18.0-30.0°C
-            data->humidity = 70.0f + (float)(rand() % 300) / 10.0f;     // 70.0-100.0%
-            data->air_quality = 65.0f + (float)(rand() % 350) / 10.0f;  // 65.0-100.0%
+            data->temperature = 18.0f + (float)(emulator_random(emulator) % 120) / 10.0f;  // 18.0-30.0°C
+            data->humidity = 70.0f + (float)(emulator_random(emulator) % 300) / 10.0f;     // 70.0-100.0%
+            data->air_quality = 65.0f + (float)(emulator_random(emulator) % 350) / 10.0f;  // 65.0-100.0%
             // printf("[SENSOR] 🌊 两广地区: ");
             break;
             
         case ZHEJIANG_ANHUI:     // 浙江安徽：温和湿润
-            data->temperature = 12.0f + (float)(rand() % 130) / 10.0f;  // 12.0-25.0°C
-            data->humidity = 65.0f + (float)(rand() % 350) / 10.0f;     // 65.0-100.0%
-            data->air_quality = 70.0f + (float)(rand() % 300) / 10.0f;  // 70.0-100.0%
+            data->temperature = 12.0f + (float)(emulator_random(emulator) % 130) / 10.0f;  // 12.0-25.0°C
+            data->humidity = 65.0f + (float)(emulator_random(emulator) % 350) / 10.0f;     // 65.0-100.0%
+            data->air_quality = 70.0f + (float)(emulator_random(emulator) % 300) / 10.0f;  // 70.0-100.0%
             // printf("[SENSOR] 🍃 江浙地区: ");
             break;
             
         case BEIJING_TIANJIN:    // 北京天津：干燥凉爽
-            data->temperature = 5.0f + (float)(rand() % 150) / 10.0f;   // 5.0-20.0°C
-            data->humidity = 30.0f + (float)(rand() % 400) / 10.0f;     // 30.0-70.0%
-            data->air_quality = 60.0f + (float)(rand() % 400) / 10.0f;  // 60.0-100.0%
+            data->temperature = 5.0f + (float)(emulator_random(emulator) % 150) / 10.0f;   // 5.0-20.0°C
+            data->humidity = 30.0f + (float)(emulator_random(emulator) % 400) / 10.0f;     // 30.0-70.0%
+            data->air_quality = 60.0f + (float)(emulator_random(emulator) % 400) / 10.0f;  // 60.0-100.0%
             // printf("[SENSOR] 🏙️ 京津地区: ");
             break;
             
         case DONGBEI:            // 东北三省：寒冷干燥
-            data->temperature = -15.0f + (float)(rand() % 250) / 10.0f; // -15.0-10.0°C
-            data->humidity = 25.0f + (float)(rand() % 350) / 10.0f;     // 25.0-60.0%
-            data->air_quality = 80.0f + (float)(rand() % 200) / 10.0f;  // 80.0-100.0%
+            data->temperature = -15.0f + (float)(emulator_random(emulator) % 250) / 10.0f; // -15.0-10.0°C
+            data->humidity = 25.0f + (float)(emulator_random(emulator) % 350) / 10.0f;     // 25.0-60.0%
+            data->air_quality = 80.0f + (float)(emulator_random(emulator) % 200) / 10.0f;  // 80.0-100.0%
             // printf("[SENSOR] 🌲 东北地区: ");
             break;
             
         case NORTHWEST:          // 西北地区：干燥大风
-            data->temperature = 0.0f + (float)(rand() % 200) / 10.0f;   // 0.0-20.0°C
-            data->humidity = 20.0f + (float)(rand() % 300) / 10.0f;     // 20.0-50.0%
-            data->air_quality = 75.0f + (float)(rand() % 250) / 10.0f;  // 75.0-100.0%
+            data->temperature = 0.0f + (float)(emulator_random(emulator) % 200) / 10.0f;   // 0.0-20.0°C
+            data->humidity = 20.0f + (float)(emulator_random(emulator) % 300) / 10.0f;     // 20.0-50.0%
+            data->air_quality = 75.0f + (float)(emulator_random(emulator) % 250) / 10.0f;  // 75.0-100.0%
             // printf("[SENSOR] 🏜️ 西北地区: ");
             break;
             
         case XINJIANG:           // 新疆：昼夜温差大
-            data->temperature = -5.0f + (float)(rand() % 300) / 10.0f;  // -5.0-25.0°C
-            data->humidity = 15.0f + (float)(rand() % 350) / 10.0f;     // 15.0-50.0%
-            data->air_quality = 85.0f + (float)(rand() % 150) / 10.0f;  // 85.0-100.0%
+            data->temperature = -5.0f + (float)(emulator_random(emulator) % 300) / 10.0f;  // -5.0-25.0°C
+            data->humidity = 15.0f + (float)(emulator_random(emulator) % 350) / 10.0f;     // 15.0-50.0%
+            data->air_quality = 85.0f + (float)(emulator_random(emulator) % 150) / 10.0f;  // 85.0-100.0%
             // printf("[SENSOR] 🐫 新疆地区: ");
             break;
             
         case XIZANG:             // 西藏：寒冷紫外线强
-            data->temperature = -10.0f + (float)(rand() % 250) / 10.0f; // -10.0-15.0°C
-            data->humidity = 25.0f + (float)(rand() % 300) / 10.0f;     // 25.0-55.0%
-            data->air_quality = 90.0f + (float)(rand() % 100) / 10.0f;  // 90.0-100.0%
+            data->temperature = -10.0f + (float)(emulator_random(emulator) % 250) / 10.0f; // -10.0-15.0°C
+            data->humidity = 25.0f + (float)(emulator_random(emulator) % 300) / 10.0f;     // 25.0-55.0%
+            data->air_quality = 90.0f + (float)(emulator_random(emulator) % 100) / 10.0f;  // 90.0-100.0%
             // printf("[SENSOR] 🏔️ 西藏地区: ");
             break;
             
         case CHUANYU:            // 川渝：潮湿多雾
-            data->temperature = 8.0f + (float)(rand() % 120) / 10.0f;   // 8.0-20.0°C
-            data->humidity = 75.0f + (float)(rand() % 250) / 10.0f;     // 75.0-100.0%
-            data->air_quality = 55.0f + (float)(rand() % 450) / 10.0f;  // 55.0-100.0%
+            data->temperature = 8.0f + (float)(emulator_random(emulator) % 120) / 10.0f;   // 8.0-20.0°C
+            data->humidity = 75.0f + (float)(emulator_random(emulator) % 250) / 10.0f;     // 75.0-100.0%
+            data->air_quality = 55.0f + (float)(emulator_random(emulator) % 450) / 10.0f;  // 55.0-100.0%
             // printf("[SENSOR] 🌫️ 川渝地区: ");
             break;
     }
     
-    data->timestamp = get_timestamp();
-    data->sequence = sequence_counter++;
+    data->timestamp = timestamp;
+    data->sequence = emulator->sequence++;
     
     // printf("温度%.1f°C, 湿度%.1f%%, 空气质量%.1f%%, 序列号%d\n", 
     //        data->temperature, data->humidity, data->air_quality, data->sequence);
+}
+
+
+result_code_t sensor_emulator_read(sensor_data_t* data) {
+    return sensor_emulator_read_r(&default_emulator, data);
+}
+
+
+// 批量读取：一次调用填满调用方提供的数组，避免每条样本一次FFI往返
+result_code_t sensor_emulator_read_batch(sensor_data_t* data, uint32_t count) {
+    return sensor_emulator_read_batch_r(&default_emulator, data, count);
+}
+
+
+// 批量读取到三个独立的float缓冲区（列式），不需要的列可传NULL
+result_code_t sensor_emulator_read_columns(float* temperature, float* humidity,
+                                           float* air_quality, uint32_t count) {
+    sensor_data_t sample;
+    uint32_t timestamp = get_timestamp();
+    
+    for (uint32_t i = 0; i < count; i++) {
+        emulate_sample(&default_emulator, &sample, timestamp);
+        if (temperature != NULL) temperature[i] = sample.temperature;
+        if (humidity != NULL) humidity[i] = sample.humidity;
+        if (air_quality != NULL) air_quality[i] = sample.air_quality;
+    }
+    return RESULT_OK;
+}
+
+
+// 可重入接口：只读写传入的上下文，不同上下文可在多个线程中同时调用
+result_code_t sensor_emulator_read_r(sensor_emulator_t* emulator, sensor_data_t* data) {
+    if (emulator == NULL || data == NULL) {
+        return RESULT_INVALID_PARAM;
+    }
     
+    emulate_sample(emulator, data, get_timestamp());
     return RESULT_OK;
 }
 
+
+result_code_t sensor_emulator_read_batch_r(sensor_emulator_t* emulator, sensor_data_t* data, uint32_t count) {
+    if (emulator == NULL || (data == NULL && count > 0)) {
+        return RESULT_INVALID_PARAM;
+    }
+    
+    uint32_t timestamp = get_timestamp();  // 整批共用一个时间戳，序列号连续递增
+    for (uint32_t i = 0; i < count; i++) {
+        emulate_sample(emulator, &data[i], timestamp);
+    }
+    return RESULT_OK;
+}
+
+
 float sensor_get_temperature(void) {
     sensor_data_t data;
     if (sensor_emulator_read(&data) == RESULT_OK) {
@@ -9,9 +9,27 @@
 extern "C" {
 #endif
 
+// 模拟器上下文（不透明类型）：每个上下文有独立的随机数种子、地区和序列号，
+// 不同上下文可以在多个线程中并行读取；相同种子和地区产生相同的读数序列
+typedef struct sensor_emulator sensor_emulator_t;
+
+#define SENSOR_REGION_RANDOM (-1)   // 每条样本随机选择地区（全局接口的行为）
+#define SENSOR_REGION_COUNT 8       // 地区数，固定地区取 0 ~ SENSOR_REGION_COUNT-1
+
 // 只在头文件中使用 ENV_MONITOR_API
 ENV_MONITOR_API result_code_t sensor_emulator_init(void);
 ENV_MONITOR_API result_code_t sensor_emulator_read(sensor_data_t* data);
+ENV_MONITOR_API result_code_t sensor_emulator_read_batch(sensor_data_t* data, uint32_t count);
+ENV_MONITOR_API result_code_t sensor_emulator_read_columns(float* temperature, float* humidity,
+                                                           float* air_quality, uint32_t count);
+
+// 上下文接口：create 失败（地区无效或内存不足）返回 NULL
+ENV_MONITOR_API sensor_emulator_t* sensor_emulator_create(uint64_t seed, int32_t region);
+ENV_MONITOR_API void sensor_emulator_destroy(sensor_emulator_t* emulator);
+ENV_MONITOR_API result_code_t sensor_emulator_read_r(sensor_emulator_t* emulator, sensor_data_t* data);
+ENV_MONITOR_API result_code_t sensor_emulator_read_batch_r(sensor_emulator_t* emulator, sensor_data_t* data,
+                                                           uint32_t count);
+
 ENV_MONITOR_API float sensor_get_temperature(void);
 ENV_MONITOR_API float sensor_get_humidity(void);
 ENV_MONITOR_API float sensor_get_air_quality(void);
@@ -0,0 +1,22 @@
+
+# Consider dependencies only in project.
+set(CMAKE_DEPENDS_IN_PROJECT_ONLY OFF)
+
+# The set of languages for which implicit dependencies are needed:
+set(CMAKE_DEPENDS_LANGUAGES
+  )
+
+# The set of dependency files which are needed:
+set(CMAKE_DEPENDS_DEPENDENCY_FILES
+  "/root/package/IoT_EnvMonitorSys_Basic/firmware/src/main.c" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/main.c.o" "gcc" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/main.c.o.d"
+  "/root/package/IoT_EnvMonitorSys_Basic/firmware/src/mqtt_client.c" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/mqtt_client.c.o" "gcc" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/mqtt_client.c.o.d"
+  "/root/package/IoT_EnvMonitorSys_Basic/firmware/src/offline_buffer.c" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/offline_buffer.c.o" "gcc" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/offline_buffer.c.o.d"
+  "/root/package/IoT_EnvMonitorSys_Basic/firmware/src/sensor_emulator.c" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/sensor_emulator.c.o" "gcc" "IoT_EnvMonitorSys_Basic/firmware/CMakeFiles/env_monitor.dir/src/sensor_emulator.c.o.d"
+  )
+
+# Targets to which this target links.
+set(CMAKE_TARGET_LINKED_INFO_FILES
+  )
+
+# Fortran module output directory.
+set(CMAKE_Fortran_TARGET_MODULE_DIR "")
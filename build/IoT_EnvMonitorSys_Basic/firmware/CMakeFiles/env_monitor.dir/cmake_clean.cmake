@@ -0,0 +1,17 @@
+file(REMOVE_RECURSE
+  "../../bin/env_monitor_app"
+  "../../bin/env_monitor_app.pdb"
+  "CMakeFiles/env_monitor.dir/src/main.c.o"
+  "CMakeFiles/env_monitor.dir/src/main.c.o.d"
+  "CMakeFiles/env_monitor.dir/src/mqtt_client.c.o"
+  "CMakeFiles/env_monitor.dir/src/mqtt_client.c.o.d"
+  "CMakeFiles/env_monitor.dir/src/offline_buffer.c.o"
+  "CMakeFiles/env_monitor.dir/src/offline_buffer.c.o.d"
+  "CMakeFiles/env_monitor.dir/src/sensor_emulator.c.o"
+  "CMakeFiles/env_monitor.dir/src/sensor_emulator.c.o.d"
+)
+
+# Per-language clean rules from dependency scanning.
+foreach(lang C)
+  include(CMakeFiles/env_monitor.dir/cmake_clean_${lang}.cmake OPTIONAL)
+endforeach()
@@ -0,0 +1,17 @@
+file(REMOVE_RECURSE
+  "../../bin/libenv_monitor.pdb"
+  "../../bin/libenv_monitor.so"
+  "../../bin/libenv_monitor.so.1"
+  "../../bin/libenv_monitor.so.1.0.0"
+  "CMakeFiles/env_monitor_shared.dir/src/mqtt_client.c.o"
+  "CMakeFiles/env_monitor_shared.dir/src/mqtt_client.c.o.d"
+  "CMakeFiles/env_monitor_shared.dir/src/offline_buffer.c.o"
+  "CMakeFiles/env_monitor_shared.dir/src/offline_buffer.c.o.d"
+  "CMakeFiles/env_monitor_shared.dir/src/sensor_emulator.c.o"
+  "CMakeFiles/env_monitor_shared.dir/src/sensor_emulator.c.o.d"
+)
+
+# Per-language clean rules from dependency scanning.
+foreach(lang C)
+  include(CMakeFiles/env_monitor_shared.dir/cmake_clean_${lang}.cmake OPTIONAL)
+endforeach()
@@ -4,10 +4,20 @@ cloud-services核心功能测试
 """
 import sys
 import os
+import json
+import shutil
+import subprocess
+import pytest
 from pathlib import Path
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from IoT_EnvMonitorSys_Basic.cloud_services.ai_analyzer.real_ai_analyzer import RealAIAnalyzer
+import numpy as np
+from IoT_EnvMonitorSys_Basic.cloud_services.ai_analyzer.real_ai_analyzer import (
+    RealAIAnalyzer, ModelRegistry, TRAINING_CLASSES)
+from IoT_EnvMonitorSys_Basic.cloud_services.ai_analyzer.cluster_retrainer import (
+    retrain_cluster, activate_cluster_version, list_cluster_versions)
+from IoT_EnvMonitorSys_Basic.cloud_services.ai_analyzer.compiled_model import CompiledModel, compile_models
+from IoT_EnvMonitorSys_Basic.cloud_services.shared.database import DatabaseManager, SENSOR_DTYPE
 
 
 def test_ai_analyzer_integration():
@@ -22,7 +32,334 @@ def test_ai_analyzer_integration():
     print("✅ AI分析器测试通过")
 
 
+def test_analyze_batch_matches_single_analysis():
+    """测试批量分析与逐条分析结果一致"""
+    ai = RealAIAnalyzer()
+    records = [
+        {'temp': 25.0, 'hum': 50.0, 'air': 85.0, 'ts': 1},
+        {'temp': 35.0, 'hum': 40.0, 'air': 70.0, 'ts': 2},
+        {'temp': 15.0, 'hum': 80.0, 'air': 60.0, 'ts': 3},
+        {'temp': 2.0, 'hum': 25.0, 'air': 20.0, 'ts': 4},
+    ]
+
+    batch = ai.analyze_batch("test_device", records)
+    assert batch["device_id"] == ["test_device"] * len(records)
+
+    for i, r in enumerate(records):
+        single = ai.analyze_with_ai("test_device", r['temp'], r['hum'], r['air'])
+        assert batch["environment_type"][i] == single["environment_type"]
+        assert abs(batch["prediction_confidence"][i] - float(single["prediction_confidence"][:-1])) < 0.11
+        assert abs(batch["anomaly_score"][i] - float(single["anomaly_score"][:-1])) < 0.11
+        assert batch["ai_suggestions"][i] == single["ai_suggestions"]
+
+    # 结构化数组输入（DatabaseManager.get_recent_array 的返回格式）
+    array = np.array([(i, r['temp'], r['hum'], r['air'], r['ts']) for i, r in enumerate(records)],
+                     dtype=SENSOR_DTYPE)
+    from_array = ai.analyze_batch("test_device", array)
+    assert from_array["environment_type"] == batch["environment_type"]
+    assert from_array["ai_suggestions"] == batch["ai_suggestions"]
+    assert np.array_equal(from_array["anomaly_score"], batch["anomaly_score"])
+
+    # 列数组输入
+    columns = ai.analyze_batch(["a", "b"], [25.0, 35.0], [50.0, 40.0], [85.0, 70.0])
+    assert columns["environment_type"] == batch["environment_type"][:2]
+    print("✅ 批量AI分析测试通过")
+
+
+def test_build_analysis_rows():
+    """测试批量分析结果转换为ai_analysis表记录"""
+    ai = RealAIAnalyzer()
+    batch = ai.analyze_batch("test_device", [22.0, 45.0], [55.0, 10.0], [85.0, 5.0])
+    rows = ai.build_analysis_rows(batch, [101, 102])
+
+    assert [row["sensor_data_id"] for row in rows] == [101, 102]
+    for row, score in zip(rows, batch["anomaly_score"]):
+        assert row["comfort_score"] == round(100 - score, 1)
+        assert row["health_risk"] in ("低", "中", "高")
+    assert rows[1]["health_risk"] == "高"  # 极端数据异常分数高
+    print("✅ 分析记录转换测试通过")
+
+
+def test_model_registry_loads_once(tmp_path):
+    """测试模型缓存：同一进程内多个分析器共享模型，缺失的模型训练一次后保存"""
+    shared = ModelRegistry()
+    first = RealAIAnalyzer(registry=shared)
+    assert first.model is not None and first.cluster_model is not None
+    loaded = shared.stats['loads'] + shared.stats['trained']
+    hits = shared.stats['hits']
+
+    second = RealAIAnalyzer(registry=shared)
+    assert second.model is first.model
+    assert second.cluster_model is first.cluster_model
+    # 第二个分析器只命中缓存，每个模型文件在进程内只加载一次
+    assert shared.stats['loads'] + shared.stats['trained'] == loaded
+    assert shared.stats['hits'] > hits
+
+    registry = ModelRegistry(mmap_mode='r')
+    path = str(tmp_path / "cluster_model.pkl")
+    trained = registry.get(path, first.train_cluster)
+    assert os.path.exists(path)
+    assert registry.get(path, first.train_cluster) is trained
+    assert registry.stats['trained'] == 1 and registry.stats['hits'] == 1
+
+    # 文件更新后重新加载（内存映射方式）
+    os.utime(path, (0, 0))
+    reloaded = registry.get(path)
+    assert reloaded is not trained
+    assert (reloaded.cluster_centers_ == trained.cluster_centers_).all()
+    assert registry.stats['loads'] == 1
+    print("✅ 模型缓存测试通过")
+
+
+def test_generate_training_data_vectorized():
+    """测试向量化合成训练数据：按类别分布生成、可复现、可按倍率扩大"""
+    ai = RealAIAnalyzer()
+    X, y = ai.generate_training_data()
+    assert X.shape == (1000, 3) and y.shape == (1000,)
+    X2, y2 = ai.generate_training_data()
+    assert np.array_equal(X, X2) and np.array_equal(y, y2)
+
+    X, y = ai.generate_training_data(scale=200)
+    assert len(X) == 200000
+    for label, mean, std, count in TRAINING_CLASSES:
+        rows = X[y == label]
+        assert len(rows) == count * 200
+        assert np.allclose(rows.mean(axis=0), mean, atol=0.2)
+        assert np.allclose(rows.std(axis=0), std, rtol=0.05)
+
+    normal = ai.generate_normal_data(n_samples=100000, seed=7)
+    assert normal.shape == (100000, 3)
+    assert np.allclose(normal.mean(axis=0), (22, 55, 80), atol=0.2)
+    print("✅ 合成训练数据测试通过")
+
+
+def test_compiled_engine_matches_sklearn():
+    """测试编译推理引擎与sklearn模型的预测结果逐位一致"""
+    compiled = RealAIAnalyzer(engine='compiled')
+    reference = RealAIAnalyzer(engine='sklearn')
+    assert compiled.engine == 'compiled' and reference.engine == 'sklearn'
+
+    rng = np.random.default_rng(0)
+    X = rng.normal((22, 55, 80), (15, 30, 40), size=(3000, 3))
+    X[:500] = np.round(X[:500], 1)  # 模拟器输出按0.1量化
+    assert np.array_equal(compiled.model.predict_proba(X), reference.model.predict_proba(X))
+
+    batch = compiled.analyze_batch("dev", X[:, 0], X[:, 1], X[:, 2])
+    expected = reference.analyze_batch("dev", X[:, 0], X[:, 1], X[:, 2])
+    assert batch["environment_type"] == expected["environment_type"]
+    assert np.array_equal(batch["prediction_confidence"], expected["prediction_confidence"])
+    assert np.array_equal(batch["anomaly_score"], expected["anomaly_score"])
+
+    for temp, hum, air in X[:50].tolist():
+        assert compiled.analyze_with_ai("dev", temp, hum, air) == reference.analyze_with_ai("dev", temp, hum, air)
+    print("✅ 编译推理引擎一致性测试通过")
+
+
+def test_compiled_model_scales_with_node_count():
+    """测试编译模型大小与节点数成正比：2万条样本训练的森林也能编译，结果与sklearn逐位一致"""
+    from sklearn.ensemble import RandomForestClassifier
+    ai = RealAIAnalyzer(engine='sklearn')
+    X, y = ai.generate_training_data(scale=20)
+    forest = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+
+    arrays = compile_models(forest, ai.cluster_model)
+    assert len(arrays['left']) == sum(e.tree_.node_count for e in forest.estimators_)
+    assert arrays['left'].dtype == arrays['right'].dtype == arrays['roots'].dtype == np.int32
+    samples = np.random.default_rng(2).normal((22, 55, 80), (10, 20, 25), size=(3000, 3))
+    assert np.array_equal(CompiledModel(arrays).predict_proba(samples), forest.predict_proba(samples))
+    print(f"✅ 编译模型规模测试通过 - {len(arrays['left'])} 个节点")
+
+
+def test_auto_engine_falls_back_when_compile_fails(tmp_path, monkeypatch):
+    """测试节点数超出编译模型范围时：auto 使用sklearn模型，显式 compiled 抛出错误"""
+    source_dir = RealAIAnalyzer().models_dir
+    for name in ("environment_model.pkl", "cluster_model.pkl"):
+        shutil.copy2(os.path.join(source_dir, name), tmp_path / name)
+    monkeypatch.setattr(sys.modules['compiled_model'], 'MAX_NODES', 10)
+
+    ai = RealAIAnalyzer(models_dir=str(tmp_path))
+    assert ai.engine == 'sklearn'
+    assert not (tmp_path / "compiled_model.joblib").exists()
+    assert "environment_type" in ai.analyze_with_ai("dev", 25.0, 50.0, 85.0)
+    with pytest.raises(ValueError):
+        RealAIAnalyzer(engine='compiled', models_dir=str(tmp_path))
+    print("✅ 编译失败回退sklearn测试通过")
+
+
+def test_compiled_engine_does_not_import_sklearn():
+    """测试默认推理路径不导入sklearn（编译模型已导出后）"""
+    analyzer_dir = Path(__file__).parent.parent.parent / "IoT_EnvMonitorSys_Basic" / "cloud_services" / "ai_analyzer"
+    RealAIAnalyzer()  # 新检出的仓库中没有编译模型，先导出一次
+    code = (
+        "import sys; sys.path.insert(0, sys.argv[1])\n"
+        "from real_ai_analyzer import RealAIAnalyzer\n"
+        "ai = RealAIAnalyzer()\n"
+        "ai.analyze_with_ai('dev', 25.0, 50.0, 85.0)\n"
+        "assert ai.engine == 'compiled'\n"
+        "assert 'sklearn' not in sys.modules\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code, str(analyzer_dir)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    print("✅ 编译推理引擎无sklearn依赖测试通过")
+
+
+def test_compiled_model_exported_on_first_load(tmp_path):
+    """测试编译模型不在版本库中：首次加载时由sklearn模型导出，sklearn模型更新后重新导出"""
+    source_dir = RealAIAnalyzer().models_dir
+    models_dir = tmp_path / "ai_models"
+    models_dir.mkdir(parents=True)
+    for name in ("environment_model.pkl", "cluster_model.pkl"):
+        shutil.copy2(os.path.join(source_dir, name), models_dir / name)
+
+    ai = RealAIAnalyzer(models_dir=str(models_dir))
+    compiled_path = models_dir / "compiled_model.joblib"
+    assert ai.engine == 'compiled' and compiled_path.exists()
+    reference = RealAIAnalyzer(engine='sklearn', models_dir=str(models_dir))
+    assert ai.analyze_with_ai("dev", 25.0, 50.0, 85.0) == reference.analyze_with_ai("dev", 25.0, 50.0, 85.0)
+
+    # sklearn模型文件比编译模型新（例如重新训练后）：编译模型过期，下次加载时重新导出
+    source_mtime = (models_dir / "cluster_model.pkl").stat().st_mtime
+    os.utime(compiled_path, (source_mtime - 10, source_mtime - 10))
+    assert ai.refresh_models(force=True)
+    assert compiled_path.stat().st_mtime > source_mtime
+    assert not ai.refresh_models(force=True)
+    print("✅ 编译模型首次加载导出测试通过")
+
+
+def test_analysis_cache_hits_and_bound():
+    """测试分析缓存：按读数命中，容量有界，返回结果互不影响；取整缓存需显式开启"""
+    ai = RealAIAnalyzer(cache_size=3)
+    uncached = RealAIAnalyzer(cache_size=0)
+
+    first = ai.analyze_with_ai("dev_a", 35.0, 40.0, 45.0)
+    assert first == uncached.analyze_with_ai("dev_a", 35.0, 40.0, 45.0)
+    # 不同设备、相同读数直接命中缓存
+    assert ai.analyze_with_ai("dev_b", 35.0, 40.0, 45.0) == first
+    assert ai.cache_info()['hits'] == 1 and ai.cache_info()['misses'] == 1
+
+    # 修改返回结果不影响缓存
+    first["ai_suggestions"].append("modified")
+    assert "modified" not in ai.analyze_with_ai("dev_a", 35.0, 40.0, 45.0)["ai_suggestions"]
+
+    for temp in (10.0, 20.0, 30.0, 40.0):
+        ai.analyze_with_ai("dev_a", temp, 50.0, 80.0)
+    info = ai.cache_info()
+    assert info['size'] == 3 and info['maxsize'] == 3
+    assert info['hits'] == 2 and info['misses'] == 5 and info['hit_rate'] == round(2 / 7, 4)
+
+    ai.clear_cache()
+    assert ai.cache_info()['size'] == 0
+
+    # 默认不取整：相近读数各自分析，结果与不缓存一致；cache_decimals=1 时0.1精度内的读数共用结果
+    assert ai.analyze_with_ai("dev_a", 35.04, 39.96, 45.0) == uncached.analyze_with_ai("dev_a", 35.04, 39.96, 45.0)
+    assert ai.cache_info()['misses'] == 1
+    rounded = RealAIAnalyzer(cache_decimals=1)
+    assert rounded.analyze_with_ai("dev_a", 35.04, 39.96, 45.0) == rounded.analyze_with_ai("dev_b", 35.0, 40.0, 45.0)
+    assert rounded.cache_info()['hits'] == 1
+    print("✅ 分析缓存测试通过")
+
+
+def test_analysis_cache_follows_retrained_model(tmp_path):
+    """测试模型文件被再训练替换后：分析器换用新模型，旧模型的缓存结果不再命中"""
+    models_dir = str(tmp_path / "ai_models")
+    shutil.copytree(RealAIAnalyzer().models_dir, models_dir)
+    ai = RealAIAnalyzer(models_dir=models_dir, model_check_interval=0)
+    before = ai.analyze_with_ai("dev", 30.0, 75.0, 60.0)
+    assert ai.analyze_with_ai("dev", 30.0, 75.0, 60.0) == before
+    version = ai.model_version
+
+    X = np.random.default_rng(1).normal((30, 75, 60), (2, 5, 5), size=(1000, 3))
+    db_path = str(tmp_path / "fleet.db")
+    with DatabaseManager(db_path=db_path) as db:
+        db.save_sensor_data_batch([{'device_id': "dev", 'temp': t, 'hum': h, 'air': a, 'ts': 1764415200 + i}
+                                   for i, (t, h, a) in enumerate(X)])
+    retrain_cluster(db_path=db_path, models_dir=models_dir, chunk_size=300)
+
+    after = ai.analyze_with_ai("dev", 30.0, 75.0, 60.0)
+    assert ai.model_version != version
+    assert ai.cache_info()['misses'] == 2
+    assert after == RealAIAnalyzer(models_dir=models_dir, cache_size=0).analyze_with_ai("dev", 30.0, 75.0, 60.0)
+    # 聚类中心向实际数据靠拢，该读数的异常分数下降
+    assert float(after['anomaly_score'].rstrip('%')) < float(before['anomaly_score'].rstrip('%'))
+    print("✅ 模型更新后分析缓存失效测试通过")
+
+
+def test_retrain_cluster_from_database(tmp_path):
+    """测试用数据库数据分块再训练聚类模型：版本化保存、替换当前模型并更新编译模型"""
+    models_dir = str(tmp_path / "ai_models")
+    shutil.copytree(RealAIAnalyzer().models_dir, models_dir)
+    original = CompiledModel.load(os.path.join(models_dir, "compiled_model.joblib")).cluster_centers_
+
+    # 实际设备环境：偏热偏潮
+    X = np.random.default_rng(1).normal((30, 75, 60), (2, 5, 5), size=(2000, 3))
+    db_path = str(tmp_path / "fleet.db")
+    with DatabaseManager(db_path=db_path) as db:
+        db.save_sensor_data_batch([{'device_id': f"dev_{i % 10}", 'temp': t, 'hum': h, 'air': a, 'ts': 1764415200 + i}
+                                   for i, (t, h, a) in enumerate(X)])
+
+    info = retrain_cluster(db_path=db_path, models_dir=models_dir, chunk_size=300, keep_versions=2)
+    assert info['version'] == 1 and info['rows'] == 2000 and info['chunks'] == 7
+    assert list_cluster_versions(models_dir) == [1]
+    # 最近的聚类中心向实际数据靠拢
+    centers = np.array(info['centers'])
+    nearest = lambda c: np.min(np.linalg.norm(c - X.mean(axis=0), axis=1))
+    assert nearest(centers) < nearest(original)
+
+    compiled = CompiledModel.load(os.path.join(models_dir, "compiled_model.joblib"))
+    np.testing.assert_allclose(compiled.cluster_centers_, centers, atol=1e-3)
+
+    # 超出保留版本数时删除最旧的版本；回滚到旧版本
+    retrain_cluster(db_path=db_path, models_dir=models_dir, chunk_size=300, keep_versions=2)
+    retrain_cluster(db_path=db_path, models_dir=models_dir, chunk_size=300, keep_versions=2)
+    assert list_cluster_versions(models_dir) == [2, 3]
+    activate_cluster_version(2, models_dir)
+    with open(os.path.join(models_dir, "cluster_model_v2.json"), encoding='utf-8') as f:
+        v2_centers = json.load(f)['centers']
+    np.testing.assert_allclose(CompiledModel.load(os.path.join(models_dir, "compiled_model.joblib")).cluster_centers_,
+                               v2_centers, atol=1e-3)
+    print("✅ 聚类模型再训练测试通过")
+
+
+def test_retrain_cluster_skips_empty_and_small_chunks(tmp_path):
+    """测试再训练：全是缺失读数的块跳过，不足聚类数的块并入相邻批次，不单独训练"""
+    models_dir = str(tmp_path / "ai_models")
+    shutil.copytree(RealAIAnalyzer().models_dir, models_dir)
+
+    X = np.random.default_rng(2).normal((30, 75, 60), (2, 5, 5), size=(1000, 3))
+    X[300:600] = np.nan   # 第2块全部缺失
+    X[601:900] = np.nan   # 第3块只剩1条
+    db_path = str(tmp_path / "fleet.db")
+    with DatabaseManager(db_path=db_path) as db:
+        db.save_sensor_data_batch([{'device_id': "dev", 'temp': None if np.isnan(t) else t, 'hum': h,
+                                    'air': a, 'ts': 1764415200 + i} for i, (t, h, a) in enumerate(X)])
+
+    info = retrain_cluster(db_path=db_path, models_dir=models_dir, chunk_size=300, activate=False)
+    assert info['rows'] == 300 + 1 + 100  # 第4块剩余100条
+    assert info['chunks'] == 2
+    assert np.isfinite(info['centers']).all()
+
+    # 首块也不足聚类数时与后续数据合并
+    info = retrain_cluster(db_path=db_path, models_dir=models_dir, chunk_size=300, since=1764415200 + 600,
+                           activate=False)
+    assert info['rows'] == 1 + 100 and info['chunks'] == 1
+    print("✅ 再训练跳过空块测试通过")
+
+
 if __name__ == "__main__":
     print("开始运行cloud-services测试...")
     test_ai_analyzer_integration()
+    test_analyze_batch_matches_single_analysis()
+    test_build_analysis_rows()
+    test_generate_training_data_vectorized()
+    test_compiled_engine_matches_sklearn()
+    test_compiled_model_scales_with_node_count()
+    test_compiled_engine_does_not_import_sklearn()
+    test_analysis_cache_hits_and_bound()
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        test_model_registry_loads_once(Path(tmp))
+        test_compiled_model_exported_on_first_load(Path(tmp) / "export")
+        test_analysis_cache_follows_retrained_model(Path(tmp) / "cache")
+        test_retrain_cluster_from_database(Path(tmp))
+        test_retrain_cluster_skips_empty_and_small_chunks(Path(tmp) / "chunks")
     print("所有测试完成！")
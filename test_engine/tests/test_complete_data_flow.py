@@ -16,31 +16,31 @@ sys.path.extend([
 
 from database import DatabaseManager
 from real_ai_analyzer import RealAIAnalyzer
+from main import run_fleet_analysis
 
 
-def test_complete_data_flow():
-    """测试从数据库读取真实数据并进行AI分析的完整流程"""
+def test_complete_data_flow(tmp_path):
+    """测试从数据库读取近期数据并进行AI分析的完整流程"""
     print("🚀 开始完整数据流测试...")
     
-    # 1. 初始化组件
-    db = DatabaseManager()  # 使用真实数据库
+    # 1. 初始化组件：临时数据库写入两台设备最近10分钟的读数（仓库中的数据库没有近期数据）
+    db = DatabaseManager(db_path=str(tmp_path / "data_flow.db"))
     ai = RealAIAnalyzer()
+    now = int(time.time())
+    db.save_sensor_data_batch([{'device_id': f"device_{d}", 'temp': 24.0 + d, 'hum': 50.0 + i, 'air': 85.0,
+                                'ts': now - i * 60} for d in range(2) for i in range(10)])
     
-    # 2. 检查数据库中是否有真实数据
+    # 2. 检查数据库中的设备
     devices = db.get_all_devices()
-    if not devices:
-        print("⏭️  跳过测试 - 数据库中无设备数据")
-        return True  # 优雅跳过
+    assert devices == ["device_0", "device_1"]
     
-    device_id = devices[1]  # 使用第一个真实设备
+    device_id = devices[1]
     
-    # 3. 获取真实数据
+    # 3. 获取近期数据
     recent_data = db.get_recent_data(device_id, hours=1)  # 最近1小时数据
-    if not recent_data:
-        print("⏭️  跳过测试 - 设备无近期数据")
-        return True
+    assert len(recent_data) == 10
     
-    print(f"📊 使用设备 {device_id} 的 {len(recent_data)} 条真实数据")
+    print(f"📊 使用设备 {device_id} 的 {len(recent_data)} 条近期数据")
     
     # 4. 使用最新数据进行AI分析
     latest_data = recent_data[0]
@@ -62,8 +62,8 @@ def test_complete_data_flow():
     print(f"🤖 分析结果: {analysis_result['environment_type']}")
     print("💡 建议:", analysis_result['ai_suggestions'][:2])  # 只显示前2条建议
     
+    db.close()
     print("🎉 完整数据流测试通过！")
-    return True
 
 
 def test_ai_analysis_with_sample_data():
@@ -90,8 +90,76 @@ def test_ai_analysis_with_sample_data():
     print("✅ 样本数据测试通过")
 
 
+def test_fleet_analysis_with_process_pool(tmp_path):
+    """测试全量设备分析：进程池分片分析并写入ai_analysis表"""
+    db_path = str(tmp_path / "fleet.db")
+    db = DatabaseManager(db_path=db_path)
+    now = int(time.time())
+    records = [{'device_id': f"device_{d:03d}", 'temp': 15.0 + d % 20, 'hum': 40.0 + i, 'air': 80.0, 'ts': now - i * 60}
+               for d in range(30) for i in range(20)]
+    db.save_sensor_data_batch(records)
+    db.close()
+
+    stats = run_fleet_analysis(db_path, workers=2, hours=1, limit=10, chunk_size=8)
+
+    assert stats['devices'] == 30
+    assert stats['readings'] == 300
+    assert stats['saved'] == 300
+    assert stats['rows_per_sec'] > 0
+
+    db = DatabaseManager(db_path=db_path)
+    latest = db.get_latest_analysis()
+    assert len(latest) == 30
+    db.close()
+    print(f"✅ 全量设备分析测试通过: {stats}")
+
+
+def test_incremental_analysis_uses_high_water_marks(tmp_path):
+    """测试增量分析：只分析高水位之后的新数据"""
+    db_path = str(tmp_path / "incremental.db")
+    db = DatabaseManager(db_path=db_path)
+    now = int(time.time())
+    db.save_sensor_data_batch([{'device_id': f"device_{d}", 'temp': 22.0, 'hum': 55.0, 'air': 85.0, 'ts': now - i}
+                               for d in range(5) for i in range(10)])
+
+    first = run_fleet_analysis(db_path, workers=1, hours=1, limit=50)
+    assert first['readings'] == 50
+
+    # 没有新数据：不重复分析
+    assert run_fleet_analysis(db_path, workers=1, hours=1, limit=50)['readings'] == 0
+
+    # 只有device_0有新数据
+    db.save_sensor_data_batch([{'device_id': "device_0", 'temp': 30.0, 'hum': 40.0, 'air': 70.0, 'ts': now + i}
+                               for i in range(1, 4)])
+    third = run_fleet_analysis(db_path, workers=1, hours=1, limit=50)
+    assert third['readings'] == 3
+
+    marks = db.get_high_water_marks()
+    assert marks["device_0"] == max(marks.values())
+    assert db.get_latest_analysis("device_0")['sensor_data_id'] == marks["device_0"]
+    db.close()
+    print("✅ 增量分析测试通过")
+
+
+def test_first_run_latest_analysis_is_newest_reading(tmp_path):
+    """测试首次分析：最新分析结果对应最新的读数（同一秒内批量写入的分析结果）"""
+    db_path = str(tmp_path / "first_run.db")
+    db = DatabaseManager(db_path=db_path)
+    now = int(time.time())
+    db.save_sensor_data_batch([{'device_id': "d", 'temp': 20.0 + i, 'hum': 55.0, 'air': 85.0, 'ts': now - 10 + i}
+                               for i in range(10)])
+    newest = db.get_recent_data("d", hours=1, limit=1)[0]['id']
+
+    assert run_fleet_analysis(db_path, workers=1, hours=1, limit=50)['readings'] == 10
+    assert db.get_latest_analysis("d")['sensor_data_id'] == newest == 10
+    assert db.get_latest_analysis()[0]['sensor_data_id'] == newest
+    db.close()
+    print("✅ 首次分析最新结果测试通过")
+
+
 if __name__ == "__main__":
-    # 优先使用真实数据，没有则使用样本数据
-    if not test_complete_data_flow():
-        test_ai_analysis_with_sample_data()
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        test_complete_data_flow(Path(tmp))
+    test_ai_analysis_with_sample_data()
     print("🎉 所有测试完成！")
\ No newline at end of file
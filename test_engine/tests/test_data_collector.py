@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+数据收集服务测试 - 不依赖MQTT broker，直接驱动消息回调
+"""
+import asyncio
+import pytest
+import sys
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root / "IoT_EnvMonitorSys_Basic" / "cloud_services" / "data_collector"))
+
+from mqtt_receiver import DataCollector, device_shard
+from collector_supervisor import CollectorSupervisor
+from async_receiver import AsyncDataCollector
+from payload_parser import parse_payload, parse_records, encode_binary, device_id_hash, PayloadError
+from streaming_anomaly import StreamingAnomalyDetector
+sys.path.insert(0, str(project_root))
+from test_engine.utils.fake_mqtt_broker import FakeMQTTBroker
+
+
+def make_message(i, device_id="test_device"):
+    payload = f'{{"device_id":"{device_id}","temp":{20 + i % 10:.2f},"hum":55.00,"air":80.00,"ts":{1764415200 + i}}}'
+    return SimpleNamespace(topic=f"devices/{device_id}/sensor_data", payload=payload.encode('utf-8'))
+
+
+def fail_writes(db, failures):
+    """让 save_sensor_data_batch 先失败 failures 次（模拟 database is locked）"""
+    save = db.save_sensor_data_batch
+    remaining = [failures]
+
+    def flaky_save(records):
+        if remaining[0] > 0:
+            remaining[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return save(records)
+    db.save_sensor_data_batch = flaky_save
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_parse_firmware_payload_formats():
+    """测试解析固件的标准JSON和丢失引号的非标准格式"""
+    expected = {'device_id': "basic_001", 'temp': 25.5, 'hum': 60.0, 'air': 75.0, 'ts': 1234567890}
+
+    assert parse_payload(b'{"device_id":"basic_001","temp":25.50,"hum":60.00,"air":75.00,"ts":1234567890}') == expected
+    assert parse_payload(b'{device_id:basic_001,temp:25.50,hum:60.00,air:75.00,ts:1234567890}') == expected
+    assert parse_payload('{"device_id": "basic_001", "temp": -3.2, "hum": 60, "air": 75.0, "ts": 1}')['temp'] == -3.2
+    # 字段顺序不同的JSON走通用解析
+    assert parse_payload(b'{"ts":1234567890,"air":75.0,"hum":60.0,"temp":25.5,"device_id":"basic_001"}') == expected
+    print("✅ 负载格式解析测试通过")
+
+
+@pytest.mark.parametrize("payload", [
+    b"not json",
+    b'{"device_id":"basic_001","temp":"hot","hum":60.0,"air":75.0,"ts":1}',
+    b'{"device_id":"basic_001","temp":25.5,"hum":60.0,"ts":1}',
+    b'{"device_id":"","temp":25.5,"hum":60.0,"air":75.0,"ts":1}',
+    b'{"device_id":"basic_001","temp":25.5,"hum":60.0,"air":75.0,"ts":1.5}',
+    b'[1, 2, 3]',
+])
+def test_parse_rejects_invalid_payloads(payload):
+    """测试字段缺失或类型错误的负载被拒绝"""
+    with pytest.raises(PayloadError):
+        parse_payload(payload)
+
+
+def test_parse_batched_records():
+    """测试解析固件补发离线缓存的批量消息"""
+    batch = b'{"device_id":"basic_001","records":[[25.50,60.00,75.00,1764415200],[-3.20,40.00,90.00,1764415205]]}'
+    assert parse_records(batch) == [
+        {'device_id': "basic_001", 'temp': 25.5, 'hum': 60.0, 'air': 75.0, 'ts': 1764415200},
+        {'device_id': "basic_001", 'temp': -3.2, 'hum': 40.0, 'air': 90.0, 'ts': 1764415205},
+    ]
+    # 单条消息也返回列表
+    assert parse_records(make_message(1).payload) == [parse_payload(make_message(1).payload)]
+    assert parse_records(b'{"device_id":"basic_001","records":[]}') == []
+
+    for payload in (b'{"device_id":"basic_001","records":[[25.5,60.0,75.0]]}',
+                    b'{"records":[[25.5,60.0,75.0,1]]}',
+                    b'{"device_id":"basic_001","records":{"temp":25.5}}'):
+        with pytest.raises(PayloadError):
+            parse_records(payload)
+    print("✅ 批量消息解析测试通过")
+
+
+def test_collector_writes_batched_payloads(tmp_path):
+    """测试一条批量消息（JSON或二进制帧）写入多行，与单条消息混合处理"""
+    db_path = str(tmp_path / "batched.db")
+    collector = DataCollector(db_path=db_path, batch_size=64)
+    collector.start_writers()
+
+    rows = ",".join(f"[{20 + i % 10:.2f},55.00,80.00,{1764415200 + i}]" for i in range(200))
+    payload = f'{{"device_id":"basic_001","records":[{rows}]}}'.encode('utf-8')
+    collector.on_message(None, None, SimpleNamespace(topic="devices/basic_001/sensor_data", payload=payload))
+    collector.on_message(None, None, make_message(500))
+    frame = encode_binary("basic_002", [parse_payload(make_message(i).payload) for i in range(50)])
+    collector.on_message(None, None, SimpleNamespace(topic="devices/basic_002/sensor_data", payload=frame))
+    collector.stop()
+
+    stats = collector.get_stats()
+    assert stats['received'] == 3 and stats['written'] == 251
+    assert count_rows(db_path) == 251
+    print("✅ 批量消息入库测试通过")
+
+
+def test_parse_binary_frames():
+    """测试二进制帧：与JSON解析结果一致，长度、版本和设备ID哈希错误被拒绝"""
+    json_records = [parse_payload(make_message(i).payload) for i in range(100)]
+    frame = encode_binary("test_device", json_records)
+    assert len(frame) == 4 + len("test_device") + 22 * 100
+    assert parse_records(frame) == json_records
+    assert parse_records(encode_binary("test_device", json_records[:1])) == json_records[:1]
+    assert device_id_hash("basic_001") == 699108933  # 与固件FNV-1a一致
+
+    forged = frame.replace(b"test_device", b"test_devicf")
+    for payload in (frame[:-1], frame + b"\x00", forged, frame[:3]):
+        with pytest.raises(PayloadError):
+            parse_records(payload)
+    print("✅ 二进制帧解析测试通过")
+
+
+def test_writer_threads_drain_queue(tmp_path):
+    """测试回调只入队，写入线程批量写库"""
+    db_path = str(tmp_path / "collector.db")
+    collector = DataCollector(db_path=db_path, num_writers=2, batch_size=64)
+    collector.start_writers()
+
+    for i in range(500):
+        collector.on_message(None, None, make_message(i))
+    collector.on_message(None, None, SimpleNamespace(topic="devices/x/sensor_data", payload=b"not json"))
+    collector.stop()
+
+    stats = collector.get_stats()
+    assert stats['received'] == 501
+    assert stats['written'] == 500
+    assert stats['parse_errors'] == 1
+    assert stats['queue_depth'] == 0
+    assert count_rows(db_path) == 500
+    print("✅ 写入线程测试通过")
+
+
+def test_drop_oldest_policy(tmp_path):
+    """测试drop_oldest背压策略：队列满时丢弃最旧数据"""
+    collector = DataCollector(db_path=str(tmp_path / "drop.db"), queue_size=5, backpressure='drop_oldest')
+
+    for i in range(12):
+        collector.on_message(None, None, make_message(i))
+
+    stats = collector.get_stats()
+    assert stats['dropped'] == 7
+    assert stats['queue_depth'] == 5
+    # 保留的是最新的5条
+    assert b'"ts":1764415211' in collector.queue.queue[-1]
+    print("✅ drop_oldest策略测试通过")
+
+
+def test_spill_policy_replays_from_disk(tmp_path):
+    """测试spill背压策略：溢出数据落盘，队列空闲后回放入库"""
+    db_path = str(tmp_path / "spill.db")
+    spill_path = str(tmp_path / "spill.bin")
+    collector = DataCollector(db_path=db_path, queue_size=3, backpressure='spill', spill_path=spill_path)
+
+    for i in range(10):
+        collector.on_message(None, None, make_message(i))
+    assert collector.get_stats()['spilled'] == 7
+    assert os.path.exists(spill_path)
+
+    collector.start_writers()
+    deadline = time.time() + 5
+    while count_rows(db_path) < 10 and time.time() < deadline:
+        time.sleep(0.05)
+    collector.stop()
+
+    assert count_rows(db_path) == 10
+    assert not os.path.exists(spill_path)
+    print("✅ spill策略测试通过")
+
+
+def test_write_failures_retry_then_drop_or_spill(tmp_path):
+    """测试写库失败：按退避重试；重试用尽后计入 write_errors，spill 策略转入溢出文件回放"""
+    db_path = str(tmp_path / "retry.db")
+    collector = DataCollector(db_path=db_path, write_retries=2, write_retry_delay=0.01)
+    fail_writes(collector.db, 2)
+    collector._write_batch([make_message(i).payload for i in range(10)])
+    assert collector.get_stats()['written'] == 10
+
+    fail_writes(collector.db, 3)
+    collector._write_batch([make_message(i).payload for i in range(10, 20)])
+    stats = collector.get_stats()
+    assert stats['write_errors'] == 1 and stats['dropped'] == 10
+    collector.db.close()
+    assert count_rows(db_path) == 10
+
+    spill_path = str(tmp_path / "retry_spill.bin")
+    collector = DataCollector(db_path=db_path, backpressure='spill', spill_path=spill_path,
+                              write_retries=1, write_retry_delay=0.01)
+    fail_writes(collector.db, 2)
+    collector._write_batch([make_message(i).payload for i in range(20, 30)] + [b"not json"])
+    stats = collector.get_stats()
+    assert stats['write_errors'] == 1 and stats['spilled'] == 10 and stats['dropped'] == 0
+    assert collector.anomaly_detector.get_stats()['updates'] == 0  # 入库后才计入异常检测
+
+    collector._replay_spill()
+    assert collector.get_stats()['written'] == 10
+    assert collector.anomaly_detector.get_stats()['updates'] == 10
+    assert not os.path.exists(spill_path)
+    collector.db.close()
+    assert count_rows(db_path) == 20
+    print("✅ 写库失败重试测试通过")
+
+
+def test_async_collector_retries_failed_writes(tmp_path):
+    """测试异步收集写库失败：按退避重试，重试用尽后计入 write_errors 和 dropped"""
+    collector = AsyncDataCollector(db_path=str(tmp_path / "async_retry.db"), write_retries=2,
+                                   write_retry_delay=0.01)
+
+    async def scenario():
+        collector._loop = asyncio.get_running_loop()
+        fail_writes(collector.db, 2)
+        await collector._write_batch([make_message(i).payload for i in range(10)])
+        fail_writes(collector.db, 3)
+        await collector._write_batch([make_message(i).payload for i in range(10, 20)])
+
+    asyncio.run(scenario())
+    stats = collector.get_stats()
+    assert stats['written'] == 10
+    assert stats['write_errors'] == 1 and stats['dropped'] == 10
+    # 只统计已入库的读数，丢弃的一批不进入异常检测
+    assert collector.anomaly_detector.get_stats()['updates'] == 10
+    collector.db.close()
+    print("✅ 异步写库失败重试测试通过")
+
+
+def test_async_collector_serves_multiple_brokers(tmp_path):
+    """测试异步收集：事件循环驱动两个代理的连接，批量写库在执行器中完成"""
+    db_path = str(tmp_path / "async.db")
+    brokers = [FakeMQTTBroker().start(), FakeMQTTBroker().start()]
+    collector = AsyncDataCollector(db_path=db_path, brokers=[(b.host, b.port) for b in brokers],
+                                   batch_size=64, flush_interval_ms=20)
+
+    async def scenario():
+        stop = asyncio.Event()
+        task = asyncio.create_task(collector.run(stop))
+        for broker in brokers:
+            assert await asyncio.to_thread(broker.wait_for_subscribers)
+        for i in range(400):
+            msg = make_message(i, device_id=f"dev_{i % 2}")
+            brokers[i % 2].publish(msg.topic, msg.payload)
+        brokers[0].publish("devices/x/sensor_data", b"not json")
+
+        deadline = time.time() + 5
+        while collector.stats['written'] < 400 and time.time() < deadline:
+            await asyncio.sleep(0.02)
+        stop.set()
+        await task
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        for broker in brokers:
+            broker.stop()
+
+    stats = collector.get_stats()
+    assert stats['received'] == 401
+    assert stats['written'] == 400
+    assert stats['parse_errors'] == 1
+    assert count_rows(db_path) == 400
+    print("✅ 异步收集测试通过")
+
+
+def test_async_collector_connects_off_event_loop(tmp_path, monkeypatch):
+    """测试异步收集：阻塞的TCP连接在执行器线程中建立，期间事件循环照常运行"""
+    import paho.mqtt.client as mqtt
+    create_socket = mqtt.Client._create_socket_connection
+    connect_threads = []
+
+    def slow_create_socket(client):
+        connect_threads.append(threading.get_ident())
+        time.sleep(0.3)
+        return create_socket(client)
+
+    monkeypatch.setattr(mqtt.Client, "_create_socket_connection", slow_create_socket)
+    with FakeMQTTBroker() as broker:
+        collector = AsyncDataCollector(db_path=str(tmp_path / "async_connect.db"),
+                                       brokers=[(broker.host, broker.port)], flush_interval_ms=20)
+
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticking = asyncio.create_task(ticker())
+            stop = asyncio.Event()
+            task = asyncio.create_task(collector.run(stop))
+            assert await asyncio.to_thread(broker.wait_for_subscribers)
+            msg = make_message(0)
+            broker.publish(msg.topic, msg.payload)
+            deadline = time.time() + 5
+            while collector.stats['written'] < 1 and time.time() < deadline:
+                await asyncio.sleep(0.02)
+            stop.set()
+            await task
+            ticking.cancel()
+            return threading.get_ident(), ticks
+
+        loop_thread, ticks = asyncio.run(scenario())
+
+    assert connect_threads and loop_thread not in connect_threads
+    assert ticks >= 10  # 连接的0.3秒内事件循环没有被阻塞
+    assert collector.get_stats()['written'] == 1
+    print("✅ 异步连接不阻塞事件循环测试通过")
+
+
+def test_supervisor_shards_devices_across_processes(tmp_path):
+    """测试多进程收集：按设备ID哈希分片，每台设备只由一个进程写入"""
+    db_path = str(tmp_path / "sharded.db")
+    DataCollector(db_path=db_path).db.close()  # 预先建表，避免子进程同时初始化
+    with FakeMQTTBroker() as broker:
+        supervisor = CollectorSupervisor(num_workers=3, db_path=db_path,
+                                         broker_host=broker.host, broker_port=broker.port, batch_size=50)
+        supervisor.start()
+        try:
+            assert broker.wait_for_subscribers(3, timeout=20)
+            for i in range(300):
+                msg = make_message(i, device_id=f"dev_{i % 30:02d}")
+                broker.publish(msg.topic, msg.payload)
+            deadline = time.time() + 10
+            while count_rows(db_path) < 300 and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            worker_stats = supervisor.stop()
+
+    assert count_rows(db_path) == 300
+    assert len(worker_stats) == 3
+    for index, stats in worker_stats.items():
+        owned = sum(1 for d in range(30) if device_shard(f"dev_{d:02d}", 3) == index)
+        assert stats['received'] == owned * 10
+        assert stats['written'] == owned * 10
+        assert stats['skipped'] == 300 - owned * 10
+    assert supervisor.get_stats()['written'] == 300
+    print("✅ 多进程分片收集测试通过")
+
+
+def test_supervisor_restarts_workers_that_exit_cleanly(tmp_path):
+    """测试代理不可用时收集进程正常返回（退出码0），管理器按退避重启，代理恢复后继续收集"""
+    db_path = str(tmp_path / "restart.db")
+    collector = DataCollector(db_path=db_path)
+    collector.db.close()
+    closed = FakeMQTTBroker()
+    port = closed.port
+    closed.server.server_close()  # 端口上暂时没有代理
+
+    supervisor = CollectorSupervisor(num_workers=1, db_path=db_path, broker_host="127.0.0.1", broker_port=port,
+                                     restart_delay=0.5, max_restart_delay=2.0, batch_size=10)
+    supervisor.start()
+    try:
+        deadline = time.time() + 20
+        while supervisor.restarts < 3 and time.time() < deadline:
+            supervisor.check_workers()
+            time.sleep(0.02)
+        assert supervisor.restarts >= 3
+        assert supervisor._backoff[0] == 2.0  # 连续重启的退避翻倍到上限
+
+        with FakeMQTTBroker(port=port) as broker:
+            deadline = time.time() + 20
+            while not broker.wait_for_subscribers(1, timeout=0.1) and time.time() < deadline:
+                supervisor.check_workers()
+            for i in range(20):
+                msg = make_message(i)
+                broker.publish(msg.topic, msg.payload)
+            deadline = time.time() + 10
+            while count_rows(db_path) < 20 and time.time() < deadline:
+                time.sleep(0.05)
+    finally:
+        worker_stats = supervisor.stop()
+
+    assert count_rows(db_path) == 20
+    assert worker_stats[0]['written'] == 20
+    assert worker_stats[0]['queue_capacity'] == collector.queue.maxsize  # 多次运行的队列容量不累加
+    print(f"✅ 收集进程重启测试通过 - 重启 {supervisor.restarts} 次")
+
+
+def test_streaming_anomaly_detector():
+    """测试按设备的在线统计：单点异常、漂移、有界内存"""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    detector = StreamingAnomalyDetector(max_devices=4)
+
+    def reading(i, temp, device_id="dev_a"):
+        return {'device_id': device_id, 'temp': temp + rng.normal(0, 1), 'hum': 55 + rng.normal(0, 3),
+                'air': 80 + rng.normal(0, 3), 'ts': i}
+
+    assert detector.update_batch([reading(i, 22) for i in range(300)]) == []
+    stats = detector.device_stats("dev_a")
+    assert stats['count'] == 300 and abs(stats['mean']['temp'] - 22) < 0.3 and 0.8 < stats['std']['temp'] < 1.2
+
+    # 单个尖峰只报告单点异常，不会被当作漂移
+    events = detector.update({'device_id': "dev_a", 'temp': 40.0, 'hum': 55.0, 'air': 80.0, 'ts': 300})
+    assert [(e['kind'], e['field']) for e in events] == [('zscore', 'temp')]
+
+    # 持续偏移3°C：读数都在阈值内，EWMA偏离基线后报告一次漂移
+    events = detector.update_batch([reading(i, 25) for i in range(301, 400)])
+    assert [(e['kind'], e['field']) for e in events] == [('drift', 'temp')]
+    assert detector.device_stats("dev_a")['drifting'] == ['temp']
+
+    # 其它设备有自己的基线：同样的温度不是异常
+    assert detector.update_batch([reading(i, 25, "dev_b") for i in range(100)]) == []
+
+    # 设备数超过上限时淘汰最久未上报的设备，统计数组不再增长
+    memory = detector.memory_bytes()
+    for k in range(10):
+        detector.update(reading(0, 22, f"dev_{k}"))
+    stats = detector.get_stats()
+    assert stats['devices'] == 4 and stats['evicted'] == 8 and stats['memory_bytes'] == memory
+    assert detector.device_stats("dev_a") is None
+    print("✅ 流式异常检测测试通过")
+
+
+def test_streaming_anomaly_updates_per_device_batch():
+    """测试异常检测按批处理：每批只加锁一次，每台设备一次向量化更新，而不是逐条处理"""
+    records = [parse_payload(make_message(i, device_id=f"dev_{i % 10}").payload) for i in range(5000)]
+    detector = StreamingAnomalyDetector()
+    lock = detector._lock
+    calls = {'lock': 0, 'devices': 0, 'rows': 0}
+
+    class CountingLock:
+        def __enter__(self):
+            calls['lock'] += 1
+            return lock.__enter__()
+
+        def __exit__(self, *exc):
+            return lock.__exit__(*exc)
+
+    update_device = detector._update_device
+
+    def counting_update(device_id, rows, events):
+        calls['devices'] += 1
+        calls['rows'] += len(rows)
+        return update_device(device_id, rows, events)
+
+    detector._lock = CountingLock()
+    detector._update_device = counting_update
+    for i in range(0, len(records), 500):  # 与写入线程的批次大小相当
+        detector.update_batch(records[i:i + 500])
+
+    assert calls['lock'] == 10
+    assert calls['devices'] == 10 * 10
+    assert calls['rows'] == len(records)
+    detector._lock = lock
+    assert detector.get_stats()['updates'] == len(records)
+    print("✅ 异常检测按批处理测试通过")
+
+
+def test_collector_reports_streaming_anomalies(tmp_path):
+    """测试写入线程在入库时更新异常检测统计"""
+    collector = DataCollector(db_path=str(tmp_path / "collector.db"), batch_size=64)
+    collector.start_writers()
+    for i in range(200):
+        collector.on_message(None, None, make_message(i))
+    spike = b'{"device_id":"test_device","temp":90.00,"hum":55.00,"air":80.00,"ts":1764416000}'
+    collector.on_message(None, None, SimpleNamespace(topic="devices/test_device/sensor_data", payload=spike))
+    collector.stop()
+
+    assert collector.get_stats()['anomalies'] == 1
+    assert collector.anomaly_detector.recent[-1]['value'] == 90.0
+    assert collector.anomaly_detector.device_stats("test_device")['count'] == 201
+    print("✅ 收集器异常检测测试通过")
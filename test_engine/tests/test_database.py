@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+数据库管理模块测试 - 使用临时数据库，不修改仓库中的sensor_data.db
+"""
+import sys
+import os
+import shutil
+import sqlite3
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from IoT_EnvMonitorSys_Basic.cloud_services.shared import database
+from IoT_EnvMonitorSys_Basic.cloud_services.shared.database import DatabaseManager, load_columnar
+
+
+def make_record(i, device_id="test_device", ts=1764415200):
+    return {'device_id': device_id, 'temp': 20.0 + i % 10, 'hum': 50.0, 'air': 80.0, 'ts': ts + i}
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_save_sensor_data_batch(tmp_path):
+    """测试批量写入：单事务 executemany"""
+    db_path = str(tmp_path / "batch.db")
+    db = DatabaseManager(db_path=db_path)
+
+    written = db.save_sensor_data_batch([make_record(i) for i in range(1000)])
+    db.save_sensor_data(make_record(1000))
+
+    assert written == 1000
+    assert count_rows(db_path) == 1001
+    db.close()
+    print("✅ 批量写入测试通过")
+
+
+def test_default_path_creates_missing_tables(tmp_path):
+    """测试默认路径：已有的库（仓库中的sensor_data.db副本）补齐汇总表，可直接写入"""
+    db_path = str(tmp_path / "sensor_data.db")
+    shutil.copyfile(database.DEFAULT_DB_PATH, db_path)
+    existing = count_rows(db_path)
+    original, database.DEFAULT_DB_PATH = database.DEFAULT_DB_PATH, db_path
+    try:
+        db = DatabaseManager()
+    finally:
+        database.DEFAULT_DB_PATH = original
+
+    assert db.db_path == db_path
+    db.save_sensor_data(make_record(0, device_id="default_path_device"))
+    assert count_rows(db_path) == existing + 1
+    # 历史数据也补进了汇总表
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT SUM(count) FROM sensor_rollup_1d").fetchone()[0] == \
+        conn.execute("SELECT COUNT(*) FROM sensor_data WHERE timestamp IS NOT NULL").fetchone()[0]
+    conn.close()
+    db.close()
+    print("✅ 默认路径建表测试通过")
+
+
+def test_existing_database_migrated_on_first_write(tmp_path):
+    """测试已有的库：只读使用不修改文件，首次写入时才补齐表结构并切换到WAL"""
+    db_path = str(tmp_path / "sensor_data.db")
+    shutil.copyfile(database.DEFAULT_DB_PATH, db_path)
+    with open(db_path, 'rb') as f:
+        original_bytes = f.read()
+
+    db = DatabaseManager(db_path=db_path)
+    devices = db.get_all_devices()
+    assert devices
+    assert db.get_high_water_marks() == {}
+    assert db.get_latest_analysis() == []
+    # 没有汇总表时按原始数据聚合
+    assert db.query_rollup(devices[0], 0, 2 ** 31, resolution=86400)
+    db.close()
+    with open(db_path, 'rb') as f:
+        assert f.read() == original_bytes
+    assert not os.path.exists(db_path + "-wal")
+
+    db = DatabaseManager(db_path=db_path)
+    db.save_sensor_data(make_record(0, device_id="first_write_device"))
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("SELECT COUNT(*) FROM sensor_rollup_1d").fetchone()[0] > 0
+    conn.close()
+    db.close()
+
+    # 迁移幂等：再次打开后直接就绪
+    db = DatabaseManager(db_path=db_path)
+    assert db._ensure_schema(create=False)
+    db.close()
+    print("✅ 首次写入迁移测试通过")
+
+
+def test_buffered_mode_flushes_on_size_and_interval(tmp_path):
+    """测试缓冲模式：满N条立即落盘，不足N条等待T毫秒后落盘"""
+    db_path = str(tmp_path / "buffered.db")
+    db = DatabaseManager(db_path=db_path, buffer_size=100, flush_interval_ms=50)
+
+    for i in range(150):
+        db.save_sensor_data(make_record(i))
+    assert count_rows(db_path) == 100  # 前100条按条数阈值落盘
+
+    time.sleep(0.3)
+    assert count_rows(db_path) == 150  # 剩余50条按时间阈值落盘
+
+    db.save_sensor_data(make_record(150))
+    db.close()  # 关闭时落盘剩余数据
+    assert count_rows(db_path) == 151
+    print("✅ 缓冲写入测试通过")
+
+
+def test_buffered_flush_keeps_records_on_failure(tmp_path):
+    """测试缓冲模式写入失败：数据保留在缓冲区，定时落盘重试后不丢失"""
+    db_path = str(tmp_path / "buffered_retry.db")
+    db = DatabaseManager(db_path=db_path, buffer_size=100, flush_interval_ms=50)
+    insert = db._insert_sensor_rows
+    failures = [2]
+
+    def flaky_insert(records):
+        if failures[0] > 0:
+            failures[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return insert(records)
+
+    db._insert_sensor_rows = flaky_insert
+    for i in range(10):
+        db.save_sensor_data(make_record(i))
+
+    # 显式落盘失败时异常抛给调用方，数据留在缓冲区
+    try:
+        db.flush()
+        assert False, "flush 应抛出写入异常"
+    except sqlite3.OperationalError:
+        pass
+    assert len(db._buffer) == 10 and count_rows(db_path) == 0
+
+    # 定时落盘第一次失败后重新安排，第二次成功
+    deadline = time.time() + 2
+    while count_rows(db_path) < 10 and time.time() < deadline:
+        time.sleep(0.02)
+    assert failures[0] == 0
+    assert count_rows(db_path) == 10 and not db._buffer
+    db.close()
+    print("✅ 缓冲落盘失败重试测试通过")
+
+
+def test_recent_data_time_window_and_paging(tmp_path):
+    """测试时间窗口查询和游标分页"""
+    db = DatabaseManager(db_path=str(tmp_path / "window.db"))
+    now = int(time.time())
+    # 每台设备200条，每分钟一条，最新一条为30秒前
+    records = [make_record(i, device_id=dev, ts=now - 30 - 199 * 60)
+               for dev in ("dev_a", "dev_b") for i in range(0, 200 * 60, 60)]
+    db.save_sensor_data_batch(records)
+
+    # 最近1小时：60条，按时间倒序
+    recent = db.get_recent_data("dev_a", hours=1, limit=1000)
+    assert len(recent) == 60
+    assert recent[0]['ts'] == now - 30
+    assert all(a['ts'] > b['ts'] for a, b in zip(recent, recent[1:]))
+    assert db.get_recent_data("dev_a", hours=1, limit=10, offset=59)[0]['ts'] == now - 30 - 59 * 60
+
+    # 游标分页遍历全部数据，不重复不遗漏
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = db.get_data_page("dev_b", cursor=cursor, page_size=64)
+        seen.extend(row['id'] for row in page)
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 200
+
+    assert sorted(db.get_all_devices()) == ["dev_a", "dev_b"]
+    db.close()
+    print("✅ 时间窗口和分页查询测试通过")
+
+
+def make_analysis(device_id, sensor_data_id, env_type="舒适"):
+    return {'device_id': device_id, 'sensor_data_id': sensor_data_id, 'environment_type': env_type,
+            'comfort_score': 90.0, 'health_risk': "低", 'suggestions': ["✅ 环境舒适，保持现状"],
+            'prediction_confidence': 95.0, 'anomaly_score': 10.0}
+
+
+def test_analysis_upsert_and_latest_per_device(tmp_path):
+    """测试分析结果批量upsert和按设备查询最新分析（含旧表结构迁移）"""
+    db_path = str(tmp_path / "analysis.db")
+    # 旧版本的ai_analysis表结构
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE ai_analysis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, device_id TEXT NOT NULL,
+            environment_type TEXT NOT NULL, comfort_score REAL NOT NULL,
+            health_risk TEXT, suggestions TEXT, analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.close()
+
+    db = DatabaseManager(db_path=db_path)
+    assert db.save_analysis_batch([make_analysis("dev_a", i) for i in range(1, 4)] +
+                                  [make_analysis("dev_b", i) for i in range(4, 6)]) == 5
+    # 同一条传感器数据重新分析：更新而不是新增
+    db.save_analysis_batch([make_analysis("dev_a", 3, env_type="炎热")])
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM ai_analysis").fetchone()[0] == 5
+    conn.close()
+
+    latest = db.get_latest_analysis("dev_a")
+    assert latest['sensor_data_id'] == 3
+    assert latest['environment_type'] == "炎热"
+    assert latest['suggestions'] == ["✅ 环境舒适，保持现状"]
+    assert db.get_latest_analysis("unknown") is None
+
+    # 同一批按读数倒序写入：最新分析仍是最新的读数
+    db.save_analysis_batch([make_analysis("dev_c", i) for i in (9, 8, 7)])
+    assert db.get_latest_analysis("dev_c")['sensor_data_id'] == 9
+
+    fleet = {row['device_id']: row['sensor_data_id'] for row in db.get_latest_analysis()}
+    assert fleet == {"dev_a": 3, "dev_b": 5, "dev_c": 9}
+    db.close()
+    print("✅ 分析结果持久化测试通过")
+
+
+def test_rollups_incremental_and_query(tmp_path):
+    """测试降采样汇总：批量写入时增量更新，查询自动选择最粗粒度汇总表"""
+    db = DatabaseManager(db_path=str(tmp_path / "rollup.db"))
+    start = 1764374400  # 整天对齐
+    # 3天数据，每30秒一条，分多个批次写入
+    records = [{'device_id': "dev_a", 'temp': 10.0 + (i % 50) * 0.5, 'hum': 50.0 + i % 7,
+                'air': 80.0, 'ts': start + i * 30} for i in range(3 * 2880)]
+    for i in range(0, len(records), 1000):
+        db.save_sensor_data_batch(records[i:i + 1000])
+
+    assert DatabaseManager.choose_rollup_level(7200) == ('sensor_rollup_1h', 3600)
+    assert DatabaseManager.choose_rollup_level(86400 * 7) == ('sensor_rollup_1d', 86400)
+    assert DatabaseManager.choose_rollup_level(90) == (None, 1)
+
+    def expected(resolution, end):
+        buckets = {}
+        for r in records:
+            if r['ts'] <= end:
+                buckets.setdefault(r['ts'] // resolution * resolution, []).append(r)
+        return buckets
+
+    end = start + 3 * 86400 - 1
+    for resolution in (86400, 7200, 300, 90):
+        rows = db.query_rollup("dev_a", start, end, resolution=resolution)
+        buckets = expected(resolution, end)
+        assert [row['ts'] for row in rows] == sorted(buckets)
+        for row in rows:
+            items = buckets[row['ts']]
+            assert row['count'] == len(items)
+            assert row['temp_min'] == min(r['temp'] for r in items)
+            assert row['temp_max'] == max(r['temp'] for r in items)
+            assert abs(row['hum_avg'] - sum(r['hum'] for r in items) / len(items)) < 1e-9
+
+    # 按最大点数自动选择分辨率：3天/30点 = 8640秒 -> 向上取整为3小时，使用小时汇总表
+    auto = db.query_rollup("dev_a", start, end, max_points=30)
+    assert len(auto) == 24 and auto[1]['ts'] - auto[0]['ts'] == 3 * 3600
+
+    # 全量重建与增量维护结果一致
+    before = db.query_rollup("dev_a", start, end, resolution=60)
+    db.rebuild_rollups()
+    assert db.query_rollup("dev_a", start, end, resolution=60) == before
+    db.close()
+    print("✅ 降采样汇总测试通过")
+
+
+def test_day_partitions_and_retention(tmp_path):
+    """测试按天分区：数据写入各自的分区文件，查询跨分区，过期分区整个文件删除"""
+    db_path = str(tmp_path / "partitioned.db")
+    db = DatabaseManager(db_path=db_path, partition='day', retention_days=30)
+    day = 86400
+    now = int(time.time())
+    today = now // day * day
+    # 最近10天，每台设备每小时一条
+    records = [make_record(i, device_id=dev, ts=today - 9 * day)
+               for dev in ("dev_a", "dev_b") for i in range(0, 10 * day, 3600) if today - 9 * day + i <= now]
+    for i in range(0, len(records), 500):
+        db.save_sensor_data_batch(records[i:i + 500])
+
+    assert len(db.list_partitions()) == 10
+    assert count_rows(db_path) == 0  # 原始数据不写入主库
+    assert db.get_all_devices() == ["dev_a", "dev_b"]
+
+    # 跨分区的时间窗口查询和分页
+    expected = sorted((r['ts'] for r in records if r['device_id'] == "dev_a"), reverse=True)
+    recent = db.get_recent_data("dev_a", hours=None, limit=100, offset=10)
+    assert [r['ts'] for r in recent] == expected[10:110]
+    seen, cursor = [], None
+    while True:
+        page, cursor = db.get_data_page("dev_a", cursor=cursor, page_size=37)
+        seen.extend(row['ts'] for row in page)
+        if cursor is None:
+            break
+    assert seen == expected
+
+    # 分区内 id 全局递增，高水位增量读取可以跨分区
+    first = db.get_new_data("dev_b", 0, limit=30)
+    rest = db.get_new_data("dev_b", first[-1]['id'], limit=100000)
+    ids = [r['id'] for r in first + rest]
+    assert ids == sorted(ids) and len(ids) == len(expected)
+
+    # 原始数据分辨率查询跨分区合并，结果与汇总表一致
+    start = today - 9 * day
+    assert db.query_rollup("dev_a", start, now, resolution=90)[0]['count'] == 1
+    assert sum(r['count'] for r in db.query_rollup("dev_a", start, now, resolution=7 * 3600)) == len(expected)
+
+    # 保留5天：整天都早于保留期的4个分区文件（含 -wal/-shm）被删除，汇总表保留
+    result = db.apply_retention(retention_days=5, now=now)
+    assert result['partitions_dropped'] == 4
+    assert len(db.list_partitions()) == 6
+    oldest = os.path.basename(db.list_partitions()[0][2])
+    assert all(name >= oldest for name in os.listdir(db.partition_dir))
+    assert min(r['ts'] for r in db.get_recent_data("dev_a", hours=None, limit=100000)) == today - 5 * day
+    assert db.query_rollup("dev_a", start, start + day - 1, resolution=86400)[0]['count'] == 24
+    db.close()
+    print("✅ 分区存储和保留策略测试通过")
+
+
+def test_iter_sensor_chunks_streams_all_sources(tmp_path):
+    """测试按 id 分块遍历全部设备数据：跨主库和分区，时间范围过滤"""
+    db = DatabaseManager(db_path=str(tmp_path / "chunks.db"), partition='day')
+    day = 86400
+    start = int(time.time()) // day * day - 3 * day
+    records = [make_record(i, device_id=f"dev_{i % 3}", ts=start) for i in range(0, 3 * day, 600)]
+    db.save_sensor_data_batch(records)
+
+    chunks = list(db.iter_sensor_chunks(chunk_size=100))
+    assert [len(c) for c in chunks[:-1]] == [100] * (len(chunks) - 1)
+    rows = [row for chunk in chunks for row in chunk]
+    ids = [row[0] for row in rows]
+    assert ids == sorted(ids) and len(ids) == len(records)
+    assert sorted(row[5] for row in rows) == [r['ts'] for r in records]
+
+    # 时间范围：只包含第二天的数据
+    window = [row for chunk in db.iter_sensor_chunks(chunk_size=50, since=start + day, until=start + 2 * day)
+              for row in chunk]
+    assert len(window) == day // 600 and all(start + day <= row[5] < start + 2 * day for row in window)
+    db.close()
+    print("✅ 分块遍历测试通过")
+
+
+def test_export_columnar_by_day_and_device(tmp_path):
+    """测试列式导出：按 日期/设备 分目录，分块读取结果与原始数据一致，.npy 以内存映射读取"""
+    import numpy as np
+    day = 86400
+    start = 1764374400  # 2025-11-29 00:00 UTC
+    records = [make_record(i, device_id=f"dev/{k % 3}", ts=start) for k, i in enumerate(range(0, 3 * day, 900))]
+    expected = {}
+    for r in records:
+        expected.setdefault((r['device_id'], (r['ts'] - start) // day), []).append(r)
+
+    for partition in (None, 'day'):
+        db = DatabaseManager(db_path=str(tmp_path / f"export_{partition}.db"), partition=partition)
+        db.save_sensor_data_batch(records + [{'device_id': "dev/0", 'temp': 1.0, 'hum': 1.0, 'air': 1.0, 'ts': None}])
+        output = str(tmp_path / f"export_{partition}")
+        result = db.export_columnar(output, format='npy', chunk_size=50)
+        assert result == {'format': 'npy', 'rows': len(records), 'partitions': 9}
+
+        seen = 0
+        for entry, columns in load_columnar(output):
+            rows = expected[(entry['device_id'], ['2025-11-29', '2025-11-30', '2025-12-01'].index(entry['date']))]
+            assert isinstance(columns['temperature'], np.memmap)
+            assert columns['timestamp'].tolist() == [r['ts'] for r in rows]
+            assert columns['temperature'].dtype == np.float32
+            np.testing.assert_array_equal(columns['temperature'], np.array([r['temp'] for r in rows], dtype=np.float32))
+            seen += len(columns['id'])
+        assert seen == len(records)
+
+        # 按设备和日期过滤；设备ID中的特殊字符在目录名中转义
+        [(entry, columns)] = load_columnar(output, device_id="dev/1", date='2025-11-30')
+        assert entry['path'].startswith(os.path.join("date=2025-11-30", "device_id=dev%2F1"))
+        assert len(columns['id']) == len(expected[("dev/1", 1)])
+        db.close()
+    print("✅ 列式导出测试通过")
+
+
+def test_numpy_query_api_matches_dict_api(tmp_path):
+    """测试结构化数组查询与字典查询结果一致（含分区模式的跨分区归并）"""
+    import numpy as np
+    day = 86400
+    now = int(time.time())
+    records = [make_record(i, device_id=f"dev_{k % 2}", ts=now - 3 * day)
+               for k, i in enumerate(range(0, 3 * day, 300))]
+    records.append({'device_id': "dev_0", 'temp': 1.0, 'hum': 2.0, 'air': 3.0, 'ts': None})
+
+    for partition in (None, 'day'):
+        db = DatabaseManager(db_path=str(tmp_path / f"arrays_{partition}.db"), partition=partition)
+        db.save_sensor_data_batch(records)
+
+        def as_tuples(array):
+            return [(int(r['id']), float(r['temp']), float(r['hum']), float(r['air']), int(r['ts'])) for r in array]
+
+        def dict_tuples(data):
+            return [(r['id'], r['temp'], r['hum'], r['air'], r['ts'] or 0) for r in data]
+
+        array = db.get_recent_array("dev_0", hours=48, limit=200, offset=30)
+        assert array.dtype.names == ('id', 'temp', 'hum', 'air', 'ts') and len(array) == 200
+        assert as_tuples(array) == dict_tuples(db.get_recent_data("dev_0", hours=48, limit=200, offset=30))
+
+        # 全部数据（含 timestamp 为空的记录，排在最后、ts 为0）
+        array = db.get_recent_array("dev_0", hours=None, limit=100000)
+        assert as_tuples(array) == dict_tuples(db.get_recent_data("dev_0", hours=None, limit=100000))
+        assert array['ts'][-1] == 0
+
+        first = db.get_new_data_array("dev_1", 0, limit=100)
+        rest = db.get_new_data_array("dev_1", int(first['id'][-1]), limit=100000)
+        assert as_tuples(np.concatenate([first, rest])) == dict_tuples(db.get_new_data("dev_1", 0, limit=100000))
+        assert len(db.get_new_data_array("missing", 0)) == 0
+        db.close()
+    print("✅ NumPy查询接口测试通过")
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    with tempfile.TemporaryDirectory() as tmp:
+        test_save_sensor_data_batch(Path(tmp))
+        test_default_path_creates_missing_tables(Path(tmp))
+        test_existing_database_migrated_on_first_write(Path(tmp))
+        test_buffered_mode_flushes_on_size_and_interval(Path(tmp))
+        test_buffered_flush_keeps_records_on_failure(Path(tmp))
+        test_recent_data_time_window_and_paging(Path(tmp))
+        test_analysis_upsert_and_latest_per_device(Path(tmp))
+        test_rollups_incremental_and_query(Path(tmp))
+        test_day_partitions_and_retention(Path(tmp))
+        test_iter_sensor_chunks_streams_all_sources(Path(tmp))
+        test_export_columnar_by_day_and_device(Path(tmp))
+        test_numpy_query_api_matches_dict_api(Path(tmp))
+    print("所有测试完成！")
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+固件MQTT客户端测试 - 通过动态库连接本地假MQTT代理，验证长连接批量发布和离线缓存补发
+"""
+import pytest
+import ctypes
+import sys
+import socket
+import time
+from pathlib import Path
+import numpy as np
+
+# 添加项目根目录
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(project_root / "IoT_EnvMonitorSys_Basic" / "cloud_services" / "data_collector"))
+from test_engine.utils.path_resolver import get_library_path
+from test_engine.utils.sensor_lib import SensorLib, SensorData
+from test_engine.utils.fake_mqtt_broker import FakeMQTTBroker
+from payload_parser import parse_payload, parse_records
+
+DATA_TOPIC = "devices/basic_001/sensor_data"   # config.h 中的 MQTT_TOPIC_DATA
+RESULT_NETWORK_ERROR = -3
+MQTT_PAYLOAD_JSON, MQTT_PAYLOAD_BINARY = 0, 1
+
+
+class TestMQTTClient:
+    """固件MQTT客户端测试"""
+
+    def setup_class(self):
+        """加载动态库并声明MQTT接口"""
+        self.dll_path = get_library_path()
+        if not self.dll_path.exists():
+            pytest.skip("动态库文件不存在，跳过MQTT客户端测试")
+
+        self.sensor = SensorLib(self.dll_path)
+        self.lib = self.sensor.lib
+        self.lib.mqtt_client_configure.argtypes = [ctypes.c_char_p, ctypes.c_uint16]
+        self.lib.mqtt_client_configure.restype = ctypes.c_int
+        self.lib.mqtt_client_init.restype = ctypes.c_int
+        self.lib.mqtt_connect.restype = ctypes.c_int
+        self.lib.mqtt_reconnect.restype = ctypes.c_int
+        self.lib.mqtt_is_connected.restype = ctypes.c_bool
+        self.lib.mqtt_publish_sensor_data.argtypes = [ctypes.POINTER(SensorData)]
+        self.lib.mqtt_publish_sensor_data.restype = ctypes.c_int
+        self.lib.mqtt_publish_sensor_batch.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self.lib.mqtt_publish_sensor_batch.restype = ctypes.c_int
+        self.lib.mqtt_flush.restype = ctypes.c_int
+        self.lib.mqtt_get_last_error.restype = ctypes.c_char_p
+        self.lib.offline_buffer_push.argtypes = [ctypes.c_void_p]
+        self.lib.offline_buffer_push.restype = ctypes.c_int
+        for name in ('offline_buffer_count', 'offline_buffer_capacity', 'offline_buffer_dropped'):
+            getattr(self.lib, name).restype = ctypes.c_uint32
+        self.lib.offline_buffer_flush.restype = ctypes.c_int
+        self.lib.mqtt_client_set_payload_format.argtypes = [ctypes.c_int]
+        self.lib.mqtt_client_set_payload_format.restype = ctypes.c_int
+        self.lib.mqtt_publish_sensor_records.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self.lib.mqtt_publish_sensor_records.restype = ctypes.c_int
+        assert self.lib.mqtt_client_init() == 0
+
+    def connect(self, broker):
+        assert self.lib.mqtt_client_configure(broker.host.encode(), broker.port) == 0
+        assert self.lib.mqtt_connect() == 0, self.lib.mqtt_get_last_error()
+        assert self.lib.mqtt_is_connected()
+
+    def test_publish_over_single_connection(self):
+        """测试单条和批量发布都复用同一个连接，负载可被收集器解析"""
+        print("📡 测试MQTT长连接发布...")
+        with FakeMQTTBroker() as broker:
+            self.connect(broker)
+            singles = [self.sensor.read() for _ in range(100)]
+            for data in singles:
+                assert self.lib.mqtt_publish_sensor_data(ctypes.byref(data)) == 0
+            self.lib.mqtt_process()  # 主循环中定期调用，发出缓冲区剩余读数
+
+            samples = self.sensor.read_batch(5000)
+            start = time.perf_counter()
+            assert self.lib.mqtt_publish_sensor_batch(samples.ctypes.data, len(samples)) == 0
+            assert broker.wait_for_messages(5100)
+            elapsed = time.perf_counter() - start
+            self.lib.mqtt_disconnect()
+
+        assert broker.connections == 1
+        assert all(topic == DATA_TOPIC for topic, _ in broker.messages)
+        first = parse_payload(broker.messages[0][1])
+        assert first['device_id'] == "basic_001" and first['ts'] == singles[0].timestamp
+        assert abs(first['temp'] - singles[0].temperature) < 0.01
+        last = parse_payload(broker.messages[-1][1])
+        assert abs(last['hum'] - float(samples['humidity'][-1])) < 0.01
+        print(f"✅ MQTT长连接发布测试通过 - 5000条读数耗时 {elapsed * 1000:.1f}ms")
+
+    def test_connection_errors(self):
+        """测试连接失败和代理断开后状态为离线，发布返回错误"""
+        print("🔌 测试MQTT连接异常...")
+        broker = FakeMQTTBroker()
+        port = broker.port
+        broker.server.server_close()  # 端口上没有代理
+        assert self.lib.mqtt_client_configure(b"127.0.0.1", port) == 0
+        assert self.lib.mqtt_connect() == RESULT_NETWORK_ERROR
+        assert not self.lib.mqtt_is_connected()
+        assert self.lib.mqtt_get_last_error() == b"Cannot connect to broker"
+        assert self.lib.mqtt_publish_sensor_data(ctypes.byref(self.sensor.read())) != 0
+
+        with FakeMQTTBroker() as broker:
+            self.connect(broker)
+        deadline = time.time() + 5
+        while self.lib.mqtt_is_connected() and time.time() < deadline:
+            self.lib.mqtt_process()
+            time.sleep(0.01)
+        assert not self.lib.mqtt_is_connected()
+        self.lib.mqtt_disconnect()
+        print("✅ MQTT连接异常测试通过")
+
+    def test_connect_timeout_and_reconnect_backoff(self):
+        """测试代理无响应时连接按超时返回，连续失败后重连进入退避"""
+        print("⏳ 测试连接超时和重连退避...")
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(0)
+        port = server.getsockname()[1]
+        # 占满监听队列，之后的SYN不再被应答，connect 只能靠超时返回
+        backlog = [socket.create_connection(("127.0.0.1", port))]
+        try:
+            assert self.lib.mqtt_client_configure(b"127.0.0.1", port) == 0
+            start = time.perf_counter()
+            assert self.lib.mqtt_connect() == RESULT_NETWORK_ERROR
+            elapsed = time.perf_counter() - start
+            assert elapsed < 5  # MQTT_CONNECT_TIMEOUT_MS = 3000
+            assert not self.lib.mqtt_is_connected()
+        finally:
+            for conn in backlog:
+                conn.close()
+            server.close()
+
+        # 首次重连失败后进入退避：再次调用直接返回，不发起连接
+        assert self.lib.mqtt_reconnect() == RESULT_NETWORK_ERROR
+        assert self.lib.mqtt_get_last_error() == b"Cannot connect to broker"
+        start = time.perf_counter()
+        assert self.lib.mqtt_reconnect() == RESULT_NETWORK_ERROR
+        assert time.perf_counter() - start < 0.1
+        assert self.lib.mqtt_get_last_error() == b"Waiting to reconnect"
+
+        # 重新配置代理后退避清零
+        with FakeMQTTBroker() as broker:
+            assert self.lib.mqtt_client_configure(broker.host.encode(), broker.port) == 0
+            assert self.lib.mqtt_reconnect() == 0
+            assert self.lib.mqtt_is_connected()
+            self.lib.mqtt_disconnect()
+        print(f"✅ 连接超时和重连退避测试通过 - 超时返回耗时 {elapsed:.1f}s")
+
+
+    def test_offline_buffer_store_and_forward(self):
+        """测试离线缓存：断线期间保留最近的读数，重连后合并为批量消息补发"""
+        print("📦 测试离线缓存补发...")
+        self.lib.mqtt_disconnect()
+        self.lib.offline_buffer_clear()
+        capacity = self.lib.offline_buffer_capacity()
+        samples = self.sensor.read_batch(capacity + 10)
+        samples['timestamp'] = 1764415200 + np.arange(len(samples))
+        for i in range(len(samples)):
+            assert self.lib.offline_buffer_push(samples.ctypes.data + i * samples.itemsize) == 0
+        assert self.lib.offline_buffer_count() == capacity
+        assert self.lib.offline_buffer_dropped() == 10  # 缓存满后覆盖最旧的读数
+        assert self.lib.offline_buffer_flush() != 0     # 未连接时保留在缓存中
+        assert self.lib.offline_buffer_count() == capacity
+
+        with FakeMQTTBroker() as broker:
+            self.connect(broker)
+            assert self.lib.offline_buffer_flush() == 0
+            assert self.lib.offline_buffer_count() == 0
+            messages = -(-capacity // 64)  # 每条消息最多 MQTT_RECORDS_PER_MESSAGE 条读数
+            assert broker.wait_for_messages(messages)
+            self.lib.mqtt_disconnect()
+
+        assert broker.connections == 1 and len(broker.messages) == messages
+        records = [r for _, payload in broker.messages for r in parse_records(payload)]
+        assert [r['ts'] for r in records] == samples['timestamp'][10:].tolist()
+        assert np.allclose([r['temp'] for r in records], samples['temperature'][10:], atol=0.01)
+        assert {r['device_id'] for r in records} == {"basic_001"}
+        self.lib.offline_buffer_clear()
+        print(f"✅ 离线缓存补发测试通过 - {capacity}条读数合并为{messages}条消息")
+
+
+    def test_unsent_readings_requeued_on_disconnect(self):
+        """测试代理断开时发送缓冲区中已接收的读数放回离线缓存，重连后补发不丢失"""
+        print("♻️ 测试断线时未发出读数放回缓存...")
+        self.lib.offline_buffer_clear()
+        samples = self.sensor.read_batch(5)
+        samples['timestamp'] = 1764415200 + np.arange(len(samples))
+        with FakeMQTTBroker() as broker:
+            self.connect(broker)
+        time.sleep(0.1)  # 等待代理关闭连接
+
+        # 读数进入发送缓冲区（返回成功），随后主循环发现连接已断开
+        for i in range(len(samples)):
+            reading = ctypes.cast(samples.ctypes.data + i * samples.itemsize, ctypes.POINTER(SensorData))
+            assert self.lib.mqtt_publish_sensor_data(reading) == 0
+        self.lib.mqtt_process()
+        assert not self.lib.mqtt_is_connected()
+        assert self.lib.offline_buffer_count() == len(samples)
+
+        with FakeMQTTBroker() as broker:
+            self.connect(broker)
+            assert self.lib.offline_buffer_flush() == 0
+            assert broker.wait_for_messages(1)
+            self.lib.mqtt_disconnect()
+        records = [r for _, payload in broker.messages for r in parse_records(payload)]
+        assert [r['ts'] for r in records] == samples['timestamp'].tolist()
+        assert self.lib.offline_buffer_count() == 0
+        print("✅ 断线时未发出读数放回缓存测试通过")
+
+
+    def test_binary_payload_format(self):
+        """测试二进制负载：单条和批量帧可被收集器解析，结果与JSON格式一致"""
+        print("🧮 测试二进制负载...")
+        samples = self.sensor.read_batch(1000)
+        frames = {}
+        for payload_format in (MQTT_PAYLOAD_JSON, MQTT_PAYLOAD_BINARY):
+            assert self.lib.mqtt_client_set_payload_format(payload_format) == 0
+            with FakeMQTTBroker() as broker:
+                self.connect(broker)
+                for i in range(10):
+                    reading = ctypes.cast(samples.ctypes.data + i * samples.itemsize, ctypes.POINTER(SensorData))
+                    assert self.lib.mqtt_publish_sensor_data(reading) == 0
+                assert self.lib.mqtt_publish_sensor_records(samples.ctypes.data, len(samples)) == 0
+                self.lib.mqtt_process()
+                assert broker.wait_for_messages(10 + 16)
+                self.lib.mqtt_disconnect()
+            frames[payload_format] = [payload for _, payload in broker.messages]
+        assert self.lib.mqtt_client_set_payload_format(2) != 0
+        self.lib.mqtt_client_set_payload_format(MQTT_PAYLOAD_JSON)
+
+        binary = frames[MQTT_PAYLOAD_BINARY]
+        assert all(payload[0] == 1 for payload in binary)
+        assert len(binary[0]) == 4 + len("basic_001") + 22
+        records = [r for payload in binary for r in parse_records(payload)]
+        assert records == [r for payload in frames[MQTT_PAYLOAD_JSON] for r in parse_records(payload)]
+        assert len(records) == 1010
+        sizes = {fmt: sum(map(len, payloads[10:])) for fmt, payloads in frames.items()}
+        assert sizes[MQTT_PAYLOAD_BINARY] * 1.4 < sizes[MQTT_PAYLOAD_JSON]
+        print(f"✅ 二进制负载测试通过 - 1000条读数 {sizes[MQTT_PAYLOAD_BINARY]} 字节"
+              f"（JSON批量 {sizes[MQTT_PAYLOAD_JSON]} 字节）")
+
+    def test_json_records_split_when_values_exceed_estimate(self):
+        """测试JSON合并消息：数值位数超出预估时不越界写入，放不下的读数转入下一条消息"""
+        print("📏 测试超长数值的合并消息...")
+        samples = self.sensor.read_batch(64)
+        samples['temperature'] = 3e38
+        samples['humidity'] = -3e38
+        samples['air_quality'] = 3e38
+        samples['timestamp'] = 1764415200 + np.arange(len(samples))
+        with FakeMQTTBroker() as broker:
+            self.connect(broker)
+            assert self.lib.mqtt_publish_sensor_records(samples.ctypes.data, len(samples)) == 0
+            self.lib.mqtt_process()
+            assert broker.wait_for_messages(2)
+            self.lib.mqtt_disconnect()
+        assert len(broker.messages) > 1
+        records = [r for _, payload in broker.messages for r in parse_records(payload)]
+        assert [r['ts'] for r in records] == samples['timestamp'].tolist()
+        assert all(r['temp'] > 1e38 and r['hum'] < -1e38 for r in records)
+        print(f"✅ 超长数值合并消息测试通过 - 64条读数拆为 {len(broker.messages)} 条消息")
+
+
+if __name__ == "__main__":
+    test = TestMQTTClient()
+    test.setup_class()
+    test.test_publish_over_single_connection()
+    test.test_connection_errors()
+    test.test_connect_timeout_and_reconnect_backoff()
+    test.test_offline_buffer_store_and_forward()
+    test.test_unsent_readings_requeued_on_disconnect()
+    test.test_binary_payload_format()
+    test.test_json_records_split_when_values_exceed_estimate()
+    print("🎉 所有MQTT客户端测试通过！")
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+性能测试 - 数据收集链路的微基准
+"""
+import sys
+import json
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root / "IoT_EnvMonitorSys_Basic" / "cloud_services" / "data_collector"))
+
+from payload_parser import parse_payload, parse_records
+from streaming_anomaly import StreamingAnomalyDetector
+
+JSON_PAYLOAD = b'{"device_id":"basic_001","temp":25.50,"hum":60.00,"air":75.00,"ts":1234567890}'
+UNQUOTED_PAYLOAD = b'{device_id:basic_001,temp:25.50,hum:60.00,air:75.00,ts:1234567890}'
+
+
+def legacy_parse(raw):
+    """原 on_message 中的解析方式：先 json.loads，失败后字符串替换修复再解析"""
+    raw = raw.decode('utf-8')
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        fixed = raw.replace('{', '{"').replace(':', '":"').replace(',', '","').replace('}', '"}')
+        fixed = fixed.replace('"","', '","').replace('":"{', ':{')
+        return json.loads(fixed)
+
+
+def measure_rate(parser, payload, count=50000):
+    """返回每秒解析消息数"""
+    start = time.perf_counter()
+    for _ in range(count):
+        parser(payload)
+    return count / (time.perf_counter() - start)
+
+
+def test_payload_parser_throughput():
+    """解析器吞吐基准：标准JSON和非标准格式"""
+    results = {}
+    for name, payload in (("标准JSON", JSON_PAYLOAD), ("非标准格式", UNQUOTED_PAYLOAD)):
+        rate = measure_rate(parse_payload, payload)
+        legacy_rate = measure_rate(legacy_parse, payload)
+        results[name] = rate
+        print(f"📊 {name}: {rate:,.0f} 条/秒 (原实现 {legacy_rate:,.0f} 条/秒, {rate / legacy_rate:.1f}x)")
+
+    # 宽松下限，只用于发现数量级的性能回退
+    assert results["标准JSON"] > 20000
+    assert results["非标准格式"] > 20000
+    print("✅ 解析器性能测试通过")
+
+
+def test_streaming_anomaly_throughput():
+    """异常检测吞吐基准：与负载解析对比，检测不应成为收集管道中最慢的环节"""
+    import numpy as np
+    rng = np.random.default_rng(1)
+    values = rng.normal((22, 55, 80), 1, size=(50000, 3))
+    payloads = [(f'{{"device_id":"dev_{i % 100}","temp":{t:.2f},"hum":{h:.2f},"air":{a:.2f},'
+                 f'"ts":{1764415200 + i}}}').encode('utf-8') for i, (t, h, a) in enumerate(values)]
+
+    start = time.perf_counter()
+    records = [record for payload in payloads for record in parse_records(payload)]
+    parse_seconds = time.perf_counter() - start
+
+    detector = StreamingAnomalyDetector()
+    start = time.perf_counter()
+    for i in range(0, len(records), 500):  # 与写入线程的批次大小相当
+        detector.update_batch(records[i:i + 500])
+    detect_seconds = time.perf_counter() - start
+
+    rate = len(records) / detect_seconds
+    print(f"📊 异常检测: {rate:,.0f} 条/秒 (解析 {len(records) / parse_seconds:,.0f} 条/秒)")
+
+    # 宽松下限，只用于发现数量级的性能回退
+    assert detector.get_stats()['updates'] == len(records)
+    assert rate > 20000
+    print("✅ 异常检测性能测试通过")
+
+
+if __name__ == "__main__":
+    test_payload_parser_throughput()
+    test_streaming_anomaly_throughput()
@@ -13,6 +13,7 @@ from pathlib import Path
 # 添加项目根目录
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 from test_engine.utils.path_resolver import get_library_path
+from test_engine.utils.sensor_lib import SensorLib, SensorData, SENSOR_DATA_DTYPE, REGION_RANDOM
 
 
 class TestSensorModule:
@@ -202,6 +203,72 @@ class TestSensorModule:
         
         print("✅ 数据连续性测试通过")
 
+
+    def test_batch_read_zero_copy(self):
+        """测试批量读取：一次调用生成大量样本，直接写入NumPy/调用方缓冲区"""
+        import numpy as np
+        print("📦 测试批量读取...")
+        sensor = SensorLib(self.dll_path)
+        assert SENSOR_DATA_DTYPE.itemsize == ctypes.sizeof(SensorData)
+
+        start = time.perf_counter()
+        samples = sensor.read_batch(1_000_000)
+        elapsed = time.perf_counter() - start
+
+        # 各地区模型的取值边界（温度 -15~30°C，湿度 15~100%，空气质量 55~100）
+        assert -15.0 <= samples['temperature'].min() and samples['temperature'].max() <= 30.0
+        assert 15.0 <= samples['humidity'].min() and samples['humidity'].max() <= 100.0
+        assert 55.0 <= samples['air_quality'].min() and samples['air_quality'].max() <= 100.0
+        # 整批共用时间戳，序列号连续递增（uint16 回绕）
+        assert len(np.unique(samples['timestamp'])) == 1
+        assert np.all(np.diff(samples['sequence'].astype(np.int64)) % 65536 == 1)
+
+        # 通过缓冲区协议写入调用方提供的内存，不复制
+        buffer = bytearray(SENSOR_DATA_DTYPE.itemsize * 100)
+        view = sensor.read_batch(out=buffer)
+        assert np.shares_memory(view, np.frombuffer(buffer, dtype=np.uint8))
+        assert (view['humidity'] > 0).all()
+
+        temps, hums, airs = sensor.read_columns(1000)
+        assert temps.dtype == np.float32 and len(airs) == 1000 and (hums > 0).all()
+        print(f"✅ 批量读取测试通过 - 100万条样本耗时 {elapsed * 1000:.1f}ms")
+
+    def test_seeded_emulators_reproducible_across_threads(self):
+        """测试模拟器上下文：相同种子可复现，设备之间互不影响，多线程并行结果与串行一致"""
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        print("🎲 测试可复现的多设备模拟...")
+        sensor = SensorLib(self.dll_path)
+        fields = ['temperature', 'humidity', 'air_quality', 'sequence']
+
+        with sensor.create_emulator(seed=42) as a, sensor.create_emulator(seed=42) as b:
+            first = a.read_batch(1000)
+            assert [a.read().sequence, b.read_batch(1000)[0]['sequence']] == [1000, 0]
+        with sensor.create_emulator(seed=42) as c, sensor.create_emulator(seed=43) as d:
+            assert np.array_equal(c.read_batch(1000)[fields], first[fields])
+            assert not np.array_equal(d.read_batch(1000)['temperature'], first['temperature'])
+
+        # 固定地区（东北：-15~10°C，湿度 25~60%，空气质量 80~100）
+        with sensor.create_emulator(seed=7, region=3) as dongbei:
+            samples = dongbei.read_batch(10000)
+        assert -15.0 <= samples['temperature'].min() and samples['temperature'].max() < 10.0
+        assert 25.0 <= samples['humidity'].min() and samples['humidity'].max() < 60.0
+        assert 80.0 <= samples['air_quality'].min()
+        with pytest.raises(ValueError):
+            sensor.create_emulator(seed=1, region=8)
+
+        # 1000个设备在8个线程中并行读取，与串行结果逐位一致
+        def simulate(seed):
+            with sensor.create_emulator(seed, REGION_RANDOM) as emulator:
+                return emulator.read_batch(500)[fields]
+
+        seeds = range(1000)
+        serial = [simulate(seed) for seed in seeds]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            parallel = list(pool.map(simulate, seeds))
+        assert all(np.array_equal(p, s) for p, s in zip(parallel, serial))
+        assert not np.array_equal(serial[0], serial[1])
+        print("✅ 可复现多设备模拟测试通过")
     
 
 if __name__ == "__main__":
@@ -215,6 +282,8 @@ if __name__ == "__main__":
 
         test.test_sensor_data_validity()
         test.test_sensor_data_continuity()
+        test.test_batch_read_zero_copy()
+        test.test_seeded_emulators_reproducible_across_threads()
 
         print("🎉 所有传感器测试通过！")
     except Exception as e:
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+本地假MQTT代理 - 实现MQTT 3.1.1的最小子集，用于不依赖mosquitto的收发测试
+
+支持 CONNECT/SUBSCRIBE/UNSUBSCRIBE/PUBLISH(QoS 0/1)/PINGREQ/DISCONNECT；
+收到的PUBLISH全部记录在 messages 中，并以QoS 0转发给订阅匹配的客户端
+"""
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT主题过滤器匹配（支持 + 和 #）"""
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def encode_packet(packet_type, flags, body):
+    """组装MQTT报文：固定头 + 剩余长度（变长编码） + 报文体"""
+    header = bytearray([(packet_type << 4) | flags])
+    length = len(body)
+    while True:
+        byte = length % 128
+        length //= 128
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    return bytes(header) + body
+
+
+def _read_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        data += chunk
+    return data
+
+
+def read_packet(sock):
+    """读取一个MQTT报文，返回 (类型, 标志位, 报文体)"""
+    first = _read_exact(sock, 1)[0]
+    length, shift = 0, 0
+    while True:
+        byte = _read_exact(sock, 1)[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return first >> 4, first & 0x0F, _read_exact(sock, length)
+
+
+def _read_string(body, offset):
+    size = struct.unpack_from('>H', body, offset)[0]
+    return body[offset + 2:offset + 2 + size].decode('utf-8'), offset + 2 + size
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server.broker
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.filters = set()
+        self.send_lock = threading.Lock()
+        broker._register(self)
+        try:
+            while True:
+                packet_type, flags, body = read_packet(sock)
+                if packet_type == 1:  # CONNECT
+                    broker.connections += 1
+                    self.send(encode_packet(2, 0, b'\x00\x00'))
+                elif packet_type == 3:  # PUBLISH
+                    topic, offset = _read_string(body, 0)
+                    qos = (flags >> 1) & 0x03
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        self.send(encode_packet(4, 0, packet_id))  # PUBACK
+                    broker._publish(topic, body[offset:])
+                elif packet_type == 8:  # SUBSCRIBE
+                    offset, granted = 2, bytearray()
+                    while offset < len(body):
+                        topic_filter, offset = _read_string(body, offset)
+                        offset += 1  # 请求的QoS，统一授予0
+                        self.filters.add(topic_filter)
+                        granted.append(0)
+                    self.send(encode_packet(9, 0, body[:2] + bytes(granted)))
+                elif packet_type == 10:  # UNSUBSCRIBE
+                    offset = 2
+                    while offset < len(body):
+                        topic_filter, offset = _read_string(body, offset)
+                        self.filters.discard(topic_filter)
+                    self.send(encode_packet(11, 0, body[:2]))
+                elif packet_type == 12:  # PINGREQ
+                    self.send(encode_packet(13, 0, b''))
+                elif packet_type == 14:  # DISCONNECT
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker._unregister(self)
+
+    def send(self, data):
+        with self.send_lock:
+            self.request.sendall(data)
+
+
+class FakeMQTTBroker:
+    """在本地随机端口上运行的假MQTT代理"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.server = socketserver.ThreadingTCPServer((host, port), _ClientHandler, bind_and_activate=False)
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.broker = self
+        self.host, self.port = self.server.server_address
+        self.messages = []        # 收到的 (topic, payload)
+        self.connections = 0      # 累计CONNECT次数
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def wait_for_messages(self, count, timeout=5.0):
+        """等待累计收到 count 条消息，返回是否达到"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if len(self.messages) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def wait_for_subscribers(self, count=1, timeout=5.0):
+        """等待至少 count 个客户端完成订阅"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if sum(1 for c in self._clients if c.filters) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def publish(self, topic, payload):
+        """由代理直接向订阅者下发一条消息"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        self._forward(topic, payload)
+
+    def _register(self, client):
+        with self._lock:
+            self._clients.add(client)
+
+    def _unregister(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def _publish(self, topic, payload):
+        with self._lock:
+            self.messages.append((topic, payload))
+        self._forward(topic, payload)
+
+    def _forward(self, topic, payload):
+        topic_bytes = topic.encode('utf-8')
+        packet = encode_packet(3, 0, struct.pack('>H', len(topic_bytes)) + topic_bytes + payload)
+        with self._lock:
+            targets = [c for c in self._clients
+                       if any(topic_matches(f, topic) for f in c.filters)]
+        for client in targets:
+            try:
+                client.send(packet)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    with FakeMQTTBroker(port=1883) as broker:
+        print(f"假MQTT代理运行在 {broker.host}:{broker.port}，Ctrl+C 退出")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass